@@ -0,0 +1,411 @@
+"""
+Control de admisión para las llamadas al modelo.
+
+Antes de cada llamada real al LLM (las resueltas por el camino rápido o la
+caché no pasan por aquí) el llamador pide turno con acquire(). El turno se
+concede cuando hay presupuesto en:
+
+- Los cubos globales de peticiones y tokens por minuto (el límite del plan de la API).
+- El cubo del usuario, para que nadie acapare el presupuesto compartido.
+
+Las peticiones en espera se ordenan por prioridad (los mensajes interactivos
+antes que los trabajos masivos) y, dentro de una prioridad, por turnos entre
+usuarios. Si la cola está llena, acquire() rechaza con AdmissionRejected o,
+para trabajos que pueden esperar, aplaza al llamador hasta que haya sitio.
+
+Todo el estado vive en el bucle de IA (app.ai.client), así que no necesita
+bloqueos: acquire() debe ejecutarse dentro de ese bucle.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from enum import IntEnum
+from typing import Deque, Dict, Optional, Tuple
+
+from app import metrics
+from app.ai import client
+from app.ai.resilience import LatencyTracker
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+_WAIT_SECONDS = metrics.Histogram(
+    "expense_admission_wait_seconds", "Espera en la cola de admisión hasta obtener turno.", ["priority"]
+)
+
+# Aproximación habitual de ~4 caracteres por token
+_CHARS_PER_TOKEN = 4
+
+# Usuarios inactivos cuyo cubo se descarta al superar este número
+_MAX_USER_BUCKETS = 10000
+
+
+class Priority(IntEnum):
+    """
+    Prioridad de una petición; un valor menor se atiende antes.
+    """
+    INTERACTIVE = 0
+    BULK = 1
+
+
+class AdmissionRejected(Exception):
+    """
+    Se lanza cuando la petición no puede admitirse (cola llena o espera excesiva).
+    """
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(*texts: str, completion: int = 150) -> int:
+    """
+    Estima los tokens de una llamada a partir de sus textos y de la respuesta esperada.
+    """
+    return sum(len(t) for t in texts) // _CHARS_PER_TOKEN + completion
+
+
+class TokenBucket:
+    """
+    Cubo de fichas: se rellena a `rate` fichas por segundo hasta `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Segundos hasta que haya `amount` fichas (0 si ya las hay).
+        """
+        self._refill(now)
+        # Una petición mayor que la capacidad solo necesita el cubo lleno
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("user_id", "requests", "tokens", "priority", "future", "enqueued_at")
+
+    def __init__(self, user_id: str, requests: float, tokens: int, priority: Priority, future: asyncio.Future):
+        self.user_id = user_id
+        self.requests = requests
+        self.tokens = tokens
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Cola de admisión con cubos globales y por usuario.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        user_requests_per_minute: float,
+        max_queue: int,
+        max_wait: float,
+    ):
+        self.requests = TokenBucket(requests_per_minute / 60.0, requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+        self.user_rate = user_requests_per_minute
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        # Por prioridad: usuario -> cola FIFO; el orden del OrderedDict es el turno entre usuarios
+        self._queues: Dict[Priority, "OrderedDict[str, Deque[_Waiter]]"] = {p: OrderedDict() for p in Priority}
+        self._user_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._depth = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.wait_times = {p: LatencyTracker() for p in Priority}
+        self.stats: Dict[str, int] = {"admitted": 0, "rejected_full": 0, "rejected_timeout": 0, "deferred": 0,
+                                     "hedges_admitted": 0, "hedges_refused": 0}
+
+    # --- API pública ---
+    async def acquire(
+        self,
+        user_id: Optional[str],
+        tokens: int,
+        priority: Priority = Priority.INTERACTIVE,
+        requests: float = 1.0,
+        defer_if_full: bool = False,
+    ) -> float:
+        """
+        Espera turno para una llamada al modelo.
+
+        Args:
+            user_id: Usuario que origina la llamada (None comparte un cubo anónimo).
+            tokens: Tokens estimados de la llamada (estimate_tokens).
+            priority: Prioridad de la petición.
+            requests: Peticiones que consume (fraccionario si la llamada se agrupa en un lote).
+            defer_if_full: Con la cola llena, esperar a que haya sitio en lugar de rechazar.
+
+        Returns:
+            Los segundos esperados en la cola.
+
+        Raises:
+            AdmissionRejected: Si la cola está llena o el turno no llega en max_wait segundos.
+        """
+        self._ensure_started()
+        if self._depth >= self.max_queue:
+            if not defer_if_full:
+                self.stats["rejected_full"] += 1
+                raise AdmissionRejected("La cola de IA está llena; inténtalo más tarde.", retry_after=self._retry_hint())
+            self.stats["deferred"] += 1
+            async with self._space:
+                await self._space.wait_for(lambda: self._depth < self.max_queue)
+
+        user_id = user_id or "anonymous"
+        waiter = _Waiter(user_id, requests, tokens, priority, asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(user_id, deque()).append(waiter)
+        self._depth += 1
+        self._wakeup.set()
+
+        # Los trabajos masivos pueden esperar lo que haga falta; los interactivos no
+        timeout = self.max_wait if priority == Priority.INTERACTIVE and self.max_wait > 0 else None
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected_timeout"] += 1
+            raise AdmissionRejected(
+                f"Sin turno de IA tras {self.max_wait:.0f}s; inténtalo más tarde.", retry_after=self._retry_hint()
+            )
+        finally:
+            if not waiter.future.done():
+                # Cancelado o expirado: se despierta al despachador para que lo descarte y libere su hueco
+                waiter.future.cancel()
+                self._wakeup.set()
+
+    def try_acquire(self, tokens: int, requests: float = 1.0) -> bool:
+        """
+        Concede turno sin esperar, o lo niega (para peticiones opcionales como las coberturas).
+
+        Solo concede si nadie espera en la cola y el presupuesto global alcanza:
+        una petición opcional nunca adelanta a las que esperan turno.
+        """
+        now = time.monotonic()
+        if self._depth > 0 or self.requests.wait_time(requests, now) > 0 or self.tokens.wait_time(tokens, now) > 0:
+            self.stats["hedges_refused"] += 1
+            return False
+        self.requests.take(requests)
+        self.tokens.take(tokens)
+        self.stats["hedges_admitted"] += 1
+        return True
+
+    def get_stats(self) -> Dict[str, object]:
+        """
+        Profundidad de la cola, esperas (p50/p95 en segundos) y contadores de admisión.
+        """
+        depth = {p.name.lower(): sum(len(q) for q in self._queues[p].values()) for p in Priority}
+        waits = {
+            p.name.lower(): {
+                "p50": round(self.wait_times[p].percentile(0.5), 4),
+                "p95": round(self.wait_times[p].percentile(0.95), 4),
+            }
+            for p in Priority
+        }
+        return {
+            "queue_depth": depth,
+            "queue_capacity": self.max_queue,
+            "wait_seconds": waits,
+            "waiting_users": len({u for p in Priority for u in self._queues[p]}),
+            **self.stats,
+        }
+
+    def queue_depths(self) -> Dict[str, int]:
+        """
+        Peticiones en espera por prioridad. A diferencia de get_stats, puede
+        llamarse desde otro hilo: solo toma copias atómicas de las colas.
+        """
+        return {p.name.lower(): sum(len(q) for q in list(self._queues[p].values())) for p in Priority}
+
+    # --- Despacho ---
+    def _ensure_started(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._space = asyncio.Condition()
+            self._dispatcher = asyncio.ensure_future(self._run())
+
+    def _retry_hint(self) -> float:
+        # Tiempo aproximado para vaciar la cola al ritmo global de peticiones
+        return max(1.0, round(self._depth / max(self.requests.rate, 1e-6), 1))
+
+    def _user_bucket(self, user_id: str) -> TokenBucket:
+        bucket = self._user_buckets.get(user_id)
+        if bucket is None:
+            bucket = self._user_buckets[user_id] = TokenBucket(self.user_rate / 60.0, max(1.0, self.user_rate / 6.0))
+            while len(self._user_buckets) > _MAX_USER_BUCKETS:
+                self._user_buckets.popitem(last=False)
+        else:
+            self._user_buckets.move_to_end(user_id)
+        return bucket
+
+    def _pick(self, now: float) -> Tuple[Optional[_Waiter], float]:
+        """
+        Elige la siguiente petición a admitir. Devuelve (petición, 0) o (None, segundos a esperar).
+
+        Por el camino descarta las peticiones canceladas; _run avisa de los huecos liberados.
+        """
+        wait = float("inf")
+        for priority in Priority:
+            queues = self._queues[priority]
+            for user_id in list(queues):
+                queue = queues[user_id]
+                while queue and queue[0].future.done():
+                    queue.popleft()
+                    self._depth -= 1
+                if not queue:
+                    del queues[user_id]
+                    continue
+                waiter = queue[0]
+                user_wait = self._user_bucket(user_id).wait_time(waiter.requests, now)
+                if user_wait > 0:
+                    # Este usuario agotó su parte; se atiende a los demás mientras tanto
+                    wait = min(wait, user_wait)
+                    continue
+                global_wait = max(
+                    self.requests.wait_time(waiter.requests, now),
+                    self.tokens.wait_time(waiter.tokens, now),
+                )
+                if global_wait > 0:
+                    # No adelantar peticiones de menor prioridad: esperar al presupuesto global
+                    return None, global_wait
+                queue.popleft()
+                if queue:
+                    queues.move_to_end(user_id)
+                else:
+                    del queues[user_id]
+                return waiter, 0.0
+        return None, wait
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            depth = self._depth
+            waiter, wait = self._pick(now)
+            if waiter is not None:
+                self._depth -= 1
+                self._user_bucket(waiter.user_id).take(waiter.requests)
+                self.requests.take(waiter.requests)
+                self.tokens.take(waiter.tokens)
+                waited = now - waiter.enqueued_at
+                self.wait_times[waiter.priority].add(waited)
+                _WAIT_SECONDS.observe(waited, waiter.priority.name.lower())
+                self.stats["admitted"] += 1
+                waiter.future.set_result(waited)
+            freed = depth - self._depth
+            if freed:
+                # Cada hueco liberado (admitido o descartado por cancelación) despierta a un llamador diferido
+                async with self._space:
+                    self._space.notify(freed)
+            if waiter is not None:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), None if wait == float("inf") else wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_controller() -> Optional[AdmissionController]:
+    """
+    Devuelve el controlador global, o None si la admisión está desactivada.
+    """
+    global _controller
+    if _controller is None and config.AI_ADMISSION_ENABLED:
+        _controller = AdmissionController(
+            requests_per_minute=config.AI_REQUESTS_PER_MINUTE,
+            tokens_per_minute=config.AI_TOKENS_PER_MINUTE,
+            user_requests_per_minute=config.AI_USER_REQUESTS_PER_MINUTE,
+            max_queue=config.AI_ADMISSION_QUEUE_SIZE,
+            max_wait=config.AI_ADMISSION_MAX_WAIT,
+        )
+    return _controller
+
+
+async def acquire(
+    user_id: Optional[str],
+    tokens: int,
+    priority: Priority = Priority.INTERACTIVE,
+    requests: float = 1.0,
+    defer_if_full: bool = False,
+) -> float:
+    """
+    Pide turno al controlador global; sin admisión configurada, concede de inmediato.
+    """
+    controller = get_controller()
+    if controller is None:
+        return 0.0
+    return await controller.acquire(user_id, tokens, priority, requests, defer_if_full)
+
+
+def try_acquire(tokens: int, requests: float = 1.0) -> bool:
+    """
+    Turno inmediato del controlador global, o False si habría que esperar. Sin admisión, siempre True.
+    """
+    controller = get_controller()
+    if controller is None:
+        return True
+    return controller.try_acquire(tokens, requests)
+
+
+async def _collect_stats() -> Dict[str, object]:
+    controller = get_controller()
+    return controller.get_stats() if controller is not None else {"enabled": False}
+
+
+async def aget_stats() -> Dict[str, object]:
+    """
+    Estadísticas de admisión, leídas dentro del bucle de IA que es dueño del estado.
+    """
+    return await client.run_async(_collect_stats())
+
+
+def get_stats() -> Dict[str, object]:
+    """
+    Versión síncrona de aget_stats. No debe llamarse desde el propio bucle de IA.
+    """
+    return client.run_sync(_collect_stats())
+
+
+def _queue_depth_samples() -> Dict[tuple, float]:
+    controller = _controller
+    if controller is None:
+        return {}
+    return {(priority,): depth for priority, depth in controller.queue_depths().items()}
+
+
+def _counter_samples() -> Dict[tuple, float]:
+    controller = _controller
+    if controller is None:
+        return {}
+    return {(result,): value for result, value in dict(controller.stats).items()}
+
+
+metrics.Gauge(
+    "expense_admission_queue_depth", "Llamadas al modelo esperando turno.", ["priority"], function=_queue_depth_samples
+)
+metrics.Counter(
+    "expense_admission_total",
+    "Decisiones de admisión: admitted, rejected_full, rejected_timeout o deferred.",
+    ["result"], function=_counter_samples,
+)
@@ -0,0 +1,76 @@
+"""
+Micro-lotes para llamadas al LLM provenientes de peticiones concurrentes.
+
+Las peticiones se acumulan durante una ventana corta (o hasta N elementos) y
+se envían juntas a un manejador que procesa la lista completa; cada llamador
+recibe únicamente su propio resultado. Debe usarse desde un único bucle de
+eventos (el bucle de IA).
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Agrupa elementos enviados con submit() y los entrega en lote al manejador.
+
+    El manejador recibe la lista de elementos y debe devolver una lista de
+    resultados del mismo tamaño y en el mismo orden.
+    """
+
+    def __init__(self, handler: Callable[[List[T]], Awaitable[List[R]]], window: float, max_items: int):
+        self.handler = handler
+        self.window = window
+        self.max_items = max(1, max_items)
+        self._pending: List[Tuple[T, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.stats: Dict[str, int] = {"batches": 0, "items": 0}
+
+    async def submit(self, item: T) -> R:
+        """
+        Encola un elemento y espera su resultado.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run(batch))
+        # Conservar una referencia para que la tarea no sea recolectada a medio camino
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[T, asyncio.Future]]) -> None:
+        self.stats["batches"] += 1
+        self.stats["items"] += len(batch)
+        try:
+            results = await self.handler([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"El manejador devolvió {len(results)} resultados para {len(batch)} elementos")
+        except Exception as e:
+            logger.error(f"Error al procesar un lote de {len(batch)} elementos: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
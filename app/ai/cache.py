@@ -0,0 +1,297 @@
+"""
+Caché de extracciones direccionada por contenido, delante del LLM.
+
+La clave es un hash del texto normalizado, de la versión del prompt del
+extractor y del nombre del modelo, así que cambiar cualquiera de ellos
+invalida las entradas anteriores de forma natural. Hay dos niveles:
+
+1. Un LRU en memoria del proceso.
+2. Un archivo SQLite local compartido entre workers y reinicios.
+
+El nivel SQLite tiene un hilo propio: las lecturas se esperan con aget() sin
+bloquear el bucle de IA, y las escrituras se encolan en ese hilo sin esperar.
+Solo la búsqueda en el LRU ocurre en el hilo del llamador.
+
+Ambos niveles aplican TTL y un tamaño máximo. Las fechas relativas se guardan
+como desplazamiento en días respecto al día de la extracción, de modo que
+"uber 120" extraído ayer sigue devolviendo la fecha de hoy.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+from app import metrics
+from app.ai.prompts import EXTRACTOR_PROMPT, BATCH_EXTRACTOR_PROMPT, LANGUAGE_HINT
+from app.config import config
+from app.preprocessing.normalize_text import normalize_text
+from app.schema.base import ExtractedExpense
+
+logger = logging.getLogger(__name__)
+
+# Ambos prompts (y la indicación de idioma) producen las mismas entradas, así que todos forman parte de la versión
+PROMPT_VERSION = hashlib.sha256(
+    (EXTRACTOR_PROMPT + BATCH_EXTRACTOR_PROMPT + LANGUAGE_HINT).encode("utf-8")
+).hexdigest()[:12]
+
+_MONTHS = (
+    "enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre|"
+    "ene|feb|mar|abr|may|jun|jul|ago|sep|oct|nov|dic|"
+    "january|february|march|april|june|july|august|september|october|november|december|"
+    "jan|apr|aug|dec"
+)
+# Fechas escritas de forma absoluta: con ellas la fecha extraída no depende del día actual
+_ABSOLUTE_DATE_RE = re.compile(
+    r"\b\d{4}-\d{1,2}-\d{1,2}\b"
+    r"|\b\d{1,2}[/.-]\d{1,2}(?:[/.-]\d{2,4})?\b"
+    rf"|\b\d{{1,2}}\s+(?:de\s+)?(?:{_MONTHS})\b"
+    rf"|\b(?:{_MONTHS})\.?\s+\d{{1,2}}\b"
+)
+
+# Cada cuántas escrituras se purga el nivel persistente
+_PRUNE_EVERY = 500
+
+
+def has_absolute_date(text: str) -> bool:
+    """
+    Indica si el texto contiene una fecha absoluta ("2025-03-01", "15/03", "3 de marzo").
+    """
+    return bool(_ABSOLUTE_DATE_RE.search(text))
+
+
+class ExtractionCache:
+    """
+    Caché de dos niveles (memoria + SQLite) para resultados del extractor.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, path: Optional[str], max_rows: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.stats: Dict[str, int] = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+        }
+
+        self._db = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if path:
+            try:
+                # La conexión solo se usa desde el hilo de self._executor
+                self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS extraction_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS ix_extraction_cache_created_at ON extraction_cache (created_at)"
+                )
+            except sqlite3.Error as e:
+                logger.error(f"No se pudo abrir la caché persistente de extracciones en {path}: {e}")
+                self._db = None
+        if self._db is not None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="extraction-cache")
+
+    @staticmethod
+    def make_key(text: str, model: str, normalized: bool = False, language: Optional[str] = None) -> str:
+        """
+        Calcula la clave de caché para un texto, un modelo y el idioma indicado al modelo.
+
+        Con normalized=True el texto ya pasó por normalize_text en la ingestión.
+        """
+        material = f"{PROMPT_VERSION}\x00{model}\x00{language or ''}\x00{text if normalized else normalize_text(text)}"
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _memory_get(self, key: str, text: str, now: float) -> Optional[ExtractedExpense]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return self._decode(value, text)
+                del self._memory[key]
+        return None
+
+    def _disk_result(self, key: str, text: str, row: Optional[tuple], now: float) -> Optional[ExtractedExpense]:
+        with self._lock:
+            if row is not None and now - row[1] <= self.ttl:
+                self._remember(key, row[1], row[0])
+                self.stats["disk_hits"] += 1
+                return self._decode(row[0], text)
+            self.stats["misses"] += 1
+            return None
+
+    def get(self, key: str, text: str) -> Optional[ExtractedExpense]:
+        """
+        Busca una extracción en la caché. Devuelve None si no existe o expiró.
+
+        Bloquea mientras lee el nivel SQLite: desde el bucle de IA debe usarse aget().
+        """
+        now = time.time()
+        found = self._memory_get(key, text, now)
+        if found is not None:
+            return found
+        row = self._executor.submit(self._disk_get, key).result() if self._executor is not None else None
+        return self._disk_result(key, text, row, now)
+
+    async def aget(self, key: str, text: str) -> Optional[ExtractedExpense]:
+        """
+        Como get(), pero espera la lectura del nivel SQLite en su hilo sin bloquear el bucle.
+        """
+        now = time.time()
+        found = self._memory_get(key, text, now)
+        if found is not None:
+            return found
+        row = None
+        if self._executor is not None:
+            row = await asyncio.get_running_loop().run_in_executor(self._executor, self._disk_get, key)
+        return self._disk_result(key, text, row, now)
+
+    def put(self, key: str, text: str, expense: ExtractedExpense) -> None:
+        """
+        Guarda una extracción exitosa en ambos niveles.
+
+        La escritura en SQLite se encola en el hilo de la caché; no se espera.
+        """
+        value = self._encode(expense, text)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            self.stats["stores"] += 1
+        if self._executor is not None:
+            self._executor.submit(self._disk_put, key, value, now)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self._executor is not None:
+            self._executor.submit(self._disk_clear).result()
+
+    def close(self) -> None:
+        """
+        Termina las escrituras pendientes y cierra el archivo SQLite.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._db.close()
+            self._db = None
+
+    # --- Nivel SQLite (solo en el hilo de self._executor) ---
+    def _disk_get(self, key: str) -> Optional[tuple]:
+        try:
+            return self._db.execute(
+                "SELECT value, created_at FROM extraction_cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"No se pudo leer la caché persistente de extracciones: {e}")
+            return None
+
+    def _disk_put(self, key: str, value: str, now: float) -> None:
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO extraction_cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, now),
+            )
+            self._writes += 1
+            if self._writes % _PRUNE_EVERY == 0:
+                self._prune(now)
+        except sqlite3.Error as e:
+            logger.warning(f"No se pudo escribir en la caché persistente de extracciones: {e}")
+
+    def _disk_clear(self) -> None:
+        self._db.execute("DELETE FROM extraction_cache")
+
+    def _remember(self, key: str, created_at: float, value: str) -> None:
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _prune(self, now: float) -> None:
+        """
+        Elimina entradas expiradas y, si sobran, las más antiguas del nivel persistente.
+        """
+        self._db.execute("DELETE FROM extraction_cache WHERE created_at < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM extraction_cache WHERE key IN ("
+            "SELECT key FROM extraction_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        )
+
+    @staticmethod
+    def _encode(expense: ExtractedExpense, text: str) -> str:
+        data = json.loads(expense.json(exclude={"raw_text"}))
+        date_offset = None
+        if expense.expense_date is not None and not has_absolute_date(text):
+            # Fecha relativa (o implícita "hoy"): guardar el desplazamiento, no la fecha
+            date_offset = (expense.expense_date - date.today()).days
+            data["expense_date"] = None
+        return json.dumps({"data": data, "date_offset": date_offset})
+
+    @staticmethod
+    def _decode(value: str, text: str) -> ExtractedExpense:
+        payload = json.loads(value)
+        data = payload["data"]
+        if payload.get("date_offset") is not None:
+            data["expense_date"] = date.today() + timedelta(days=payload["date_offset"])
+        data["raw_text"] = text
+        return ExtractedExpense(**data)
+
+
+_cache: Optional[ExtractionCache] = None
+
+
+def get_cache() -> Optional[ExtractionCache]:
+    """
+    Devuelve la caché global, o None si está desactivada.
+    """
+    global _cache
+    if _cache is None and config.EXTRACTION_CACHE_ENABLED:
+        path = config.EXTRACTION_CACHE_PATH or None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        _cache = ExtractionCache(
+            max_entries=config.EXTRACTION_CACHE_SIZE,
+            ttl=config.EXTRACTION_CACHE_TTL,
+            path=path,
+            max_rows=config.EXTRACTION_CACHE_MAX_ROWS,
+        )
+    return _cache
+
+
+def shutdown() -> None:
+    """
+    Cierra la caché global, esperando sus escrituras pendientes en SQLite.
+    """
+    global _cache
+    cache, _cache = _cache, None
+    if cache is not None:
+        cache.close()
+
+
+def _metric_samples() -> Dict[tuple, float]:
+    cache = _cache
+    return {(event,): value for event, value in dict(cache.stats).items()} if cache is not None else {}
+
+
+metrics.Counter(
+    "expense_extraction_cache_total",
+    "Eventos de la caché de extracciones: memory_hits, disk_hits, misses, stores y evictions.",
+    ["event"], function=_metric_samples,
+)
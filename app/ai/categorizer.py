@@ -0,0 +1,264 @@
+"""
+Categorizador local aprendido del historial de gastos confirmados.
+
+Se sitúa entre el matcher determinístico y el LLM: cuando ni providers.csv ni
+keywords.csv reconocen la descripción, se predice la combinación
+(categoría, subcategoría, tipo de gasto) que el usuario suele confirmar para
+descripciones parecidas, sin llamar a ningún modelo remoto.
+
+El modelo es un Naive Bayes multinomial sobre rasgos con hashing:
+
+- Palabras y pares de palabras de la descripción normalizada.
+- Trigramas de caracteres de cada palabra (tolera faltas de ortografía).
+- Las mismas palabras con el usuario como prefijo, de modo que cada usuario
+  aprende sus propias costumbres sobre el modelo común.
+
+Se entrena sin conexión con `python -m app.maintenance.train_categorizer` y se
+guarda como un JSON comprimido que cada proceso carga una sola vez. Solo se
+guardan los rasgos vistos en el entrenamiento, así que predecir consiste en
+unas decenas de búsquedas en diccionarios (bastante menos de un milisegundo).
+"""
+import gzip
+import json
+import logging
+import math
+import os
+import threading
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app import metrics
+from app.config import config
+from app.preprocessing.normalize_text import normalize_for_matching
+
+logger = logging.getLogger(__name__)
+
+MODEL_VERSION = 1
+
+# Tamaño del espacio de rasgos (2^18); las colisiones apenas afectan con este tamaño
+FEATURE_BITS = 18
+_FEATURE_MASK = (1 << FEATURE_BITS) - 1
+
+# Suavizado de Laplace
+_ALPHA = 0.1
+
+# Proporción de rasgos conocidos a partir de la cual la predicción no se penaliza
+_MIN_KNOWN_SHARE = 0.5
+
+# Etiquetas que no deben aprenderse: significan "sin clasificar"
+UNKNOWN_CATEGORIES = {"Por Determinar", ""}
+
+
+def _hash(feature: str) -> int:
+    # crc32 es estable entre procesos (hash() de Python usa una semilla aleatoria)
+    return zlib.crc32(feature.encode("utf-8")) & _FEATURE_MASK
+
+
+def features(description: str, user_id: Optional[str] = None, normalized: bool = False) -> List[int]:
+    """
+    Convierte una descripción en la lista de rasgos con hashing.
+
+    Args:
+        description: La descripción del gasto.
+        user_id: El usuario, para los rasgos personales.
+        normalized: True si la descripción ya pasó por normalize_for_matching.
+    """
+    text = description if normalized else normalize_for_matching(description)
+    words = text.split()
+    found = []
+    for i, word in enumerate(words):
+        found.append("w:" + word)
+        if i:
+            found.append("b:" + words[i - 1] + " " + word)
+        padded = f"#{word}#"
+        found.extend("c:" + padded[j:j + 3] for j in range(len(padded) - 2))
+        if user_id:
+            found.append(f"u:{user_id}:{word}")
+    return [_hash(f) for f in found]
+
+
+def label_of(category: str, subcategory: Optional[str], expense_type: Optional[str]) -> str:
+    return "\x1f".join((category or "", subcategory or "", expense_type or ""))
+
+
+class CategorizerModel:
+    """
+    Modelo entrenado: probabilidades a priori y log-verosimilitudes dispersas por rasgo.
+    """
+
+    def __init__(self, labels: List[str], priors: List[float], unseen: List[float], weights: Dict[int, Dict[int, float]]):
+        self.labels = labels
+        self.priors = priors
+        # log P(rasgo no visto | clase), igual para todos los rasgos no vistos de la clase
+        self.unseen = unseen
+        # rasgo -> {clase: log P(rasgo | clase) - unseen[clase]}
+        self.weights = weights
+
+    @classmethod
+    def train(cls, samples: Iterable[Tuple[List[int], str]]) -> "CategorizerModel":
+        """
+        Entrena el modelo a partir de pares (rasgos, etiqueta).
+        """
+        label_index: Dict[str, int] = {}
+        doc_counts: List[int] = []
+        feature_totals: List[int] = []
+        counts: Dict[int, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        for feats, label in samples:
+            c = label_index.setdefault(label, len(label_index))
+            if c == len(doc_counts):
+                doc_counts.append(0)
+                feature_totals.append(0)
+            doc_counts[c] += 1
+            feature_totals[c] += len(feats)
+            for f in feats:
+                counts[f][c] += 1
+
+        vocabulary = len(counts) or 1
+        total_docs = sum(doc_counts) or 1
+        priors = [math.log(n / total_docs) for n in doc_counts]
+        denominators = [math.log(total + _ALPHA * vocabulary) for total in feature_totals]
+        unseen = [math.log(_ALPHA) - d for d in denominators]
+        weights = {
+            f: {c: round(math.log(n + _ALPHA) - math.log(_ALPHA), 4) for c, n in by_class.items()}
+            for f, by_class in counts.items()
+        }
+        labels = [None] * len(label_index)
+        for label, c in label_index.items():
+            labels[c] = label
+        return cls(labels, priors, unseen, weights)
+
+    def predict(self, feats: List[int]) -> Tuple[Optional[str], float]:
+        """
+        Devuelve la etiqueta más probable y una confianza entre 0 y 1.
+
+        Los rasgos nunca vistos en el entrenamiento se ignoran. Si menos de
+        _MIN_KNOWN_SHARE de los rasgos son conocidos, la probabilidad posterior
+        se reduce en proporción: un texto casi desconocido no debe producir una
+        predicción segura.
+        """
+        known = [self.weights[f] for f in feats if f in self.weights]
+        if not known or not self.labels:
+            return None, 0.0
+        n = len(known)
+        scores = [p + n * u for p, u in zip(self.priors, self.unseen)]
+        for by_class in known:
+            for c, w in by_class.items():
+                scores[c] += w
+        best = max(range(len(scores)), key=scores.__getitem__)
+        top = scores[best]
+        posterior = 1.0 / sum(math.exp(s - top) for s in scores)
+        return self.labels[best], posterior * min(1.0, n / len(feats) / _MIN_KNOWN_SHARE)
+
+    def save(self, path: str) -> None:
+        """
+        Guarda el modelo como JSON comprimido, reemplazando el archivo de forma atómica.
+        """
+        payload = {
+            "version": MODEL_VERSION,
+            "feature_bits": FEATURE_BITS,
+            "labels": self.labels,
+            "priors": [round(p, 6) for p in self.priors],
+            "unseen": [round(u, 6) for u in self.unseen],
+            "weights": {str(f): {str(c): w for c, w in by_class.items()} for f, by_class in self.weights.items()},
+        }
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as fh:
+            json.dump(payload, fh, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CategorizerModel":
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            payload = json.load(fh)
+        if payload.get("version") != MODEL_VERSION or payload.get("feature_bits") != FEATURE_BITS:
+            raise ValueError("El modelo del categorizador es de una versión incompatible; vuelve a entrenarlo.")
+        weights = {
+            int(f): {int(c): w for c, w in by_class.items()}
+            for f, by_class in payload["weights"].items()
+        }
+        return cls(payload["labels"], payload["priors"], payload["unseen"], weights)
+
+
+_model: Optional[CategorizerModel] = None
+_loaded = False
+_load_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"predicted": 0, "abstained": 0}
+
+
+def load_model(path: Optional[str] = None) -> Optional[CategorizerModel]:
+    """
+    Carga (o recarga) el modelo desde disco. Devuelve None si no existe o no es válido.
+    """
+    global _model, _loaded
+    path = path or config.CATEGORIZER_MODEL_PATH
+    with _load_lock:
+        model = None
+        if path and os.path.exists(path):
+            try:
+                model = CategorizerModel.load(path)
+                logger.info(f"Categorizador cargado desde {path}: {len(model.labels)} etiquetas, {len(model.weights)} rasgos.")
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"No se pudo cargar el categorizador desde {path}: {e}")
+        _model = model
+        _loaded = True
+    return model
+
+
+def get_model() -> Optional[CategorizerModel]:
+    """
+    Devuelve el modelo del proceso, cargándolo la primera vez.
+    """
+    if not _loaded:
+        load_model()
+    return _model
+
+
+def get_metadata(description: str, user_id: Optional[str] = None, normalized: bool = False) -> Dict[str, Any]:
+    """
+    Predice la clasificación de una descripción con el modelo local.
+
+    Devuelve un diccionario con la misma forma que matcher.get_metadata_from_match
+    (match_type "learned" y la probabilidad en "score"), o {} si el categorizador
+    está desactivado, no hay modelo o la predicción no alcanza CATEGORIZER_MIN_CONFIDENCE.
+    """
+    if not config.CATEGORIZER_ENABLED or not description:
+        return {}
+    model = get_model()
+    if model is None:
+        return {}
+
+    label, probability = model.predict(features(description, user_id, normalized))
+    if label is None or probability < config.CATEGORIZER_MIN_CONFIDENCE:
+        with _stats_lock:
+            _stats["abstained"] += 1
+        return {}
+    with _stats_lock:
+        _stats["predicted"] += 1
+    category, subcategory, expense_type = label.split("\x1f")
+    return {
+        "category": category,
+        "subcategory": subcategory or None,
+        "expense_type": expense_type or None,
+        "match_type": "learned",
+        "matched_name": None,
+        "score": round(probability, 4),
+    }
+
+
+def get_stats() -> Dict[str, float]:
+    """
+    Devuelve cuántas descripciones sin coincidencia resolvió el categorizador.
+    """
+    with _stats_lock:
+        predicted, abstained = _stats["predicted"], _stats["abstained"]
+    total = predicted + abstained
+    return {"predicted": predicted, "abstained": abstained, "coverage": round(predicted / total, 4) if total else 0.0}
+
+
+metrics.Counter(
+    "expense_categorizer_total",
+    "Descripciones sin coincidencia evaluadas por el categorizador: predicted o abstained.",
+    ["result"], function=lambda: {(key,): value for key, value in get_stats().items() if key != "coverage"},
+)
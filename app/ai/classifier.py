@@ -1,42 +1,159 @@
 """
 Clasificación y puntuación de confianza impulsada por IA.
+
+La confianza se calcula localmente (app.ai.confidence). El modelo auditor solo
+se consulta para los gastos que caen en la banda de incertidumbre entre
+CONFIDENCE_REJECT_THRESHOLD y CONFIDENCE_ACCEPT_THRESHOLD; por encima se
+aceptan y por debajo van directo a revisión manual sin gastar una llamada.
 """
-import openai
 import json
 import logging
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, Optional
+
+import httpx
 
+from app import metrics
+from app.ai import admission, client, confidence, resilience
+from app.ai.admission import Priority
 from app.config import config
 from app.ai.prompts import AUDITOR_PROMPT
 from app.schema.base import ProvisionalExpense
 
-# Configure the OpenAI client
-openai.api_key = config.OPENAI_API_KEY
-
 logger = logging.getLogger(__name__)
 
-def classify_and_audit(expense: ProvisionalExpense) -> ProvisionalExpense:
+# --- Seguimiento de la tasa de llamadas al auditor ---
+_stats_lock = threading.Lock()
+_stats = {"scored": 0, "accepted_locally": 0, "rejected_locally": 0, "auditor_calls": 0, "auditor_failures": 0}
+
+
+def _record(key: str) -> None:
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def get_stats() -> Dict[str, float]:
+    """
+    Devuelve los contadores del clasificador y la proporción de gastos que necesitaron al auditor.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    scored = stats["scored"]
+    stats["auditor_call_rate"] = round(stats["auditor_calls"] / scored, 4) if scored else 0.0
+    return stats
+
+
+metrics.Counter(
+    "expense_classifier_total",
+    "Gastos puntuados y su destino: accepted_locally, rejected_locally, auditor_calls, auditor_failures.",
+    ["result"], function=lambda: {(key,): value for key, value in get_stats().items() if key != "auditor_call_rate"},
+)
+
+
+def _score_locally(
+    expense: ProvisionalExpense,
+    match_metadata: Optional[Dict[str, Any]],
+    amount_stats: Optional[Dict[str, Any]],
+) -> bool:
     """
-    Utiliza un modelo de IA para auditar un gasto extraído, proporcionando una puntuación
-    de confianza y notas. Este es un marcador de posición para una lógica de clasificación
-    y validación más compleja.
+    Asigna la confianza local. Devuelve True si el gasto cae en la banda incierta.
+    """
+    assessment = confidence.assess(expense.extracted_data.dict(), match_metadata, amount_stats)
+    expense.confidence_score = assessment.score
+    expense.validation_notes.extend(assessment.notes)
+    if match_metadata and match_metadata.get("category"):
+        expense.category = match_metadata["category"]
+        expense.subcategory = match_metadata.get("subcategory")
+    elif expense.extracted_data.category:
+        expense.category = expense.extracted_data.category
+
+    _record("scored")
+    if assessment.score >= config.CONFIDENCE_ACCEPT_THRESHOLD:
+        _record("accepted_locally")
+        expense.validation_notes.append(f"Confianza local {assessment.score}: aceptado sin auditor.")
+        return False
+    if assessment.score < config.CONFIDENCE_REJECT_THRESHOLD or not config.AUDITOR_ENABLED:
+        _record("rejected_locally")
+        expense.validation_notes.append(f"Confianza local {assessment.score}: sin auditor.")
+        return False
+    return True
+
+
+async def _audit(expense: ProvisionalExpense, priority: Priority) -> ProvisionalExpense:
+    """
+    Pide al modelo auditor una confianza para un gasto de la banda incierta.
+    Si el auditor no está disponible se conserva la confianza local.
+    """
+    _record("auditor_calls")
+    logger.info(f"Confianza local {expense.confidence_score} incierta; consultando al auditor.")
+    data = expense.extracted_data.dict(exclude={"raw_text"})
+    data["date"] = str(data.pop("expense_date") or "")
+    payload = json.dumps(data, ensure_ascii=False)
+    tokens = admission.estimate_tokens(AUDITOR_PROMPT, payload, completion=60)
+    try:
+        await admission.acquire(expense.user_id, tokens, priority, defer_if_full=priority == Priority.BULK)
+        response = await resilience.get_caller().call(lambda: client.chat_completion(
+            messages=[
+                {"role": "system", "content": AUDITOR_PROMPT},
+                {"role": "user", "content": payload}
+            ],
+            temperature=0.0,
+            response_format={"type": "json_object"},
+            purpose="audit",
+        ), tokens=tokens)
+        audit = json.loads(response["choices"][0]["message"]["content"])
+        expense.confidence_score = max(0.0, min(1.0, float(audit["confidence_score"])))
+        if audit.get("audit_notes"):
+            expense.validation_notes.append(f"Auditor: {audit['audit_notes']}")
+    except (resilience.CircuitOpenError, admission.AdmissionRejected) as e:
+        _record("auditor_failures")
+        logger.warning(str(e))
+        expense.validation_notes.append("Auditor no disponible; se conserva la confianza local.")
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        _record("auditor_failures")
+        logger.error(f"Respuesta inválida del auditor: {e}")
+        expense.validation_notes.append("Respuesta inválida del auditor; se conserva la confianza local.")
+    except httpx.HTTPError as e:
+        _record("auditor_failures")
+        logger.error(f"Error HTTP durante la auditoría por IA: {e}")
+        expense.validation_notes.append("Auditor no disponible; se conserva la confianza local.")
+    return expense
+
+
+async def aclassify_and_audit(
+    expense: ProvisionalExpense,
+    match_metadata: Optional[Dict[str, Any]] = None,
+    amount_stats: Optional[Dict[str, Any]] = None,
+    priority: Priority = Priority.INTERACTIVE,
+) -> ProvisionalExpense:
+    """
+    Puntúa un gasto extraído y, solo si la confianza local es incierta, lo audita con IA.
 
     Args:
         expense: Un objeto ProvisionalExpense con datos extraídos.
+        match_metadata: Resultado del matcher para la descripción, si lo hay.
+        amount_stats: Historial de montos del usuario (repositories.get_amount_stats).
+        priority: Prioridad de admisión de la llamada al auditor.
 
     Returns:
-        El mismo objeto ProvisionalExpense, actualizado con los hallazgos de la auditoría.
+        El mismo objeto ProvisionalExpense, actualizado con la confianza y las notas.
     """
-    logger.info(f"Iniciando auditoría por IA para el gasto: {expense.extracted_data.description}")
+    logger.info(f"Clasificando el gasto: {expense.extracted_data.description}")
+    if _score_locally(expense, match_metadata, amount_stats):
+        await client.run_async(_audit(expense, priority))
+    return expense
 
-    # Por ahora, esto es un marcador de posición. Una implementación real
-    # llamaría a un modelo de IA como en el extractor.
-    # Para la demostración, simplemente asignaremos una puntuación de confianza alta.
-    
-    expense.confidence_score = 0.95
-    expense.validation_notes.append("Marcador de posición de auditoría por IA: aprobado automáticamente.")
-    expense.processing_method = "ai_inference" # Asumir que se usó IA
 
-    logger.info("AI audit placeholder complete.")
-    
+def classify_and_audit(
+    expense: ProvisionalExpense,
+    match_metadata: Optional[Dict[str, Any]] = None,
+    amount_stats: Optional[Dict[str, Any]] = None,
+    priority: Priority = Priority.INTERACTIVE,
+) -> ProvisionalExpense:
+    """
+    Versión síncrona de aclassify_and_audit para código que no es asíncrono.
+    """
+    logger.info(f"Clasificando el gasto: {expense.extracted_data.description}")
+    if _score_locally(expense, match_metadata, amount_stats):
+        client.run_sync(_audit(expense, priority))
     return expense
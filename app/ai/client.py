@@ -0,0 +1,186 @@
+"""
+Cliente HTTP asíncrono y compartido para la API de OpenAI (o compatible).
+
+Todas las llamadas a modelos se ejecutan en un único bucle de eventos dedicado
+que corre en un hilo en segundo plano. Así el pool de conexiones, el límite de
+concurrencia y cualquier estado compartido viven en un solo bucle, y tanto el
+código asíncrono (FastAPI, Telegram) como el síncrono (scripts, trabajos de
+mantenimiento) pueden usarlos sin bloquear el bucle del llamador.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Dict, List, Optional, TypeVar
+
+import httpx
+
+from app import metrics, recording
+from app.ai import resilience
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+_LLM_SECONDS = metrics.Histogram(
+    "expense_llm_request_seconds",
+    "Duración de las llamadas a /chat/completions (sin la espera por el límite de concurrencia).",
+    ["purpose", "outcome"],
+)
+_LLM_TOKENS = metrics.Counter(
+    "expense_llm_tokens_total", "Tokens informados por el proveedor; kind prompt o completion.", ["purpose", "kind"]
+)
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+
+# Creados perezosamente dentro del bucle de IA
+_http_client: Optional[httpx.AsyncClient] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Devuelve el bucle de IA, arrancando su hilo la primera vez.
+    """
+    global _loop, _thread
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="ai-loop", daemon=True)
+                thread.start()
+                _thread = thread
+                _loop = loop
+    return _loop
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """
+    Ejecuta una corrutina en el bucle de IA y bloquea hasta obtener su resultado.
+    No debe llamarse desde el propio bucle de IA.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+async def run_async(coro: Awaitable[T]) -> T:
+    """
+    Ejecuta una corrutina en el bucle de IA y la espera sin bloquear el bucle actual.
+    """
+    loop = _get_loop()
+    try:
+        if asyncio.get_running_loop() is loop:
+            return await coro
+    except RuntimeError:
+        pass
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client, _semaphore
+    if _http_client is None:
+        headers = {"Authorization": f"Bearer {config.OPENAI_API_KEY}"} if config.OPENAI_API_KEY else {}
+        _http_client = httpx.AsyncClient(
+            base_url=config.OPENAI_BASE_URL,
+            headers=headers,
+            timeout=httpx.Timeout(config.AI_TIMEOUT, connect=config.AI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=config.AI_MAX_CONNECTIONS,
+                max_keepalive_connections=config.AI_MAX_CONNECTIONS,
+            ),
+        )
+        _semaphore = asyncio.Semaphore(config.AI_MAX_CONCURRENCY)
+    return _http_client
+
+
+async def chat_completion(
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    temperature: float = 0.0,
+    response_format: Optional[Dict[str, Any]] = None,
+    purpose: str = "other",
+) -> Dict[str, Any]:
+    """
+    Llama al endpoint /chat/completions y devuelve la respuesta JSON completa.
+
+    Debe ejecutarse en el bucle de IA (a través de run_sync o run_async).
+    Como máximo AI_MAX_CONCURRENCY llamadas están en vuelo a la vez; el resto espera.
+    Al obtener turno lo anuncia con resilience.mark_dispatched(): las latencias y
+    las coberturas de ResilientCaller no cuentan esa espera.
+    purpose solo etiqueta las métricas (extract, extract_batch, audit...).
+
+    Raises:
+        httpx.HTTPError: Si la petición falla o la respuesta no es 2xx.
+    """
+    client = _get_http_client()
+    payload: Dict[str, Any] = {
+        "model": model or config.OPENAI_MODEL,
+        "messages": messages,
+        "temperature": temperature,
+    }
+    if response_format:
+        payload["response_format"] = response_format
+
+    async with _semaphore:
+        resilience.mark_dispatched()
+        start = time.perf_counter()
+        try:
+            response = await client.post("/chat/completions", json=payload)
+        except httpx.HTTPError:
+            _LLM_SECONDS.observe(time.perf_counter() - start, purpose, "error")
+            raise
+        _LLM_SECONDS.observe(
+            time.perf_counter() - start, purpose, "ok" if response.is_success else f"http_{response.status_code}"
+        )
+    response.raise_for_status()
+    data = response.json()
+    usage = data.get("usage") or {}
+    for kind in ("prompt", "completion"):
+        tokens = usage.get(f"{kind}_tokens")
+        if tokens:
+            _LLM_TOKENS.inc(purpose, kind, amount=tokens)
+    if config.RECORD_LLM_PATH:
+        # Solo encola la línea: el hilo de grabación escribe en disco fuera del bucle de IA
+        try:
+            recording.record_llm(messages, data["choices"][0]["message"]["content"])
+        except (KeyError, IndexError, TypeError):
+            pass
+    return data
+
+
+def has_free_slot() -> bool:
+    """
+    True si una llamada nueva saldría sin esperar al límite de concurrencia.
+    """
+    return _semaphore is None or not _semaphore.locked()
+
+
+async def _aclose():
+    global _http_client, _semaphore
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        _semaphore = None
+
+
+def shutdown():
+    """
+    Cierra el pool de conexiones y detiene el bucle de IA.
+    """
+    global _loop, _thread
+    with _loop_lock:
+        if _loop is None:
+            return
+        loop, thread = _loop, _thread
+        try:
+            asyncio.run_coroutine_threadsafe(_aclose(), loop).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"Error al cerrar el cliente HTTP de IA: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
+        _loop = None
+        _thread = None
+    logger.info("Cliente de IA cerrado.")
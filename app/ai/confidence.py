@@ -1,16 +1,181 @@
 """
 Functions for calculating confidence scores.
+
+The score is computed locally, without calling any model, from four signals:
+
+- Field completeness (amount, description, date, currency, category).
+- Agreement between the extractor's category and the deterministic matcher.
+- How the amount compares with the user's history for the same provider/category.
+- Parse sanity checks (positive amount, plausible date and currency...).
+
+The classifier only asks the auditor model about items whose score falls in
+the uncertain band between the configured thresholds.
 """
+import re
+from datetime import date, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from app.preprocessing.normalize_text import normalize_for_matching
+from app.preprocessing.validators import is_valid_expense
+
+# Weight of each field in the completeness score (they add up to 1.0)
+_FIELD_WEIGHTS = {
+    "amount": 0.4,
+    "description": 0.25,
+    "expense_date": 0.1,
+    "currency": 0.1,
+    "category": 0.15,
+}
+
+# Category values that mean "the extractor did not know"
+_UNKNOWN_CATEGORIES = {"", "other", "otro", "otros", "por determinar"}
+
+_CURRENCY_RE = re.compile(r"^[A-Z]{3}$")
+
+# Amounts above this are almost always a parse error (a phone number, a date...)
+MAX_PLAUSIBLE_AMOUNT = 1_000_000
+
+# Minimum number of previous expenses before the user's history is trusted
+MIN_HISTORY = 5
+
+
+class ConfidenceAssessment(NamedTuple):
+    score: float
+    notes: List[str]
+
+
+def _known_category(value: Optional[str]) -> bool:
+    return bool(value) and normalize_for_matching(value) not in _UNKNOWN_CATEGORIES
+
+
+def _categories_agree(extracted: Optional[str], match_metadata: Dict[str, Any]) -> Optional[bool]:
+    """
+    Compares the extractor's category with the matcher's category and subcategory.
+    Returns None when there is nothing to compare.
+    """
+    matched = [match_metadata.get("category"), match_metadata.get("subcategory")]
+    matched = [normalize_for_matching(m) for m in matched if _known_category(m)]
+    if not matched or not _known_category(extracted):
+        return None
+    extracted = normalize_for_matching(extracted)
+    return any(extracted == m or extracted in m or m in extracted for m in matched)
 
-def calculate_confidence(extracted_data: dict) -> float:
+
+def _amount_outlier(amount: float, amount_stats: Dict[str, Any]) -> Optional[bool]:
+    """
+    Checks the amount against the user's history (count, mean, stddev, min, max).
+    Returns None when the history is too short to say anything.
+    """
+    if not amount_stats or (amount_stats.get("count") or 0) < MIN_HISTORY:
+        return None
+    mean = amount_stats["mean"]
+    stddev = amount_stats.get("stddev") or 0.0
+    low, high = amount_stats["min"], amount_stats["max"]
+    if low / 3 <= amount <= high * 3:
+        return False
+    if stddev > 0:
+        return abs(amount - mean) / stddev > 3
+    return True
+
+
+def assess(
+    extracted_data: Dict[str, Any],
+    match_metadata: Optional[Dict[str, Any]] = None,
+    amount_stats: Optional[Dict[str, Any]] = None,
+    today: Optional[date] = None,
+) -> ConfidenceAssessment:
+    """
+    Scores an extraction between 0 and 1 and explains the adjustments.
+
+    Args:
+        extracted_data: The extracted expense as a dict (ExtractedExpense.dict()).
+        match_metadata: The matcher result for the description, if any.
+        amount_stats: The user's amount statistics for the matched provider/category,
+            as returned by repositories.get_amount_stats.
+        today: Reference date for the date checks; defaults to today.
+
+    Returns:
+        A ConfidenceAssessment with the score and human-readable notes.
+    """
+    match_metadata = match_metadata or {}
+    today = today or date.today()
+    notes: List[str] = []
+
+    # --- Completeness ---
+    present = {field: bool(extracted_data.get(field)) for field in _FIELD_WEIGHTS}
+    present["category"] = _known_category(extracted_data.get("category")) or bool(match_metadata.get("category"))
+    score = sum(weight for field, weight in _FIELD_WEIGHTS.items() if present[field])
+    # Bonuses can only top the score up to 1.0; penalties are applied afterwards
+    bonus = penalty = 0.0
+    missing = [field for field, ok in present.items() if not ok]
+    if missing:
+        notes.append(f"Missing fields: {', '.join(missing)}.")
+
+    # --- Matcher agreement ---
+    match_type = match_metadata.get("match_type")
+    if match_type == "provider":
+        bonus += 0.05
+    elif not match_type:
+        penalty += 0.1
+        notes.append("No known provider or keyword.")
+    agree = _categories_agree(extracted_data.get("category"), match_metadata)
+    if agree is True:
+        bonus += 0.05
+    elif agree is False:
+        penalty += 0.15
+        notes.append(
+            f"Extractor category '{extracted_data.get('category')}' disagrees with matcher "
+            f"category '{match_metadata.get('category')}'."
+        )
+
+    # --- User's usual amounts ---
+    amount = extracted_data.get("amount")
+    if amount:
+        outlier = _amount_outlier(amount, amount_stats)
+        if outlier is True:
+            penalty += 0.25
+            notes.append(
+                f"Amount {amount} is unusual for this user (usual range "
+                f"{amount_stats['min']}-{amount_stats['max']})."
+            )
+        elif outlier is False:
+            bonus += 0.05
+
+    # --- Sanity checks ---
+    if amount is not None and not is_valid_expense(extracted_data):
+        penalty += 0.5
+        notes.append("Amount is not positive.")
+    elif amount and amount > MAX_PLAUSIBLE_AMOUNT:
+        penalty += 0.3
+        notes.append("Amount is implausibly large.")
+    expense_date = extracted_data.get("expense_date")
+    if isinstance(expense_date, date):
+        if expense_date > today + timedelta(days=1):
+            penalty += 0.3
+            notes.append("Date is in the future.")
+        elif expense_date < today - timedelta(days=365):
+            penalty += 0.1
+            notes.append("Date is more than a year old.")
+    currency = extracted_data.get("currency")
+    if currency and not _CURRENCY_RE.match(currency):
+        penalty += 0.2
+        notes.append(f"Unrecognized currency '{currency}'.")
+    description = extracted_data.get("description")
+    if description and not any(ch.isalpha() for ch in description):
+        penalty += 0.2
+        notes.append("Description has no words.")
+
+    score = min(1.0, score + bonus) - penalty
+    return ConfidenceAssessment(round(max(0.0, score), 2), notes)
+
+
+def calculate_confidence(
+    extracted_data: dict,
+    match_metadata: Optional[dict] = None,
+    amount_stats: Optional[dict] = None,
+) -> float:
     """
     Calculates a confidence score based on the quality of the extracted data.
-    Stub function.
-    """
-    score = 1.0
-    # Lower score if key fields are missing
-    if not extracted_data.get("amount"):
-        score -= 0.5
-    if not extracted_data.get("description"):
-        score -= 0.3
-    return max(0.0, score)
+    See assess() for the signals involved.
+    """
+    return assess(extracted_data, match_metadata, amount_stats).score
@@ -1,60 +1,291 @@
 """
 Extracción de datos impulsada por IA a partir de texto sin procesar.
 """
-import openai
+import asyncio
 import json
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
+import httpx
+
+from app import metrics
+from app.ai import admission, client, fast_path, resilience
+from app.ai.admission import Priority
+from app.ai.batcher import MicroBatcher
+from app.ai.cache import get_cache
 from app.config import config
-from app.ai.prompts import EXTRACTOR_PROMPT
+from app.ai.prompts import EXTRACTOR_PROMPT, BATCH_EXTRACTOR_PROMPT, LANGUAGE_HINT, LANGUAGE_NAMES
+from app.preprocessing.language_detect import detect_language
 from app.schema.base import ExtractedExpense
 
-# Configure the OpenAI client
-openai.api_key = config.OPENAI_API_KEY
-
 logger = logging.getLogger(__name__)
 
-def extract_expense_data(text: str) -> ExtractedExpense:
+# Se crea perezosamente dentro del bucle de IA
+_batcher: Optional[MicroBatcher] = None
+
+_EXTRACTION_TOTAL = metrics.Counter(
+    "expense_extraction_total",
+    "Extracciones por origen: fast_path, cache, llm o fast_path_fallback (el LLM falló).",
+    ["source"],
+)
+
+def _parse_content(content: str, text: str) -> ExtractedExpense:
+    """
+    Convierte el contenido JSON devuelto por el modelo en un ExtractedExpense.
     """
-    Utiliza un modelo de IA para extraer datos de gastos estructurados de una cadena de texto sin procesar.
+    extracted_data: Dict[str, Any] = json.loads(content)
+    logger.info(f"Extracción por IA exitosa. JSON sin procesar: {extracted_data}")
+    return _to_expense(extracted_data, text)
 
-    Args:
-        text: El texto sin procesar de la entrada del usuario, OCR o transcripción.
+def _to_expense(extracted_data: Dict[str, Any], text: str) -> ExtractedExpense:
+    """
+    Construye un ExtractedExpense a partir del diccionario devuelto por el modelo.
+    """
+    # El prompt pide "date"; el modelo de datos usa "expense_date"
+    if "date" in extracted_data and "expense_date" not in extracted_data:
+        extracted_data["expense_date"] = extracted_data.pop("date")
+
+    # Añadir el texto original al modelo para fines de auditoría
+    extracted_data['raw_text'] = text
+    return ExtractedExpense(**extracted_data)
+
+# Orígenes cuya descripción es un fragmento del texto ya normalizado
+NORMALIZED_SOURCES = ("fast_path", "fast_path_fallback")
+
+def _language_messages(language: Optional[str]) -> List[Dict[str, str]]:
+    """
+    Mensaje de sistema con el idioma detectado de la entrada, si es uno conocido.
+    """
+    name = LANGUAGE_NAMES.get(language)
+    return [{"role": "system", "content": LANGUAGE_HINT.format(language=name)}] if name else []
+
+async def _extract(
+    text: str,
+    user_id: Optional[str] = None,
+    priority: Priority = Priority.INTERACTIVE,
+    normalized: bool = False,
+    language: Optional[str] = None,
+) -> Tuple[ExtractedExpense, str]:
+    """
+    Núcleo de la extracción. Se ejecuta en el bucle de IA.
+
+    Orden: camino rápido determinístico (matcher y categorizador aprendido) ->
+    caché de extracciones -> admisión -> LLM. Sin language, el idioma se
+    detecta aquí; el pipeline lo detecta antes sobre el texto original.
 
     Returns:
-        Un objeto ExtractedExpense con los datos encontrados por la IA.
+        El gasto extraído y su origen: fast_path, cache, llm o fast_path_fallback.
+
+    Raises:
+        AdmissionRejected: Si no hay turno para llamar al modelo.
+    """
+    fast = None
+    if config.FAST_PATH_ENABLED:
+        fast = fast_path.parse(text, user_id=user_id, normalized=normalized)
+        handled_locally = fast.confidence >= config.FAST_PATH_MIN_CONFIDENCE
+        fast_path.record(handled_locally)
+        if handled_locally:
+            logger.info(f"Extracción resuelta por el camino rápido (confianza {fast.confidence}).")
+            _EXTRACTION_TOTAL.inc("fast_path")
+            return fast.expense, "fast_path"
+
+    language = language or detect_language(text)
+    cache = get_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(text, config.OPENAI_MODEL, normalized=normalized, language=language)
+        cached = await cache.aget(cache_key, text)
+        if cached is not None:
+            logger.info("Extracción servida desde la caché.")
+            _EXTRACTION_TOTAL.inc("cache")
+            return cached, "cache"
+
+    # Solo las llamadas reales al modelo consumen presupuesto; en un lote, cada texto paga su parte
+    await admission.acquire(
+        user_id,
+        admission.estimate_tokens(EXTRACTOR_PROMPT, text),
+        priority,
+        requests=1.0 / config.AI_BATCH_MAX_ITEMS if config.AI_BATCH_ENABLED else 1.0,
+        defer_if_full=priority == Priority.BULK,
+    )
+    extracted = await _extract_with_llm(text, language)
+    if extracted.amount and extracted.description:
+        # Solo se guardan extracciones útiles; los fallos deben reintentarse
+        if cache is not None:
+            cache.put(cache_key, text, extracted)
+    elif fast is not None and fast.expense.amount and fast.expense.description:
+        # Si el LLM falla, el resultado parcial del camino rápido es mejor que nada
+        logger.warning("El LLM no devolvió datos útiles; se usa el resultado del camino rápido.")
+        _EXTRACTION_TOTAL.inc("fast_path_fallback")
+        return fast.expense, "fast_path_fallback"
+    _EXTRACTION_TOTAL.inc("llm")
+    return extracted, "llm"
+
+async def _extract_expense(
+    text: str, user_id: Optional[str], priority: Priority, normalized: bool, language: Optional[str]
+) -> ExtractedExpense:
+    return (await _extract(text, user_id, priority, normalized, language))[0]
+
+async def _extract_with_llm(text: str, language: Optional[str] = None) -> ExtractedExpense:
+    """
+    Llama al modelo, agrupando la petición en un micro-lote si está activado.
+    """
+    global _batcher
+    if not config.AI_BATCH_ENABLED:
+        return await _extract_single(text, language)
+    if _batcher is None:
+        _batcher = MicroBatcher(_extract_batch, config.AI_BATCH_WINDOW_MS / 1000.0, config.AI_BATCH_MAX_ITEMS)
+    return await _batcher.submit((text, language))
+
+async def _extract_batch(entries: List[Tuple[str, Optional[str]]]) -> List[ExtractedExpense]:
+    """
+    Extrae varios textos (con su idioma detectado) con una sola llamada al modelo.
+
+    El modelo responde con un arreglo "items" indexado. Los elementos que falten
+    o vengan malformados (o el lote entero si la respuesta no es válida) se
+    reintentan con llamadas individuales.
+    """
+    if len(entries) == 1:
+        return [await _extract_single(*entries[0])]
+
+    texts = [text for text, _ in entries]
+    payload = []
+    for index, (text, language) in enumerate(entries):
+        entry = {"index": index, "text": text}
+        if language in LANGUAGE_NAMES:
+            entry["language"] = language
+        payload.append(entry)
+
+    logger.info(f"Iniciando extracción por IA en lote de {len(texts)} textos.")
+    results: List[Optional[ExtractedExpense]] = [None] * len(texts)
+    try:
+        response = await resilience.get_caller().call(lambda: client.chat_completion(
+            messages=[
+                {"role": "system", "content": BATCH_EXTRACTOR_PROMPT},
+                {"role": "user", "content": json.dumps({"items": payload}, ensure_ascii=False)}
+            ],
+            temperature=0.0,
+            response_format={"type": "json_object"},
+            purpose="extract_batch",
+        ), tokens=admission.estimate_tokens(BATCH_EXTRACTOR_PROMPT, *texts, completion=150 * len(texts)))
+        items = json.loads(response["choices"][0]["message"]["content"])["items"]
+        for item in items:
+            index = item.pop("index", None)
+            if isinstance(index, int) and 0 <= index < len(texts) and results[index] is None:
+                try:
+                    results[index] = _to_expense(item, texts[index])
+                except Exception as e:
+                    logger.warning(f"Elemento {index} del lote malformado: {e}")
+    except resilience.CircuitOpenError as e:
+        # Con el proveedor caído, las llamadas individuales también fallarían de inmediato
+        logger.warning(f"{e} Lote de {len(texts)} textos sin extracción por IA.")
+        return [ExtractedExpense(raw_text=t) for t in texts]
+    except Exception as e:
+        logger.error(f"Respuesta de lote inválida; se recurre a llamadas individuales: {e}")
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        singles = await asyncio.gather(*(_extract_single(*entries[i]) for i in missing))
+        for i, result in zip(missing, singles):
+            results[i] = result
+    return results
+
+async def _extract_single(text: str, language: Optional[str] = None) -> ExtractedExpense:
+    """
+    Llama al modelo para extraer los datos de un único gasto.
     """
     logger.info(f"Iniciando extracción por IA para el texto: '{text[:100]}...'")
-    
+
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",  # Or another suitable model
+        response = await resilience.get_caller().call(lambda: client.chat_completion(
             messages=[
                 {"role": "system", "content": EXTRACTOR_PROMPT},
+                *_language_messages(language),
                 {"role": "user", "content": text}
             ],
             temperature=0.0,
-            response_format={"type": "json_object"}
-        )
-
-        # La respuesta de OpenAI debería ser una cadena JSON en el contenido del mensaje
-        json_response = response.choices[0].message['content']
-        extracted_data = json.loads(json_response)
-        
-        logger.info(f"Extracción por IA exitosa. JSON sin procesar: {extracted_data}")
-
-        # Añadir el texto original al modelo para fines de auditoría
-        extracted_data['raw_text'] = text
+            response_format={"type": "json_object"},
+            purpose="extract",
+        ), tokens=admission.estimate_tokens(EXTRACTOR_PROMPT, text))
 
-        return ExtractedExpense(**extracted_data)
+        # La respuesta debería ser una cadena JSON en el contenido del mensaje
+        return _parse_content(response["choices"][0]["message"]["content"], text)
 
     except json.JSONDecodeError as e:
         logger.error(f"Error al decodificar JSON de la respuesta de la IA: {e}")
         # Devolver un modelo con solo el texto sin procesar para revisión manual
         return ExtractedExpense(raw_text=text)
+    except resilience.CircuitOpenError as e:
+        # Fallar rápido: el llamador recurre al camino rápido o a revisión manual
+        logger.warning(str(e))
+        return ExtractedExpense(raw_text=text)
+    except httpx.HTTPError as e:
+        logger.error(f"Error HTTP durante la extracción por IA: {e}")
+        return ExtractedExpense(raw_text=text)
     except Exception as e:
         logger.error(f"Ocurrió un error inesperado durante la extracción por IA: {e}")
         # Devolver un modelo con solo el texto sin procesar
         return ExtractedExpense(raw_text=text)
 
+async def aextract_expense_data(
+    text: str,
+    user_id: Optional[str] = None,
+    priority: Priority = Priority.INTERACTIVE,
+    normalized: bool = False,
+    language: Optional[str] = None,
+) -> ExtractedExpense:
+    """
+    Utiliza un modelo de IA para extraer datos de gastos estructurados de una cadena de texto sin procesar,
+    sin bloquear el bucle de eventos del llamador.
+
+    Args:
+        text: El texto sin procesar de la entrada del usuario, OCR o transcripción.
+        user_id: Usuario que envía el gasto, para repartir el presupuesto de IA.
+        priority: Prioridad de admisión (interactiva o masiva).
+        normalized: True si el texto ya pasó por normalize_text (la ingestión lo hace).
+        language: Idioma de la entrada ("es", "en"); si falta, se detecta sobre el texto.
+
+    Returns:
+        Un objeto ExtractedExpense con los datos encontrados por la IA.
+
+    Raises:
+        AdmissionRejected: Si la cola de IA está llena o la espera es excesiva.
+    """
+    return await client.run_async(_extract_expense(text, user_id, priority, normalized, language))
+
+async def aextract_with_source(
+    text: str,
+    user_id: Optional[str] = None,
+    priority: Priority = Priority.INTERACTIVE,
+    normalized: bool = False,
+    language: Optional[str] = None,
+) -> Tuple[ExtractedExpense, str]:
+    """
+    Como aextract_expense_data, pero devuelve también el origen de la extracción.
+
+    El pipeline lo usa para saber si la descripción ya está normalizada
+    (origen en NORMALIZED_SOURCES) y no volver a normalizarla.
+    """
+    return await client.run_async(_extract(text, user_id, priority, normalized, language))
+
+def extract_expense_data(
+    text: str,
+    user_id: Optional[str] = None,
+    priority: Priority = Priority.INTERACTIVE,
+    normalized: bool = False,
+    language: Optional[str] = None,
+) -> ExtractedExpense:
+    """
+    Versión síncrona de aextract_expense_data para código que no es asíncrono.
+
+    Args:
+        text: El texto sin procesar de la entrada del usuario, OCR o transcripción.
+        user_id: Usuario que envía el gasto, para repartir el presupuesto de IA.
+        priority: Prioridad de admisión (interactiva o masiva).
+        normalized: True si el texto ya pasó por normalize_text.
+        language: Idioma de la entrada ("es", "en"); si falta, se detecta sobre el texto.
+
+    Returns:
+        Un objeto ExtractedExpense con los datos encontrados por la IA.
+    """
+    return client.run_sync(_extract_expense(text, user_id, priority, normalized, language))
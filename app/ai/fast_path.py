@@ -0,0 +1,280 @@
+"""
+Extractor determinístico para mensajes simples ("comida 250 mxn", "uber 120").
+
+Antes de pagar una llamada al LLM se intenta leer el monto, la moneda y la
+fecha con expresiones regulares; el resto del texto se toma como descripción y
+se enriquece con el matcher de proveedores/palabras clave. El resultado lleva
+una confianza y el extractor solo recurre al LLM cuando el camino rápido no
+está seguro.
+"""
+import re
+import threading
+from datetime import date, timedelta
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from app import metrics
+from app.ai import categorizer
+from app.config import config
+from app.preprocessing import matcher
+from app.preprocessing.normalize_text import normalize_text, normalize_for_matching
+from app.schema.base import ExtractedExpense
+
+# --- Moneda ---
+_CURRENCY_WORDS = {
+    "mxn": "MXN", "peso": "MXN", "pesos": "MXN",
+    "usd": "USD", "dolar": "USD", "dolares": "USD", "dollar": "USD", "dollars": "USD", "bucks": "USD",
+    "eur": "EUR", "euro": "EUR", "euros": "EUR",
+}
+_CURRENCY_SYMBOLS = {"us$": "USD", "mx$": "MXN", "€": "EUR", "$": None}  # "$" usa config.DEFAULT_CURRENCY
+
+_CURRENCY_WORD_ALT = "|".join(sorted(_CURRENCY_WORDS, key=len, reverse=True))
+_SYMBOL_ALT = r"us\$|mx\$|€|\$"
+_NUMBER = r"\d{1,3}(?:[.,]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?"
+
+# La moneda puede ir pegada al número ("250mxn", "250€"); sin moneda, el número no
+# debe continuar en una palabra o una fecha ("3er", "15/03")
+_AMOUNT_RE = re.compile(
+    rf"(?P<prefix>{_SYMBOL_ALT})?\s?(?<![\w.,])(?P<number>{_NUMBER})"
+    rf"(?:\s?(?P<suffix>{_SYMBOL_ALT}|(?:{_CURRENCY_WORD_ALT})\b)|(?![\w/]))"
+)
+_BARE_CURRENCY_RE = re.compile(rf"\b(?:{_CURRENCY_WORD_ALT})\b")
+
+# --- Fechas ---
+_MONTHS = {
+    "enero": 1, "ene": 1, "january": 1, "jan": 1,
+    "febrero": 2, "feb": 2, "february": 2,
+    "marzo": 3, "mar": 3, "march": 3,
+    "abril": 4, "abr": 4, "april": 4, "apr": 4,
+    "mayo": 5, "may": 5,
+    "junio": 6, "jun": 6, "june": 6,
+    "julio": 7, "jul": 7, "july": 7,
+    "agosto": 8, "ago": 8, "august": 8, "aug": 8,
+    "septiembre": 9, "setiembre": 9, "sep": 9, "sept": 9, "september": 9,
+    "octubre": 10, "oct": 10, "october": 10,
+    "noviembre": 11, "nov": 11, "november": 11,
+    "diciembre": 12, "dic": 12, "december": 12, "dec": 12,
+}
+_WEEKDAYS = {
+    "lunes": 0, "monday": 0, "martes": 1, "tuesday": 1, "miercoles": 2, "wednesday": 2,
+    "jueves": 3, "thursday": 3, "viernes": 4, "friday": 4, "sabado": 5, "saturday": 5,
+    "domingo": 6, "sunday": 6,
+}
+_RELATIVE_DAYS = {
+    "hoy": 0, "today": 0, "tonight": 0, "esta noche": 0, "hoy en la manana": 0, "this morning": 0,
+    "ayer": -1, "yesterday": -1, "anoche": -1, "last night": -1,
+    "antier": -2, "anteayer": -2, "antes de ayer": -2, "day before yesterday": -2,
+    "the day before yesterday": -2,
+}
+_MONTH_ALT = "|".join(sorted(_MONTHS, key=len, reverse=True))
+_WEEKDAY_ALT = "|".join(_WEEKDAYS)
+_RELATIVE_ALT = "|".join(sorted((re.escape(k) for k in _RELATIVE_DAYS), key=len, reverse=True))
+
+_DATE_PATTERNS = (
+    ("iso", re.compile(r"\b(?P<y>\d{4})-(?P<m>\d{1,2})-(?P<d>\d{1,2})\b")),
+    ("dmy", re.compile(r"\b(?P<d>\d{1,2})[/.-](?P<m>\d{1,2})(?:[/.-](?P<y>\d{2,4}))?\b")),
+    ("d_month", re.compile(rf"\b(?P<d>\d{{1,2}})\s+(?:de\s+)?(?P<month>{_MONTH_ALT})\b\.?(?:\s+(?:de\s+)?(?P<y>\d{{4}}))?")),
+    ("month_d", re.compile(rf"\b(?P<month>{_MONTH_ALT})\.?\s+(?P<d>\d{{1,2}})\b(?:,?\s+(?P<y>\d{{4}}))?")),
+    ("ago", re.compile(r"\b(?:hace\s+(?P<n1>\d{1,2})\s+dias?|(?P<n2>\d{1,2})\s+days?\s+ago)\b")),
+    ("weekday", re.compile(rf"\b(?:el\s+|last\s+|on\s+)?(?P<weekday>{_WEEKDAY_ALT})(?:\s+pasado)?\b")),
+    ("relative", re.compile(rf"\b(?:{_RELATIVE_ALT})\b")),
+)
+
+# Palabras de relleno que no aportan a la descripción cuando quedan en los bordes
+_FILLER = {
+    "de", "del", "en", "por", "para", "con", "el", "la", "los", "las", "un", "una", "y", "a", "al",
+    "gaste", "pague", "compre", "spent", "paid", "bought", "on", "for", "at", "in", "of", "the", "and",
+}
+# Un token con algún dígito ("3er", "2x1", "500ml") es un ordinal, una unidad o un código: no va a la descripción
+_TOKEN_RE = re.compile(r"[\w'&-]+")
+_DIGIT_RE = re.compile(r"\d")
+_SPACES_RE = re.compile(r"\s+")
+
+# Mensajes más largos suelen ser frases complejas que el LLM resuelve mejor
+_MAX_SIMPLE_WORDS = 8
+
+
+class FastPathResult(NamedTuple):
+    expense: ExtractedExpense
+    confidence: float
+    match_metadata: Dict
+
+
+def _parse_number(raw: str) -> Optional[float]:
+    """
+    Interpreta separadores de miles y decimales: "1,234.56", "1.234,56", "250,50", "1,500".
+    """
+    if "," in raw and "." in raw:
+        decimal = "," if raw.rfind(",") > raw.rfind(".") else "."
+        thousands = "." if decimal == "," else ","
+        raw = raw.replace(thousands, "").replace(decimal, ".")
+    elif "," in raw or "." in raw:
+        sep = "," if "," in raw else "."
+        groups = raw.split(sep)
+        if len(groups) > 2 or len(groups[-1]) == 3:
+            raw = raw.replace(sep, "")          # separador de miles
+        else:
+            raw = raw.replace(sep, ".")         # separador decimal
+    try:
+        return float(raw)
+    except ValueError:
+        return None
+
+
+def _safe_date(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _parse_date(text: str, today: date) -> Tuple[Optional[date], Optional[Tuple[int, int]]]:
+    """
+    Busca una fecha absoluta o relativa. Devuelve la fecha y el tramo del texto que ocupa.
+    """
+    for kind, pattern in _DATE_PATTERNS:
+        match = pattern.search(text)
+        if not match:
+            continue
+        groups = match.groupdict()
+        if kind in ("iso", "dmy", "d_month", "month_d"):
+            month = _MONTHS[groups["month"]] if groups.get("month") else int(groups["m"])
+            year = groups.get("y")
+            year = int(year) + (2000 if len(year) == 2 else 0) if year else today.year
+            found = _safe_date(year, month, int(groups["d"]))
+            # Sin año explícito, una fecha futura se refiere al año anterior
+            if found and not groups.get("y") and found > today:
+                found = _safe_date(year - 1, month, int(groups["d"]))
+        elif kind == "ago":
+            found = today - timedelta(days=int(groups["n1"] or groups["n2"]))
+        elif kind == "weekday":
+            delta = (today.weekday() - _WEEKDAYS[groups["weekday"]]) % 7
+            found = today - timedelta(days=delta)
+        else:
+            found = today + timedelta(days=_RELATIVE_DAYS[match.group(0)])
+        if found:
+            return found, match.span()
+    return None, None
+
+
+def _remove_span(text: str, span: Optional[Tuple[int, int]]) -> str:
+    if not span:
+        return text
+    return text[:span[0]] + " " + text[span[1]:]
+
+
+def _clean_description(text: str) -> str:
+    words = [
+        word for word in (token.strip("'&-_") for token in _TOKEN_RE.findall(text))
+        if word and not _DIGIT_RE.search(word)
+    ]
+    while words and words[0] in _FILLER:
+        words.pop(0)
+    while words and words[-1] in _FILLER:
+        words.pop()
+    return " ".join(words)
+
+
+def parse(
+    text: str, today: Optional[date] = None, user_id: Optional[str] = None, normalized: bool = False
+) -> FastPathResult:
+    """
+    Extrae un gasto de un mensaje simple sin llamar al LLM.
+
+    Args:
+        text: El texto del usuario.
+        today: Fecha de referencia para expresiones relativas; por defecto, hoy.
+        user_id: El usuario, para el categorizador aprendido.
+        normalized: True si el texto ya pasó por normalize_text (la ingestión lo hace).
+
+    Returns:
+        Un FastPathResult con el gasto extraído, una confianza entre 0 y 1 y
+        los metadatos del matcher.
+    """
+    today = today or date.today()
+    clean = text if normalized else normalize_text(text)
+
+    expense_date, date_span = _parse_date(clean, today)
+    remainder = _remove_span(clean, date_span)
+
+    amounts = [m for m in _AMOUNT_RE.finditer(remainder) if _parse_number(m.group("number"))]
+    amount = currency = None
+    if amounts:
+        # Preferir el número que lleva una moneda explícita
+        with_currency = [m for m in amounts if m.group("prefix") or m.group("suffix")]
+        chosen = with_currency[0] if with_currency else amounts[0]
+        amount = _parse_number(chosen.group("number"))
+        marker = chosen.group("prefix") or chosen.group("suffix")
+        if marker:
+            currency = _CURRENCY_SYMBOLS.get(marker, _CURRENCY_WORDS.get(marker))
+        remainder = _remove_span(remainder, chosen.span())
+
+    if currency is None:
+        bare = _BARE_CURRENCY_RE.search(remainder)
+        if bare:
+            currency = _CURRENCY_WORDS[bare.group(0)]
+    remainder = _BARE_CURRENCY_RE.sub(" ", remainder)
+
+    description = _clean_description(remainder)
+    match_metadata = {}
+    if description:
+        # Sin coincidencia en la configuración, el categorizador aprendido del historial es el siguiente nivel
+        # La descripción sale del texto ya normalizado: solo faltan moneda y puntuación
+        desc_norm = normalize_for_matching(description, normalized=True)
+        match_metadata = (
+            matcher.get_metadata_from_match(desc_norm, normalized=True)
+            or categorizer.get_metadata(desc_norm, user_id, normalized=True)
+        )
+
+    fields = {"amount": amount, "description": description or None, "expense_date": expense_date or today, "raw_text": text}
+    # Sin moneda en el texto, la misma que asume el prompt del modelo
+    fields["currency"] = currency or config.DEFAULT_CURRENCY
+    if match_metadata.get("match_type") in ("provider", "fuzzy_provider"):
+        fields["provider_name"] = match_metadata["matched_name"]
+    if match_metadata.get("category"):
+        fields["category"] = match_metadata["category"]
+    expense = ExtractedExpense(**fields)
+
+    # --- Confianza ---
+    if amount is None or not description:
+        confidence = 0.0
+    else:
+        confidence = 1.0
+        if len(amounts) > 1:
+            confidence -= 0.4      # Varios números: no está claro cuál es el monto
+        if len(_SPACES_RE.split(clean)) > _MAX_SIMPLE_WORDS:
+            confidence -= 0.3      # Frase larga: probablemente necesita comprensión
+        if not match_metadata:
+            confidence -= 0.15     # Sin proveedor, palabra clave ni predicción del categorizador
+        if len(description) < 3:
+            confidence -= 0.3
+    return FastPathResult(expense, max(0.0, round(confidence, 2)), match_metadata)
+
+
+# --- Seguimiento de la proporción de entradas resueltas localmente ---
+_stats_lock = threading.Lock()
+_stats = {"local": 0, "llm": 0}
+
+
+def record(handled_locally: bool) -> None:
+    """
+    Registra si una entrada se resolvió con el camino rápido o necesitó el LLM.
+    """
+    with _stats_lock:
+        _stats["local" if handled_locally else "llm"] += 1
+
+
+def get_stats() -> Dict[str, float]:
+    """
+    Devuelve los contadores y la proporción de entradas resueltas localmente.
+    """
+    with _stats_lock:
+        local, llm = _stats["local"], _stats["llm"]
+    total = local + llm
+    return {"local": local, "llm": llm, "local_share": round(local / total, 4) if total else 0.0}
+
+
+metrics.Counter(
+    "expense_fast_path_total",
+    "Entradas evaluadas por el camino rápido; handled local o llm.",
+    ["handled"], function=lambda: {(key,): value for key, value in get_stats().items() if key != "local_share"},
+)
@@ -1,6 +1,7 @@
 """
 Version-controlled prompts for AI agents.
 """
+from app.config import config
 
 # Prompt for the "Extractor" AI agent, which pulls structured data from raw text.
 EXTRACTOR_PROMPT = """
@@ -8,7 +9,7 @@ You are a highly specialized AI assistant for expense tracking. Your task is to
 
 From the text, extract the following fields:
 - "amount": The numeric value of the expense.
-- "currency": The currency code (e.g., USD, EUR, CLP). If not specified, assume 'EUR'.
+- "currency": The currency code (e.g., USD, EUR, CLP). If not specified, assume '{default_currency}'.
 - "description": A brief description of what the expense was for.
 - "date": The date of the expense in YYYY-MM-DD format. If not specified, use today's date.
 - "category": The category of the expense (e.g., Food, Transport, Shopping, Rent, Utilities). If you cannot determine it, use 'Other'.
@@ -26,6 +27,46 @@ Example JSON:
 }
 """
 
+# Prompt for extracting several expense entries in a single call (micro-batching).
+BATCH_EXTRACTOR_PROMPT = """
+You are a highly specialized AI assistant for expense tracking. You will receive a JSON object with an "items" array.
+Each item has an "index" and a "text" containing one user's expense entry. Process every item independently.
+An item may also have a "language" (ISO 639-1 code) detected for its text: keep that item's description in that
+language and read its dates and numbers accordingly.
+
+For each item, extract the following fields:
+- "amount": The numeric value of the expense.
+- "currency": The currency code (e.g., USD, EUR, CLP). If not specified, assume '{default_currency}'.
+- "description": A brief description of what the expense was for.
+- "date": The date of the expense in YYYY-MM-DD format. If not specified, use today's date.
+- "category": The category of the expense (e.g., Food, Transport, Shopping, Rent, Utilities). If you cannot determine it, use 'Other'.
+
+Respond ONLY with a valid JSON object with an "items" array containing exactly one object per input item,
+each including the same "index" it was given. Do not add any explanation or conversational text.
+
+Example Input:
+{"items": [{"index": 0, "text": "lunch with colleagues today, 25.50 eur"}, {"index": 1, "text": "taxi 12 usd"}]}
+Example JSON:
+{
+  "items": [
+    {"index": 0, "amount": 25.50, "currency": "EUR", "description": "Lunch with colleagues", "date": "2025-12-18", "category": "Food"},
+    {"index": 1, "amount": 12.00, "currency": "USD", "description": "Taxi", "date": "2025-12-18", "category": "Transport"}
+  ]
+}
+"""
+
+# The fast path falls back to the same currency (config.DEFAULT_CURRENCY), so both paths store the same value.
+EXTRACTOR_PROMPT = EXTRACTOR_PROMPT.replace("{default_currency}", config.DEFAULT_CURRENCY)
+BATCH_EXTRACTOR_PROMPT = BATCH_EXTRACTOR_PROMPT.replace("{default_currency}", config.DEFAULT_CURRENCY)
+
+# Extra system message sent with EXTRACTOR_PROMPT when the language of the entry was detected.
+LANGUAGE_HINT = """
+The entry is written in {language}. Keep the description in {language} and read dates and numbers the way {language} speakers write them.
+"""
+
+# Names used in LANGUAGE_HINT for the codes returned by language detection.
+LANGUAGE_NAMES = {"es": "Spanish", "en": "English"}
+
 # Prompt for a "Classifier" or "Auditor" agent, which could validate the extraction.
 # This is a placeholder for a potential future agent.
 AUDITOR_PROMPT = """
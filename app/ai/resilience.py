@@ -0,0 +1,425 @@
+"""
+Envoltura resiliente para llamadas a proveedores de IA.
+
+Combina tres mecanismos, cada uno con sus propios contadores:
+
+- Reintentos con retroceso exponencial y jitter ("full jitter") que respetan
+  la cabecera Retry-After en respuestas 429/503.
+- Un interruptor de circuito que, tras varios fallos consecutivos, rechaza las
+  llamadas de inmediato (CircuitOpenError) durante un tiempo para que el
+  llamador use su camino alternativo en lugar de esperar a un proveedor caído.
+- Peticiones de cobertura ("hedged requests") opcionales: si una llamada tarda
+  más que el percentil configurado de las latencias recientes, se lanza una
+  segunda y gana la primera que responda.
+
+Las latencias y la espera de cobertura se cuentan desde que la petición sale
+hacia el proveedor, no desde que se pide: la función envuelta llama a
+mark_dispatched() al obtener su turno (client.chat_completion lo hace tras el
+límite de concurrencia). Así, con el cliente saturado, la cola no dispara
+coberturas. Una cobertura solo sale si hay un hueco libre en el cliente y
+presupuesto en el control de admisión; si no, se sigue esperando a la primera.
+Las funciones que nunca llaman a mark_dispatched() no se cubren.
+
+Los contadores de cada envoltura se exportan como expense_ai_resilience_total.
+"""
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple, TypeVar
+
+import httpx
+
+from app import metrics
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """
+    Se lanza cuando el interruptor está abierto y la llamada no se intenta.
+    """
+
+
+class _Dispatch:
+    """
+    Momento en que una llamada salió hacia el proveedor (ver mark_dispatched).
+    """
+
+    __slots__ = ("event", "at")
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.at: Optional[float] = None
+
+
+_dispatch: ContextVar[Optional[_Dispatch]] = ContextVar("resilience_dispatch", default=None)
+
+
+def mark_dispatched() -> None:
+    """
+    Indica que la llamada en curso sale ahora hacia el proveedor (ya tiene su turno).
+
+    La llaman las funciones envueltas por ResilientCaller; fuera de una llamada no hace nada.
+    """
+    dispatch = _dispatch.get()
+    if dispatch is not None and dispatch.at is None:
+        dispatch.at = time.monotonic()
+        dispatch.event.set()
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    Errores transitorios del proveedor: red, tiempo de espera, 429 y 5xx.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """
+    Devuelve los segundos indicados por Retry-After (número o fecha HTTP), si existen.
+    """
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    value = error.response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Interruptor de circuito de tres estados: cerrado, abierto y semiabierto.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Indica si se puede intentar una llamada. En semiabierto solo se deja pasar una sonda.
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self.state = self.CLOSED
+
+    def release(self) -> None:
+        """
+        Libera la sonda en curso sin cambiar el estado (la respuesta no dice nada de la salud del proveedor).
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> bool:
+        """
+        Registra un fallo del proveedor. Devuelve True si el interruptor acaba de abrirse.
+        """
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                was_open = self.state == self.OPEN
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                return not was_open
+            return False
+
+
+class LatencyTracker:
+    """
+    Ventana deslizante de latencias recientes para estimar percentiles.
+    """
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._cached: Dict[float, float] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+            self._cached.clear()
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            if q not in self._cached:
+                ordered = sorted(self._samples)
+                self._cached[q] = ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+            return self._cached[q]
+
+
+class ResilientCaller:
+    """
+    Ejecuta llamadas asíncronas a un proveedor con reintentos, interruptor y cobertura.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        breaker: CircuitBreaker,
+        hedge_enabled: bool = False,
+        hedge_percentile: float = 0.95,
+        hedge_min_samples: int = 20,
+        hedge_gate: Optional[Callable[[int], bool]] = None,
+    ):
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        # Decide si una cobertura puede salir (recibe los tokens estimados de la llamada)
+        self.hedge_gate = hedge_gate
+        self.latencies = LatencyTracker()
+        self.metrics: Dict[str, int] = {
+            "calls": 0, "successes": 0, "failures": 0, "retries": 0, "retry_after_honored": 0,
+            "circuit_rejections": 0, "circuit_opened": 0, "hedges_launched": 0, "hedges_won": 0,
+            "hedges_skipped": 0,
+        }
+
+    def _backoff(self, attempt: int, error: Exception) -> Optional[float]:
+        """
+        Calcula la espera antes del siguiente intento, o None si no conviene reintentar.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            if retry_after > self.max_delay:
+                # El proveedor pide esperar más de lo que un usuario tolera
+                return None
+            self.metrics["retry_after_honored"] += 1
+            delay = max(delay, retry_after)
+        return delay
+
+    async def call(self, fn: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        """
+        Ejecuta fn() aplicando las políticas de resiliencia.
+
+        tokens estima el coste de la llamada; lo consume una cobertura si llega a lanzarse.
+
+        Raises:
+            CircuitOpenError: Si el interruptor está abierto.
+            Exception: El último error si se agotan los intentos o no es reintentable.
+        """
+        self.metrics["calls"] += 1
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.metrics["circuit_rejections"] += 1
+                raise CircuitOpenError(f"Circuito '{self.name}' abierto; se omite la llamada.")
+            try:
+                result = await self._attempt(fn, tokens)
+            except Exception as error:
+                if not _is_retryable(error):
+                    # Errores del cliente (400, JSON inválido...) no dicen si el proveedor está sano:
+                    # el interruptor no cambia, solo se libera la sonda si la había
+                    self.breaker.release()
+                    self.metrics["failures"] += 1
+                    raise
+                if self.breaker.record_failure():
+                    self.metrics["circuit_opened"] += 1
+                    logger.warning(f"Circuito '{self.name}' abierto tras fallos consecutivos.")
+                attempt += 1
+                delay = self._backoff(attempt - 1, error) if attempt < self.max_attempts else None
+                if delay is None:
+                    self.metrics["failures"] += 1
+                    raise
+                self.metrics["retries"] += 1
+                logger.warning(f"Llamada a '{self.name}' falló ({error}); reintento {attempt} en {delay:.2f}s.")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self.metrics["successes"] += 1
+            return result
+
+    @staticmethod
+    def _launch(fn: Callable[[], Awaitable[T]]) -> Tuple["asyncio.Task[T]", _Dispatch]:
+        """
+        Lanza fn() en una tarea propia con su registro de salida (mark_dispatched).
+        """
+        dispatch = _Dispatch()
+        token = _dispatch.set(dispatch)
+        try:
+            # La tarea copia el contexto actual, con el registro de esta llamada
+            task = asyncio.ensure_future(fn())
+        finally:
+            _dispatch.reset(token)
+        return task, dispatch
+
+    def _record_latency(self, dispatch: _Dispatch, start: float) -> None:
+        self.latencies.add(time.monotonic() - (dispatch.at or start))
+
+    async def _attempt(self, fn: Callable[[], Awaitable[T]], tokens: int) -> T:
+        start = time.monotonic()
+        if not self.hedge_enabled or len(self.latencies) < self.hedge_min_samples:
+            dispatch = _Dispatch()
+            token = _dispatch.set(dispatch)
+            try:
+                result = await fn()
+            finally:
+                _dispatch.reset(token)
+            self._record_latency(dispatch, start)
+            return result
+
+        primary, dispatch = self._launch(fn)
+        tasks: Set[asyncio.Task] = {primary}
+        try:
+            # La espera por un turno en el cliente no cuenta como lentitud del proveedor
+            dispatched = asyncio.ensure_future(dispatch.event.wait())
+            try:
+                await asyncio.wait({primary, dispatched}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                dispatched.cancel()
+            if not primary.done():
+                threshold = self.latencies.percentile(self.hedge_percentile)
+                await asyncio.wait({primary}, timeout=max(0.0, threshold - (time.monotonic() - dispatch.at)))
+            if primary.done():
+                result = primary.result()
+                self._record_latency(dispatch, start)
+                return result
+
+            if self.hedge_gate is not None and not self.hedge_gate(tokens):
+                # Sin hueco ni presupuesto, una cobertura solo añadiría carga
+                self.metrics["hedges_skipped"] += 1
+                result = await primary
+                self._record_latency(dispatch, start)
+                return result
+
+            self.metrics["hedges_launched"] += 1
+            hedge, hedge_dispatch = self._launch(fn)
+            tasks.add(hedge)
+            launched = {primary: dispatch, hedge: hedge_dispatch}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.metrics["hedges_won"] += 1
+                        self._record_latency(launched[task], start)
+                        return task.result()
+                if not pending:
+                    # Ambas fallaron: propagar el error de la última
+                    raise done.pop().exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+_callers: Dict[str, ResilientCaller] = {}
+
+
+def get_caller(name: str = "openai") -> ResilientCaller:
+    """
+    Devuelve la envoltura compartida para un proveedor; extractor y clasificador
+    comparten la misma para que el interruptor refleje el estado real del proveedor.
+    """
+    caller = _callers.get(name)
+    if caller is None:
+        caller = _callers.setdefault(name, ResilientCaller(
+            name,
+            max_attempts=config.AI_RETRY_ATTEMPTS,
+            base_delay=config.AI_RETRY_BASE_DELAY,
+            max_delay=config.AI_RETRY_MAX_DELAY,
+            breaker=CircuitBreaker(config.AI_BREAKER_FAILURES, config.AI_BREAKER_RESET),
+            hedge_enabled=config.AI_HEDGE_ENABLED,
+            hedge_percentile=config.AI_HEDGE_PERCENTILE,
+            hedge_min_samples=config.AI_HEDGE_MIN_SAMPLES,
+            hedge_gate=_hedge_gate,
+        ))
+    return caller
+
+
+def _hedge_gate(tokens: int) -> bool:
+    """
+    Una cobertura sale solo si hay un hueco libre en el cliente y la admisión tiene presupuesto.
+    """
+    # Importación diferida: admission usa LatencyTracker de este módulo
+    from app.ai import admission, client
+    return client.has_free_slot() and admission.try_acquire(tokens)
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Contadores y estado del interruptor de cada envoltura.
+    """
+    return {
+        name: dict(caller.metrics, breaker_state=caller.breaker.state)
+        for name, caller in list(_callers.items())
+    }
+
+
+def _metric_samples() -> Dict[tuple, float]:
+    return {
+        (name, event): value
+        for name, caller in list(_callers.items())
+        for event, value in dict(caller.metrics).items()
+    }
+
+
+def _breaker_samples() -> Dict[tuple, float]:
+    return {
+        (name, state): 1.0 if caller.breaker.state == state else 0.0
+        for name, caller in list(_callers.items())
+        for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)
+    }
+
+
+metrics.Counter(
+    "expense_ai_resilience_total",
+    "Decisiones de la envoltura resiliente por proveedor: calls, successes, failures, retries, "
+    "retry_after_honored, circuit_rejections, circuit_opened, hedges_launched, hedges_won y hedges_skipped.",
+    ["caller", "event"], function=_metric_samples,
+)
+metrics.Gauge(
+    "expense_ai_circuit_state", "Estado del interruptor de circuito (1 en el estado actual).",
+    ["caller", "state"], function=_breaker_samples,
+)
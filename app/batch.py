@@ -0,0 +1,371 @@
+"""
+Procesamiento por lotes con resultados en streaming.
+
+Recibe un arreglo JSON o un flujo NDJSON de RawInput y lo procesa sin
+cargarlo entero en memoria:
+
+- La entrada se analiza de forma incremental: solo se lee el siguiente
+  elemento cuando hay un hueco libre (BATCH_CONCURRENCY elementos en curso).
+- Cada elemento recorre el pipeline con prioridad BULK, sin la etapa de
+  persistencia.
+- Los gastos auto-confirmados se guardan en grupos de hasta BATCH_COMMIT_SIZE
+  por transacción. Un grupo incompleto se confirma tras BATCH_COMMIT_INTERVAL
+  segundos, para no retrasar los resultados.
+- Se devuelve una línea por elemento en cuanto termina, en el orden en que
+  terminan; "index" indica su posición en la entrada.
+
+Si el cliente lee los resultados despacio, las colas se llenan y se deja de
+leer la entrada: la memoria usada no depende del tamaño del lote.
+"""
+import asyncio
+import codecs
+import json
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from app import metrics, router
+from app.ai.admission import AdmissionRejected, Priority
+from app.config import config
+from app.ingestion.executor import IngestionError
+from app.persistence import repositories
+from app.persistence.db import get_write_executor, write_session_scope
+from app.schema.base import FinalExpense, RawInput
+
+logger = logging.getLogger(__name__)
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+# Marcas internas de las colas
+_END = object()
+_FLUSH = object()
+
+_stats_lock = threading.Lock()
+_stats = {"batches": 0, "items": 0, "stored": 0, "duplicate": 0, "review": 0, "invalid": 0, "rejected": 0, "failed": 0, "commits": 0}
+
+
+class BatchFormatError(ValueError):
+    """
+    Un elemento del lote no se pudo leer (JSON inválido o demasiado grande).
+    """
+
+
+def _record(key: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += n
+
+
+def get_stats() -> Dict[str, int]:
+    """
+    Devuelve los contadores de lotes, elementos por estado y transacciones.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+metrics.Counter(
+    "expense_batch_total",
+    "Lotes, elementos por estado y transacciones del endpoint de lotes.",
+    ["event"], function=lambda: {(key,): value for key, value in get_stats().items()},
+)
+
+
+# --- Lectura incremental de la entrada ---
+
+async def iter_ndjson(chunks: AsyncIterator[bytes], max_item_bytes: int) -> AsyncIterator[Any]:
+    """
+    Produce un valor por línea no vacía. Las líneas inválidas producen un
+    BatchFormatError y la lectura continúa con la siguiente.
+    """
+    buffer = bytearray()
+    skipping = False
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        while True:
+            newline = buffer.find(b"\n")
+            if newline < 0:
+                break
+            line = bytes(buffer[:newline])
+            del buffer[:newline + 1]
+            if skipping:
+                skipping = False
+            elif line.strip():
+                yield _loads(line)
+        if not skipping and len(buffer) > max_item_bytes:
+            # Se descarta el resto de la línea sin acumularlo
+            yield BatchFormatError(f"El elemento supera {max_item_bytes // 1024} KB.")
+            skipping = True
+        if skipping:
+            buffer.clear()
+    if buffer.strip() and not skipping:
+        yield _loads(bytes(buffer))
+
+
+def _loads(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return BatchFormatError(f"JSON inválido: {e}")
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes], max_item_bytes: int) -> AsyncIterator[Any]:
+    """
+    Produce los elementos de un arreglo JSON de objetos a medida que llegan.
+
+    Un error de sintaxis no permite recuperar el resto del arreglo: se produce
+    un BatchFormatError y la lectura termina.
+    """
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    text = ""
+    state = "start"  # start -> first -> (sep -> item)* -> end
+    async for chunk in chunks:
+        try:
+            text += utf8.decode(chunk)
+        except UnicodeDecodeError as e:
+            yield BatchFormatError(f"La entrada no es UTF-8 válido: {e}")
+            return
+        pos = 0
+        while True:
+            while pos < len(text) and text[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(text):
+                break
+            char = text[pos]
+            if state == "start":
+                if char != "[":
+                    yield BatchFormatError("Se esperaba un arreglo JSON.")
+                    return
+                state, pos = "first", pos + 1
+                continue
+            if state in ("first", "sep") and char == "]":
+                state, pos = "end", pos + 1
+                continue
+            if state == "sep":
+                if char != ",":
+                    yield BatchFormatError(f"Se esperaba ',' o ']' y se encontró {char!r}.")
+                    return
+                state, pos = "item", pos + 1
+                continue
+            if state == "end":
+                yield BatchFormatError("Contenido adicional después del arreglo JSON.")
+                return
+            # Solo se aceptan objetos: así un objeto incompleto nunca se confunde con uno válido
+            if char != "{":
+                yield BatchFormatError(f"Cada elemento debe ser un objeto JSON (se encontró {char!r}).")
+                return
+            try:
+                item, pos = _decoder.raw_decode(text, pos)
+            except json.JSONDecodeError as e:
+                # Probablemente el objeto llega en el siguiente bloque
+                if len(text) - pos > max_item_bytes:
+                    yield BatchFormatError(f"El elemento supera {max_item_bytes // 1024} KB o es inválido: {e}")
+                    return
+                break
+            state = "sep"
+            yield item
+        text = text[pos:]
+    if state != "end":
+        yield BatchFormatError("El arreglo JSON está incompleto.")
+
+
+async def iter_items(chunks: AsyncIterator[bytes], max_item_bytes: Optional[int] = None) -> AsyncIterator[Any]:
+    """
+    Detecta el formato por el primer carácter ('[' para un arreglo, NDJSON en otro caso)
+    y produce los elementos de la entrada uno a uno.
+    """
+    max_item_bytes = max_item_bytes or config.BATCH_MAX_ITEM_KB * 1024
+    chunks = chunks.__aiter__()
+    head = b""
+    async for chunk in chunks:
+        head += chunk
+        if head.strip():
+            break
+    if not head.strip():
+        return
+
+    async def replay():
+        yield head
+        async for rest in chunks:
+            yield rest
+
+    parse = iter_json_array if head.lstrip()[:1] == b"[" else iter_ndjson
+    async for item in parse(replay(), max_item_bytes):
+        yield item
+
+
+# --- Procesamiento ---
+
+def _line(index: int, item_id: Any = None, status: str = "error", errors: Optional[List[str]] = None) -> Dict[str, Any]:
+    return {"index": index, "id": item_id, "status": status, "expense_id": None, "duplicate_of": None, "errors": errors or []}
+
+
+async def _process_item(index: int, item: Any, priority: Priority) -> Tuple[Dict[str, Any], Optional[FinalExpense]]:
+    """
+    Procesa un elemento. Devuelve su línea de resultado y, si se auto-confirmó, el gasto a guardar.
+    """
+    if isinstance(item, BatchFormatError):
+        return _line(index, status="invalid", errors=[str(item)]), None
+    if not isinstance(item, dict):
+        return _line(index, status="invalid", errors=["Cada elemento debe ser un objeto JSON."]), None
+
+    line = _line(index, item.get("id"))
+    try:
+        raw_input = RawInput(**item)
+    except ValidationError as e:
+        line["status"] = "invalid"
+        line["errors"] = [f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors()]
+        return line, None
+
+    try:
+        final_expense = await router.aprepare_expense_input(raw_input, priority)
+    except AdmissionRejected as e:
+        line["status"] = "rejected"
+        line["errors"] = [str(e)]
+        return line, None
+    except (IngestionError, ValueError) as e:
+        line["errors"] = [str(e)]
+        return line, None
+    except Exception as e:
+        logger.error(f"Error inesperado en el elemento {index} del lote: {e}", exc_info=True)
+        line["errors"] = ["Ocurrió un error interno del servidor."]
+        return line, None
+
+    if final_expense is None:
+        line["status"] = "review"
+        line["errors"] = ["Baja confianza o datos incompletos: requiere revisión manual."]
+    return line, final_expense
+
+
+def _save_group(expenses: List[FinalExpense]) -> List[repositories.SavedExpense]:
+    with write_session_scope() as session:
+        return repositories.save_final_expenses(session, expenses)
+
+
+async def process_batch(items: AsyncIterator[Any], priority: Priority = Priority.BULK) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Procesa los elementos de un lote y produce una línea de resultado por elemento.
+
+    Cada línea tiene index, id (el "id" del elemento, si lo trae), status
+    ("stored", "duplicate", "review", "invalid", "rejected" o "error"), expense_id,
+    duplicate_of y errors. Un duplicado exacto no se guarda: expense_id es el
+    gasto ya registrado. Un posible duplicado se guarda y duplicate_of indica
+    el gasto parecido.
+
+    Si el consumidor abandona el generador (el cliente se desconecta), se
+    cancelan los elementos en curso; los grupos ya confirmados se conservan.
+    """
+    loop = asyncio.get_running_loop()
+    results: asyncio.Queue = asyncio.Queue(maxsize=config.BATCH_CONCURRENCY)
+    to_commit: asyncio.Queue = asyncio.Queue(maxsize=config.BATCH_COMMIT_SIZE)
+    slots = asyncio.Semaphore(config.BATCH_CONCURRENCY)
+    in_flight = set()
+    _record("batches")
+
+    async def handle(index: int, item: Any) -> None:
+        try:
+            line, final_expense = await _process_item(index, item, priority)
+            if final_expense is not None:
+                await to_commit.put((line, final_expense))
+            else:
+                _record(line["status"] if line["status"] in _stats else "failed")
+                await results.put(line)
+        finally:
+            slots.release()
+
+    async def flush(group: List[Tuple[Dict[str, Any], FinalExpense]]) -> None:
+        try:
+            saved = await loop.run_in_executor(get_write_executor(), _save_group, [expense for _, expense in group])
+            for (line, _), result in zip(group, saved):
+                line["status"] = "duplicate" if result.duplicate else "stored"
+                line["expense_id"] = result.expense_id
+                line["duplicate_of"] = result.expense_id if result.duplicate else result.duplicate_of
+                _record(line["status"])
+            _record("commits")
+        except Exception as e:
+            logger.error(f"No se pudo guardar un grupo de {len(group)} gastos del lote: {e}", exc_info=True)
+            for line, _ in group:
+                line["errors"] = ["No se pudo guardar el gasto."]
+            _record("failed", len(group))
+        for line, _ in group:
+            await results.put(line)
+
+    async def commit() -> None:
+        group: List[Tuple[Dict[str, Any], FinalExpense]] = []
+        deadline = 0.0
+        while True:
+            timeout = max(0.0, deadline - loop.time()) if group else None
+            try:
+                entry = await asyncio.wait_for(to_commit.get(), timeout)
+            except asyncio.TimeoutError:
+                entry = _FLUSH
+            if entry is not _FLUSH and entry is not _END:
+                if not group:
+                    deadline = loop.time() + config.BATCH_COMMIT_INTERVAL
+                group.append(entry)
+            if group and (entry is _FLUSH or entry is _END or len(group) >= config.BATCH_COMMIT_SIZE):
+                await flush(group)
+                group = []
+            if entry is _END:
+                return
+
+    async def produce() -> None:
+        index = 0
+        try:
+            async for item in items:
+                await slots.acquire()
+                task = asyncio.ensure_future(handle(index, item))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                index += 1
+                _record("items")
+        except Exception as e:
+            # La lectura del cuerpo falló (p. ej. desconexión): se termina lo que ya estaba en curso
+            logger.error(f"Error al leer el lote: {e}")
+            await results.put(_line(index, status="invalid", errors=[f"Error al leer la entrada: {e}"]))
+        if in_flight:
+            await asyncio.gather(*list(in_flight))
+        await to_commit.put(_END)
+        await committer
+        await results.put(_END)
+
+    committer = asyncio.ensure_future(commit())
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            line = await results.get()
+            if line is _END:
+                break
+            yield line
+    finally:
+        for task in (producer, committer, *in_flight):
+            task.cancel()
+        await asyncio.gather(producer, committer, return_exceptions=True)
+
+
+async def encode_ndjson(lines: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    async for line in lines:
+        yield (json.dumps(line, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+class BatchResponse(StreamingResponse):
+    """
+    Respuesta NDJSON que se escribe mientras todavía se lee el cuerpo de la petición.
+
+    StreamingResponse escucha la desconexión del cliente llamando a receive()
+    en paralelo, lo que le roba al lote los bloques del cuerpo y lo deja
+    esperando para siempre. Aquí receive() queda solo para la lectura de la
+    entrada; una desconexión se detecta al leer el cuerpo o al escribir.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            logger.warning("El cliente se desconectó antes de recibir todos los resultados del lote.")
@@ -22,15 +22,157 @@ class Config:
     # OpenAI API Key
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+    # Endpoint compatible con OpenAI y modelo por defecto
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+    OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+
+    # Moneda que se asume cuando el texto no indica ninguna (camino rápido y prompts del modelo)
+    DEFAULT_CURRENCY = os.getenv("DEFAULT_CURRENCY", "EUR").upper()
+
+    # Cliente HTTP de IA: tiempos de espera (segundos), conexiones del pool y llamadas simultáneas
+    AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "30"))
+    AI_CONNECT_TIMEOUT = float(os.getenv("AI_CONNECT_TIMEOUT", "5"))
+    AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "20"))
+    AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+
+    # Resiliencia de llamadas a IA: reintentos, interruptor de circuito y peticiones de cobertura
+    AI_RETRY_ATTEMPTS = int(os.getenv("AI_RETRY_ATTEMPTS", "3"))
+    AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "0.5"))
+    AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "8"))
+    AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+    AI_BREAKER_RESET = float(os.getenv("AI_BREAKER_RESET", "30"))
+    AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "false").lower() == "true"
+    AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "0.95"))
+    AI_HEDGE_MIN_SAMPLES = int(os.getenv("AI_HEDGE_MIN_SAMPLES", "20"))
+
+    # Control de admisión de llamadas a IA: presupuesto global por minuto (según el plan de la API),
+    # parte justa por usuario, tamaño de la cola y espera máxima (segundos) de las peticiones interactivas
+    AI_ADMISSION_ENABLED = os.getenv("AI_ADMISSION_ENABLED", "true").lower() == "true"
+    AI_REQUESTS_PER_MINUTE = float(os.getenv("AI_REQUESTS_PER_MINUTE", "500"))
+    AI_TOKENS_PER_MINUTE = float(os.getenv("AI_TOKENS_PER_MINUTE", "90000"))
+    AI_USER_REQUESTS_PER_MINUTE = float(os.getenv("AI_USER_REQUESTS_PER_MINUTE", "60"))
+    AI_ADMISSION_QUEUE_SIZE = int(os.getenv("AI_ADMISSION_QUEUE_SIZE", "1000"))
+    AI_ADMISSION_MAX_WAIT = float(os.getenv("AI_ADMISSION_MAX_WAIT", "30"))
+
+    # Micro-lotes de extracción: ventana de espera (ms) y elementos máximos por llamada
+    AI_BATCH_ENABLED = os.getenv("AI_BATCH_ENABLED", "false").lower() == "true"
+    AI_BATCH_WINDOW_MS = float(os.getenv("AI_BATCH_WINDOW_MS", "50"))
+    AI_BATCH_MAX_ITEMS = int(os.getenv("AI_BATCH_MAX_ITEMS", "10"))
+
+    # Camino rápido determinístico: confianza mínima (0-1) para no llamar al LLM
+    FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+    FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+
+    # Caché de extracciones: tamaño en memoria, TTL (segundos), archivo SQLite ("" lo desactiva) y filas máximas
+    EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+    EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "2048"))
+    EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL", str(7 * 24 * 3600)))
+    EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "extraction_cache.db"))
+    EXTRACTION_CACHE_MAX_ROWS = int(os.getenv("EXTRACTION_CACHE_MAX_ROWS", "100000"))
+
+    # Categorizador local aprendido del historial: archivo del modelo y probabilidad mínima (0-1) para usarlo
+    CATEGORIZER_ENABLED = os.getenv("CATEGORIZER_ENABLED", "true").lower() == "true"
+    CATEGORIZER_MODEL_PATH = os.getenv("CATEGORIZER_MODEL_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "categorizer_model.json.gz"))
+    CATEGORIZER_MIN_CONFIDENCE = float(os.getenv("CATEGORIZER_MIN_CONFIDENCE", "0.9"))
+
+    # Confianza local (0-1): por encima de ACCEPT no se llama al auditor, por debajo de REJECT
+    # va directo a revisión manual; AUTO_CONFIRM es el mínimo para guardar sin confirmación del usuario
+    CONFIDENCE_ACCEPT_THRESHOLD = float(os.getenv("CONFIDENCE_ACCEPT_THRESHOLD", "0.85"))
+    CONFIDENCE_REJECT_THRESHOLD = float(os.getenv("CONFIDENCE_REJECT_THRESHOLD", "0.4"))
+    CONFIDENCE_AUTO_CONFIRM = float(os.getenv("CONFIDENCE_AUTO_CONFIRM", "0.7"))
+    AUDITOR_ENABLED = os.getenv("AUDITOR_ENABLED", "true").lower() == "true"
+
+    # Pipeline por etapas: trabajadores de cada etapa (la persistencia usa un único escritor)
+    # y tamaño de las colas entre etapas (contrapresión)
+    PIPELINE_INGEST_WORKERS = int(os.getenv("PIPELINE_INGEST_WORKERS", str(os.cpu_count() or 1)))
+    PIPELINE_EXTRACT_WORKERS = int(os.getenv("PIPELINE_EXTRACT_WORKERS", "16"))
+    PIPELINE_CLASSIFY_WORKERS = int(os.getenv("PIPELINE_CLASSIFY_WORKERS", "8"))
+    PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "100"))
+
+    # Ejecutor de ingestión (OCR, PDF, audio): tiempo máximo por tarea (segundos), tareas y memoria
+    # máxima (MB) antes de reciclar un proceso, y tamaño (KB) a partir del cual se usa memoria compartida
+    INGEST_TASK_TIMEOUT = float(os.getenv("INGEST_TASK_TIMEOUT", "60"))
+    INGEST_MAX_TASKS_PER_WORKER = int(os.getenv("INGEST_MAX_TASKS_PER_WORKER", "200"))
+    INGEST_MAX_WORKER_MEMORY_MB = float(os.getenv("INGEST_MAX_WORKER_MEMORY_MB", "512"))
+    INGEST_SHM_THRESHOLD_KB = int(os.getenv("INGEST_SHM_THRESHOLD_KB", "256"))
+
+    # Lotes (/process-expenses/batch): gastos procesados a la vez, gastos por transacción,
+    # espera máxima (segundos) antes de confirmar un grupo incompleto y tamaño máximo (KB) de cada elemento
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "32"))
+    BATCH_COMMIT_SIZE = int(os.getenv("BATCH_COMMIT_SIZE", "50"))
+    BATCH_COMMIT_INTERVAL = float(os.getenv("BATCH_COMMIT_INTERVAL", "0.5"))
+    BATCH_MAX_ITEM_KB = int(os.getenv("BATCH_MAX_ITEM_KB", "1024"))
+
+    # Métricas de Prometheus (/metrics). Con varios workers, directorio compartido donde cada
+    # proceso escribe su estado cada METRICS_FLUSH_INTERVAL segundos (vacío: solo este proceso)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+    METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+    # Detección de duplicados: ventana (días) para marcar posibles duplicados, tasa de falsos positivos
+    # del filtro de Bloom por usuario, usuarios en memoria y segundos entre lecturas de filas nuevas
+    DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+    DEDUP_WINDOW_DAYS = int(os.getenv("DEDUP_WINDOW_DAYS", "3"))
+    DEDUP_BLOOM_ERROR_RATE = float(os.getenv("DEDUP_BLOOM_ERROR_RATE", "0.01"))
+    DEDUP_MAX_USERS = int(os.getenv("DEDUP_MAX_USERS", "10000"))
+    DEDUP_REFRESH_INTERVAL = float(os.getenv("DEDUP_REFRESH_INTERVAL", "5"))
+
+    # Grabación de tráfico para pruebas de carga: archivo NDJSON de entradas anonimizadas ("" no graba),
+    # archivo de respuestas del modelo, si se graban imágenes/audio/PDF y sal de los seudónimos de usuario
+    RECORD_PATH = os.getenv("RECORD_PATH", "")
+    RECORD_LLM_PATH = os.getenv("RECORD_LLM_PATH", "")
+    RECORD_MEDIA = os.getenv("RECORD_MEDIA", "false").lower() == "true"
+    RECORD_SALT = os.getenv("RECORD_SALT", "")
+
+    # Escritor con confirmación agrupada (pipeline): gastos por INSERT, espera máxima (milisegundos)
+    # para juntar un grupo y gastos en espera antes de frenar a los productores (contrapresión)
+    WRITER_ENABLED = os.getenv("WRITER_ENABLED", "true").lower() == "true"
+    WRITER_MAX_BATCH = int(os.getenv("WRITER_MAX_BATCH", "100"))
+    WRITER_MAX_DELAY_MS = float(os.getenv("WRITER_MAX_DELAY_MS", "5"))
+    WRITER_BUFFER_SIZE = int(os.getenv("WRITER_BUFFER_SIZE", "1000"))
+
     # ID del Supergrupo para el bot
     SUPERGROUP_ID = os.getenv("SUPERGROUP_ID")
     
     # URL de la Base de Datos (ej., "sqlite:///expenses.db")
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///../database.db")
 
+    # Pool de conexiones (motores síncrono y asíncrono): conexiones permanentes, adicionales en picos,
+    # espera máxima (segundos) por una conexión, reciclaje (segundos) y verificación antes de usarla
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+    # Motor asíncrono: URL (vacía: DATABASE_URL con aiosqlite, aiomysql o asyncpg) y si las lecturas
+    # del pipeline (historial de montos) lo usan en lugar de un hilo con el motor síncrono
+    DATABASE_ASYNC_URL = os.getenv("DATABASE_ASYNC_URL", "")
+    DB_ASYNC_ENABLED = os.getenv("DB_ASYNC_ENABLED", "false").lower() == "true"
+
+    # Perfil de SQLite en archivo: WAL y PRAGMAs por conexión (synchronous, mmap en bytes, caché en KB,
+    # espera máxima en milisegundos ante un bloqueo) y una única conexión de escritura
+    SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "true").lower() == "true"
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
     # Nivel de registro
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
+    # Secreto para los endpoints de operación (cabecera X-Admin-Token); vacío los desactiva
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+    # Idioma asumido cuando la detección es ambigua (ej. "uber 120")
+    DEFAULT_LANGUAGE = os.getenv("DEFAULT_LANGUAGE", "es")
+
+    # Segundos entre verificaciones de cambios en providers.csv / keywords.csv (0 desactiva la recarga)
+    MATCHER_RELOAD_INTERVAL = float(os.getenv("MATCHER_RELOAD_INTERVAL", "5"))
+
+    # Similitud mínima (0-1) para aceptar un proveedor aproximado (0 desactiva la coincidencia difusa)
+    MATCHER_FUZZY_THRESHOLD = float(os.getenv("MATCHER_FUZZY_THRESHOLD", "0.85"))
+
 
 # Crear una única instancia de la configuración
 config = Config()
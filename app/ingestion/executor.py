@@ -0,0 +1,294 @@
+"""
+Executes CPU-heavy ingestion handlers (OCR, PDF parsing, audio decoding) in worker processes.
+
+The standard ProcessPoolExecutor cannot stop a task that hangs, and it breaks
+entirely when a worker exits on purpose. This executor manages its own
+workers instead:
+
+- One process per core (PIPELINE_INGEST_WORKERS), started with "spawn" so they
+  do not inherit the parent's threads. Each worker only imports the ingestion
+  handlers it needs.
+- Payloads above INGEST_SHM_THRESHOLD_KB travel through shared memory. Only the
+  segment name goes down the pipe, so large files are not pickled.
+- A task that exceeds INGEST_TASK_TIMEOUT kills its worker, which is replaced.
+- A worker retires itself after INGEST_MAX_TASKS_PER_WORKER tasks or when its
+  peak memory goes over INGEST_MAX_WORKER_MEMORY_MB, so a leaking library
+  cannot grow forever.
+
+The parent waits on the worker's pipe with the event loop's reader callbacks,
+so awaiting a result never blocks the loop.
+"""
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import resource
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+from app import metrics
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+# Input type -> "module:function" of the handler that runs in the worker
+HANDLERS: Dict[str, str] = {
+    "image": "app.ingestion.image:process_image_input",
+    "audio": "app.ingestion.audio:process_audio_input",
+    "document": "app.ingestion.document:process_document_input",
+}
+
+
+class IngestionError(Exception):
+    """
+    Raised when an ingestion handler fails or its worker dies.
+    """
+
+
+class IngestionTimeout(IngestionError):
+    """
+    Raised when an ingestion task exceeds its time limit.
+    """
+
+
+def _worker_main(conn, max_tasks: int, max_memory_mb: float) -> None:
+    """
+    Worker process loop: receive a task, run its handler, send back the result.
+    """
+    handlers = {}
+    for done in range(1, max_tasks + 1):
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        input_type, payload, shm_name, size = task
+        try:
+            if shm_name is not None:
+                shm = shared_memory.SharedMemory(name=shm_name)
+                try:
+                    payload = bytes(shm.buf[:size])
+                finally:
+                    shm.close()
+            handler = handlers.get(input_type)
+            if handler is None:
+                module, func = HANDLERS[input_type].split(":")
+                handler = handlers[input_type] = getattr(importlib.import_module(module), func)
+            reply = ("ok", handler(payload))
+        except Exception as e:
+            reply = ("error", f"{type(e).__name__}: {e}")
+
+        # ru_maxrss is in KiB on Linux
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        retiring = done >= max_tasks or (max_memory_mb > 0 and peak_mb > max_memory_mb)
+        conn.send(reply + (retiring,))
+        if retiring:
+            return
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+    def kill(self) -> None:
+        try:
+            self.conn.close()
+        finally:
+            if self.process.is_alive():
+                self.process.kill()
+            self.process.join(timeout=5)
+
+
+class IngestionExecutor:
+    """
+    Pool of ingestion worker processes. run() must always be awaited from the same event loop.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        task_timeout: float,
+        max_tasks_per_worker: int,
+        max_memory_mb: float,
+        shm_threshold: int,
+    ):
+        self.size = max(1, workers)
+        self.task_timeout = task_timeout
+        self.max_tasks_per_worker = max(1, max_tasks_per_worker)
+        self.max_memory_mb = max_memory_mb
+        self.shm_threshold = shm_threshold
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: List[_Worker] = []
+        self.stats: Dict[str, int] = {
+            "tasks": 0, "failed": 0, "timeouts": 0, "recycled": 0, "crashed": 0, "shared_memory": 0,
+        }
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.max_tasks_per_worker, self.max_memory_mb),
+            name="ingest-worker",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        self._workers.append(worker)
+        return worker
+
+    async def _replace(self, worker: _Worker) -> None:
+        """
+        Retires a worker and queues a fresh one in its place.
+        """
+        worker.kill()
+        if worker in self._workers:
+            self._workers.remove(worker)
+        # Starting a process blocks for a moment: do it off the event loop
+        fresh = await asyncio.get_running_loop().run_in_executor(None, self._spawn)
+        self._idle.put_nowait(fresh)
+
+    async def _start(self) -> None:
+        self._idle = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        for _ in range(self.size):
+            self._idle.put_nowait(await loop.run_in_executor(None, self._spawn))
+        logger.info(f"Ingestion executor started with {self.size} worker processes.")
+
+    async def _receive(self, worker: _Worker):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = worker.conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await asyncio.wait_for(ready, self.task_timeout if self.task_timeout > 0 else None)
+        finally:
+            loop.remove_reader(fd)
+        return worker.conn.recv()
+
+    async def run(self, input_type: str, data: bytes) -> str:
+        """
+        Runs the handler for input_type on a worker process and returns the extracted text.
+
+        Raises:
+            IngestionTimeout: If the task exceeds INGEST_TASK_TIMEOUT (its worker is killed).
+            IngestionError: If the handler raises or the worker dies.
+        """
+        if input_type not in HANDLERS:
+            raise IngestionError(f"No ingestion handler for '{input_type}'.")
+        if self._idle is None:
+            await self._start()
+
+        shm = None
+        if len(data) >= self.shm_threshold:
+            shm = shared_memory.SharedMemory(create=True, size=len(data))
+            shm.buf[:len(data)] = data
+            task = (input_type, None, shm.name, len(data))
+            self.stats["shared_memory"] += 1
+        else:
+            task = (input_type, data, None, len(data))
+
+        worker = await self._idle.get()
+        self.stats["tasks"] += 1
+        try:
+            worker.conn.send(task)
+            status, result, retiring = await self._receive(worker)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            logger.error(f"Ingestion of '{input_type}' exceeded {self.task_timeout}s; restarting its worker.")
+            await self._replace(worker)
+            raise IngestionTimeout(f"Ingestion of '{input_type}' timed out.")
+        except (EOFError, OSError) as e:
+            self.stats["crashed"] += 1
+            logger.error(f"Ingestion worker died unexpectedly: {e}")
+            await self._replace(worker)
+            raise IngestionError("Ingestion worker died unexpectedly.")
+        except asyncio.CancelledError:
+            # A pending reply would desynchronize the pipe, so the worker cannot be reused
+            await asyncio.shield(self._replace(worker))
+            raise
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+        if retiring:
+            self.stats["recycled"] += 1
+            await self._replace(worker)
+        else:
+            self._idle.put_nowait(worker)
+        if status != "ok":
+            self.stats["failed"] += 1
+            raise IngestionError(result)
+        return result
+
+    def shutdown(self) -> None:
+        """
+        Stops every worker process.
+        """
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            worker.process.join(timeout=2)
+            worker.kill()
+        self._workers = []
+        self._idle = None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "workers": len(self._workers),
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            **self.stats,
+        }
+
+
+_executor: Optional[IngestionExecutor] = None
+
+
+def get_executor() -> IngestionExecutor:
+    """
+    Returns the process-wide ingestion executor.
+    """
+    global _executor
+    if _executor is None:
+        _executor = IngestionExecutor(
+            workers=config.PIPELINE_INGEST_WORKERS,
+            task_timeout=config.INGEST_TASK_TIMEOUT,
+            max_tasks_per_worker=config.INGEST_MAX_TASKS_PER_WORKER,
+            max_memory_mb=config.INGEST_MAX_WORKER_MEMORY_MB,
+            shm_threshold=config.INGEST_SHM_THRESHOLD_KB * 1024,
+        )
+    return _executor
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def _gauge_samples() -> Dict[tuple, float]:
+    executor = _executor
+    if executor is None:
+        return {}
+    stats = executor.get_stats()
+    return {("workers",): stats["workers"], ("idle",): stats["idle"]}
+
+
+def _counter_samples() -> Dict[tuple, float]:
+    executor = _executor
+    return {(event,): value for event, value in dict(executor.stats).items()} if executor is not None else {}
+
+
+metrics.Gauge("expense_ingest_processes", "Procesos de ingestión vivos y ociosos.", ["state"], function=_gauge_samples)
+metrics.Counter(
+    "expense_ingest_tasks_total",
+    "Tareas del ejecutor de ingestión: tasks, failed, timeouts, recycled, crashed y shared_memory.",
+    ["event"], function=_counter_samples,
+)
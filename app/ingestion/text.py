@@ -3,14 +3,17 @@ Handles processing of raw text inputs.
 """
 import logging
 
+from app.preprocessing.normalize_text import normalize_text
+
 logger = logging.getLogger(__name__)
 
 def process_text_input(text: str) -> str:
     """
     Takes raw text, normalizes it, and prepares it for AI extraction.
 
-    In the future, this could include more complex preprocessing like
-    language detection or PII removal.
+    Runs the shared normalization stage once (NFKC, lowercase, accent folding,
+    whitespace collapsing). Currency symbols and punctuation are kept because
+    the extraction step needs them to read amounts.
 
     Args:
         text: The raw input text.
@@ -19,6 +22,4 @@ def process_text_input(text: str) -> str:
         The processed text.
     """
     logger.info("Processing text input.")
-    # For now, normalization is simple. It will be moved to the preprocessing module.
-    normalized_text = text.lower().strip()
-    return normalized_text
+    return normalize_text(text)
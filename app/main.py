@@ -5,8 +5,11 @@ Inicializa la aplicación FastAPI, configura el registro, la base de datos
 y define los principales endpoints de la API.
 """
 import logging
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
+from typing import Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 
 # Es crucial configurar la configuración antes de otras importaciones
 from app.config import config
@@ -17,11 +20,15 @@ logger = logging.getLogger(__name__)
 
 # Import other components
 from app.schema.base import RawInput
-from app.router import process_expense_input
-from app.persistence import repositories, db
+from app.router import aprocess_expense_input, get_pipeline_stats, shutdown_pipeline
+from app import batch, metrics, permissions, recording
+from app.ingestion.executor import IngestionError, IngestionTimeout
+from app.ai import client as ai_client, classifier, admission, categorizer, resilience, cache as extraction_cache
+from app.persistence import db, dedup, repositories
+from app.persistence.dedup import DuplicateExpenseError
+from app.preprocessing import matcher
 
-# Crear tablas de base de datos al inicio
-# Esto es simple, pero para producción, usarías migraciones (ej. Alembic)
+# Aplicar las migraciones pendientes (Alembic) al inicio
 repositories.create_tables()
 
 # Inicializar la aplicación FastAPI
@@ -35,12 +42,93 @@ app = FastAPI(
 async def startup_event():
     logger.info("Inicio de la aplicación completado.")
     logger.info(f"El nivel de registro está establecido en: {config.LOG_LEVEL.upper()}")
+    metrics.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Detener el pipeline antes de cerrar el pool de conexiones del cliente de IA
+    shutdown_pipeline()
+    ai_client.shutdown()
+    extraction_cache.shutdown()
+    metrics.shutdown()
+    recording.shutdown()
 
 @app.get("/", tags=["Estado"])
 async def root():
     """Endpoint de verificación de salud."""
     return {"message": "La API del Bot de Gastos de Telegram está en ejecución."}
 
+@app.get("/matcher/version", tags=["Estado"])
+async def matcher_version():
+    """Muestra la versión activa de la configuración de proveedores y palabras clave."""
+    return matcher.get_config_version()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Exige el secreto ADMIN_TOKEN en la cabecera X-Admin-Token."""
+    if not permissions.is_admin_token_valid(x_admin_token):
+        raise HTTPException(status_code=403, detail="Se requiere un token de administración válido.")
+
+@app.post("/matcher/reload", tags=["Estado"], dependencies=[Depends(require_admin)])
+async def matcher_reload():
+    """Fuerza la recarga de la configuración de coincidencia en este worker."""
+    # Leer los CSV y compilar los índices no debe bloquear el bucle de eventos
+    version = await run_in_threadpool(matcher.reload_config)
+    return {"status": "reloaded", "version": version}
+
+async def _pipeline_stats():
+    # El estado del pipeline pertenece al bucle de IA
+    return get_pipeline_stats()
+
+@app.get("/metrics", tags=["Estado"], response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Métricas en formato de texto de Prometheus: latencias por etapa, resultados,
+    tokens del modelo, aciertos de caché y profundidad de colas.
+
+    Con METRICS_MULTIPROC_DIR devuelve la suma de todos los workers.
+    """
+    return PlainTextResponse(metrics.generate_latest(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/pipeline/stats", tags=["Estado"])
+async def pipeline_stats():
+    """Muestra la profundidad de cola y los trabajos en curso de cada etapa del pipeline."""
+    return await ai_client.run_async(_pipeline_stats())
+
+@app.get("/classifier/stats", tags=["Estado"])
+async def classifier_stats():
+    """Muestra cuántos gastos se resolvieron con la confianza local y la tasa de llamadas al auditor."""
+    return classifier.get_stats()
+
+@app.get("/categorizer/stats", tags=["Estado"])
+async def categorizer_stats():
+    """Muestra cuántas descripciones sin coincidencia resolvió el categorizador aprendido."""
+    return categorizer.get_stats()
+
+@app.get("/admission/stats", tags=["Estado"])
+async def admission_stats():
+    """Muestra la profundidad de la cola de IA, los tiempos de espera y los rechazos."""
+    return await admission.aget_stats()
+
+@app.get("/resilience/stats", tags=["Estado"])
+async def resilience_stats():
+    """Muestra reintentos, rechazos del interruptor de circuito y peticiones de cobertura de cada proveedor de IA."""
+    return resilience.get_stats()
+
+@app.get("/batch/stats", tags=["Estado"])
+async def batch_stats():
+    """Muestra los lotes procesados, los elementos por estado y las transacciones confirmadas."""
+    return batch.get_stats()
+
+@app.get("/db/stats", tags=["Estado"])
+async def db_stats():
+    """Muestra las conexiones en uso, libres y de desborde de cada pool de la base de datos y su utilización."""
+    return db.get_pool_stats()
+
+@app.get("/dedup/stats", tags=["Estado"])
+async def dedup_stats():
+    """Muestra las comprobaciones de duplicados, cuántas resolvió el filtro en memoria y los duplicados hallados."""
+    return dedup.get_stats()
+
 @app.post("/webhook/telegram", tags=["Webhooks"])
 async def process_telegram_update(request: dict):
     """
@@ -54,18 +142,22 @@ async def process_telegram_update(request: dict):
     return {"status": "received", "message": "El manejador de webhook de Telegram no está completamente implementado."}
 
 @app.post("/process-expense", tags=["Procesamiento"])
-async def process_expense(raw_input: RawInput, db_session: Session = Depends(db.get_db)):
+async def process_expense(raw_input: RawInput):
     """
     Recibe datos de gastos sin procesar, los procesa a través del pipeline completo
     y devuelve el resultado.
+
+    No se abre una sesión de BD por petición: cada etapa del pipeline usa la suya
+    solo mientras la necesita, sin retenerla durante la ingestión o la llamada al modelo.
     """
     logger.info(f"Entrada sin procesar recibida para procesamiento: {raw_input.dict()}")
+    recording.record_input(raw_input)
     
     try:
-        result = process_expense_input(db=db_session, raw_input=raw_input)
+        result = await aprocess_expense_input(db=None, raw_input=raw_input)
         
         if result:
-            return {"status": "success", "expense_id": result.id}
+            return {"status": "success", "expense_id": result.id, "duplicate_of": result.duplicate_of}
         else:
             # Esto podría suceder si la confianza es baja o ocurrió un error
             raise HTTPException(
@@ -73,6 +165,20 @@ async def process_expense(raw_input: RawInput, db_session: Session = Depends(db.
                 detail="Error al procesar el gasto. Puede requerir revisión manual o tenía datos inválidos."
             )
 
+    except DuplicateExpenseError as e:
+        # Reenvío o reintento de un gasto ya guardado: se responde con el registro existente.
+        # Si es otro gasto igual, el cliente lo confirma reenviándolo con allow_duplicate=true.
+        logger.info(f"Gasto duplicado de {raw_input.user_id}: ya existe con ID {e.existing_id}.")
+        return {"status": "duplicate", "expense_id": e.existing_id, "duplicate_of": e.existing_id, "detail": str(e)}
+    except admission.AdmissionRejected as e:
+        logger.warning(f"Entrada rechazada por el control de admisión: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+    except IngestionTimeout as e:
+        logger.error(f"Tiempo de ingestión agotado: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except IngestionError as e:
+        logger.error(f"Error de ingestión: {e}")
+        raise HTTPException(status_code=422, detail=str(e))
     except ValueError as e:
         logger.error(f"Error de validación: {e}")
         raise HTTPException(status_code=422, detail=str(e))
@@ -80,5 +186,18 @@ async def process_expense(raw_input: RawInput, db_session: Session = Depends(db.
         logger.critical(f"Ocurrió un error inesperado en el pipeline de procesamiento: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Ocurrió un error interno del servidor.")
 
+@app.post("/process-expenses/batch", tags=["Procesamiento"])
+async def process_expenses_batch(request: Request):
+    """
+    Procesa un lote de entradas (arreglo JSON o NDJSON de RawInput) y devuelve
+    un flujo NDJSON con una línea por elemento en cuanto termina.
+
+    Cada línea incluye index (posición en la entrada), id (el campo "id" del
+    elemento, si lo trae), status, expense_id, duplicate_of y errors. Los gastos
+    auto-confirmados se guardan en transacciones agrupadas.
+    """
+    items = batch.iter_items(request.stream())
+    return batch.BatchResponse(batch.encode_ndjson(batch.process_batch(items)))
+
 # Para ejecutar esta aplicación:
 # uvicorn app.main:app --reload
@@ -0,0 +1,131 @@
+"""
+Prepara una tabla `expenses` existente para la detección de duplicados.
+
+Uso:
+    python -m app.maintenance.backfill_fingerprints [--chunk-size 1000] [--dry-run]
+
+Añade las columnas fingerprint y duplicate_of si faltan, calcula la huella de
+las filas que no la tienen y crea los índices. Si el historial ya tiene
+duplicados exactos, el primero conserva la huella y los demás se tratan como
+repeticiones confirmadas: reciben la huella de su ocurrencia (1, 2...) y
+duplicate_of apuntando al primero, como los que se guardan con
+allow_duplicate. Guarda en memoria una entrada por huella mientras recorre la tabla.
+"""
+import argparse
+import logging
+import sys
+
+from sqlalchemy import inspect, text
+
+from app.config import config
+from app.persistence import db as database
+from app.persistence import dedup, repositories
+from app.persistence.repositories import ExpenseDB
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = {"fingerprint": "VARCHAR(32)", "duplicate_of": "INTEGER"}
+_INDEXES = {
+    "uq_expenses_user_fingerprint": "CREATE UNIQUE INDEX uq_expenses_user_fingerprint ON expenses (user_id, fingerprint)",
+    "ix_expenses_user_amount_date": "CREATE INDEX ix_expenses_user_amount_date ON expenses (user_id, amount, expense_date)",
+}
+
+
+def _add_columns(dry_run: bool) -> list:
+    existing = {column["name"] for column in inspect(database.engine).get_columns("expenses")}
+    missing = [name for name in _COLUMNS if name not in existing]
+    if missing and not dry_run:
+        with database.engine.begin() as connection:
+            for name in missing:
+                connection.execute(text(f"ALTER TABLE expenses ADD COLUMN {name} {_COLUMNS[name]}"))
+    return missing
+
+
+def _create_indexes(dry_run: bool) -> list:
+    inspector = inspect(database.engine)
+    existing = {index["name"] for index in inspector.get_indexes("expenses")}
+    existing |= {constraint["name"] for constraint in inspector.get_unique_constraints("expenses")}
+    missing = [name for name in _INDEXES if name not in existing]
+    if missing and not dry_run:
+        with database.engine.begin() as connection:
+            for name in missing:
+                connection.execute(text(_INDEXES[name]))
+    return missing
+
+
+def backfill_fingerprints(chunk_size: int = 1000, dry_run: bool = False) -> dict:
+    """
+    Calcula las huellas que faltan y marca los duplicados exactos del historial.
+
+    Args:
+        chunk_size: Filas leídas y actualizadas por transacción.
+        dry_run: Si es True, solo cuenta los cambios sin escribirlos.
+
+    Returns:
+        Un resumen con columnas e índices creados, filas examinadas, huellas escritas y duplicados.
+    """
+    stats = {"columns": _add_columns(dry_run), "scanned": 0, "updated": 0, "duplicates": 0}
+    if stats["columns"] and dry_run:
+        # Sin las columnas no se puede leer la tabla con el modelo actual
+        stats["indexes"] = list(_INDEXES)
+        return stats
+
+    seen = {}
+    session = database.SessionLocal()
+    try:
+        chunks = repositories.iter_expense_chunks(
+            session, chunk_size,
+            ExpenseDB.user_id, ExpenseDB.amount, ExpenseDB.currency, ExpenseDB.expense_date,
+            ExpenseDB.description, ExpenseDB.provider_name, ExpenseDB.fingerprint, ExpenseDB.duplicate_of,
+        )
+        for rows in chunks:
+            mappings = []
+            for row in rows:
+                if row.fingerprint:
+                    seen.setdefault(row.fingerprint, row.id)
+                    continue
+                key = (row.user_id, row.amount, row.currency, row.expense_date, row.description or row.provider_name)
+                fingerprint = dedup.fingerprint(*key)
+                original_id = seen.get(fingerprint)
+                if original_id is None:
+                    seen[fingerprint] = row.id
+                    mappings.append({"id": row.id, "fingerprint": fingerprint})
+                    continue
+                stats["duplicates"] += 1
+                occurrence = 1
+                while dedup.fingerprint(*key, occurrence) in seen:
+                    occurrence += 1
+                fingerprint = dedup.fingerprint(*key, occurrence)
+                seen[fingerprint] = row.id
+                mappings.append({"id": row.id, "fingerprint": fingerprint, "duplicate_of": row.duplicate_of or original_id})
+            stats["scanned"] += len(rows)
+            if dry_run:
+                stats["updated"] += len(mappings)
+            else:
+                stats["updated"] += repositories.bulk_update_expenses(session, mappings)
+            logger.info(f"Huellas: {stats['scanned']} filas examinadas, {stats['updated']} actualizadas.")
+    finally:
+        session.close()
+
+    stats["indexes"] = _create_indexes(dry_run)
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Calcula las huellas de duplicados de los gastos almacenados.")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Filas por bloque y por transacción.")
+    parser.add_argument("--dry-run", action="store_true", help="Cuenta los cambios sin escribirlos.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=config.LOG_LEVEL.upper())
+    if database.SessionLocal is None:
+        logger.critical("La base de datos no está configurada.")
+        return 1
+
+    stats = backfill_fingerprints(chunk_size=args.chunk_size, dry_run=args.dry_run)
+    logger.info(f"Huellas terminadas: {stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Mide el costo de la instrumentación de métricas.
+
+Uso:
+    python -m app.maintenance.bench_metrics [--iterations 200000]
+
+Reporta, en nanosegundos por operación, el costo de Counter.inc,
+Histogram.observe y Histogram.time con métricas activadas y desactivadas, y
+el costo estimado por gasto (un gasto registra unas OPS_PER_EXPENSE
+operaciones).
+
+Con --pipeline N, además envía N textos resueltos por el camino rápido al
+pipeline (sin guardarlos; la clasificación sí lee el historial de montos de
+la base configurada) con métricas activadas y desactivadas, y compara la
+latencia media por gasto. También mide cuánto tarda generar /metrics.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+from app import metrics, router
+from app.ai import client
+from app.ai.admission import Priority
+from app.config import config
+from app.schema.base import RawInput
+
+logger = logging.getLogger(__name__)
+
+# Observaciones por gasto: 4 etapas (histograma + contador), total, coincidencia (2),
+# extracción, historial de montos, escritura (2)
+OPS_PER_EXPENSE = 15
+
+
+def _per_op_ns(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def benchmark(iterations: int = 200000) -> dict:
+    counter = metrics.Counter("bench_events_total", "Contador de prueba.", ["stage", "outcome"])
+    histogram = metrics.Histogram("bench_stage_seconds", "Histograma de prueba.", ["stage"])
+
+    def timed():
+        with histogram.time("extract"):
+            pass
+
+    operations = {
+        "counter_inc": lambda: counter.inc("extract", "ok"),
+        "histogram_observe": lambda: histogram.observe(0.042, "extract"),
+        "histogram_time": timed,
+    }
+    report = {"iterations": iterations}
+    baseline = _per_op_ns(lambda: None, iterations)
+    enabled = config.METRICS_ENABLED
+    try:
+        for state in (True, False):
+            config.METRICS_ENABLED = state
+            suffix = "" if state else "_disabled"
+            for name, fn in operations.items():
+                report[f"{name}{suffix}_ns"] = round(_per_op_ns(fn, iterations) - baseline, 1)
+    finally:
+        config.METRICS_ENABLED = enabled
+
+    per_op = (report["counter_inc_ns"] + report["histogram_time_ns"]) / 2
+    report["per_expense_us"] = round(per_op * OPS_PER_EXPENSE / 1000, 2)
+
+    start = time.perf_counter()
+    metrics.generate_latest()
+    report["render_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return report
+
+
+async def _run_expenses(count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        await router.aprepare_expense_input(RawInput(user_id="bench", type="text", data=f"uber {100 + i % 50}"), Priority.BULK)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def benchmark_pipeline(count: int) -> dict:
+    """
+    Latencia media por gasto en el pipeline (camino rápido, sin guardar) con y sin métricas.
+    """
+    enabled = config.METRICS_ENABLED
+    report = {}
+    try:
+        client.run_sync(_run_expenses(min(count, 50)))  # calentamiento
+        for _ in range(2):
+            for state in (True, False):
+                config.METRICS_ENABLED = state
+                key = "pipeline_us" if state else "pipeline_disabled_us"
+                report[key] = min(report.get(key, float("inf")), round(client.run_sync(_run_expenses(count)), 1))
+    finally:
+        config.METRICS_ENABLED = enabled
+        router.shutdown_pipeline()
+        client.shutdown()
+    report["pipeline_overhead_pct"] = round(
+        (report["pipeline_us"] - report["pipeline_disabled_us"]) / report["pipeline_disabled_us"] * 100, 2
+    )
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mide el costo de la instrumentación de métricas.")
+    parser.add_argument("--iterations", type=int, default=200000, help="Repeticiones por operación.")
+    parser.add_argument("--pipeline", type=int, default=0, help="Gastos enviados al pipeline (0 lo omite).")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=config.LOG_LEVEL.upper())
+    report = benchmark(args.iterations)
+    if args.pipeline > 0:
+        report.update(benchmark_pipeline(args.pipeline))
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+Compara el rendimiento de escrituras concurrentes en SQLite con y sin el perfil de producción.
+
+Uso:
+    python -m app.maintenance.bench_sqlite [--processes 2] [--threads 4] [--readers 2]
+        [--read-interval 0.005] [--seconds 10]
+
+Para cada modo crea una base nueva en un directorio temporal, aplica las
+migraciones y lanza --processes procesos (como el bot y la API, o varios
+workers de uvicorn). Cada proceso tiene --threads hilos que guardan gastos con
+save_final_expense y --readers hilos que leen rangos y totales mensuales
+(una lectura cada --read-interval segundos, para no acaparar el GIL):
+
+- default: SQLITE_PROFILE=false. Cada hilo escribe con su propia conexión del
+  pool, en el modo de diario por defecto (rollback journal), como antes del perfil.
+- profile: SQLITE_PROFILE=true. WAL y PRAGMAs, y las escrituras de cada
+  proceso pasan por el hilo y la conexión de escritura (BEGIN IMMEDIATE).
+
+Informa gastos guardados por segundo, errores "database is locked" y
+latencias p50/p99 de escrituras y lecturas. El resultado depende del disco:
+conviene ejecutarlo en la máquina de despliegue.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+_MODES = {"default": "false", "profile": "true"}
+_CATEGORIES = ("Food", "Transport", "Home", "Health", "Leisure")
+
+
+def _quantile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _latencies(values: List[float]) -> Dict[str, float]:
+    return {"p50_ms": round(_quantile(values, 0.5) * 1000, 2), "p99_ms": round(_quantile(values, 0.99) * 1000, 2)}
+
+
+def _worker(threads: int, readers: int, read_interval: float, seconds: float, worker_id: int) -> Dict[str, Any]:
+    """
+    Un proceso de carga: escritores y lectores hasta que vence el plazo.
+    """
+    from sqlalchemy.exc import OperationalError
+
+    from app.persistence import db, repositories
+    from app.schema.base import FinalExpense
+
+    profile = db.uses_sqlite_profile()
+    deadline = time.monotonic() + seconds
+    lock = threading.Lock()
+    result: Dict[str, Any] = {"writes": 0, "locked": 0, "errors": 0, "reads": 0}
+    write_times: List[float] = []
+    read_times: List[float] = []
+
+    def save(expense: FinalExpense) -> None:
+        if profile:
+            # Como la aplicación: el hilo y la conexión de escritura del proceso
+            def store():
+                with db.write_session_scope() as session:
+                    repositories.save_final_expense(session, expense)
+            db.get_write_executor().submit(store).result()
+        else:
+            with db.session_scope() as session:
+                repositories.save_final_expense(session, expense)
+
+    def writer(thread_id: int) -> None:
+        rng = random.Random(f"{worker_id}-{thread_id}")
+        while time.monotonic() < deadline:
+            expense = FinalExpense(
+                user_id=f"bench-{rng.randrange(20)}",
+                provider_name="Bench",
+                amount=round(rng.uniform(1, 200), 2),
+                currency="EUR",
+                expense_date=date.today() - timedelta(days=rng.randrange(365)),
+                # Palabras al azar: la huella de duplicados ignora los números
+                description=" ".join("".join(rng.choice(string.ascii_lowercase) for _ in range(6)) for _ in range(3)),
+                category=rng.choice(_CATEGORIES),
+                expense_type="personal",
+                initial_processing_method="bench",
+                confirmed_by="bench",
+            )
+            start = time.perf_counter()
+            try:
+                save(expense)
+            except OperationalError as e:
+                with lock:
+                    result["locked" if "locked" in str(e) else "errors"] += 1
+                continue
+            except Exception:
+                with lock:
+                    result["errors"] += 1
+                continue
+            with lock:
+                result["writes"] += 1
+                write_times.append(time.perf_counter() - start)
+
+    def reader(thread_id: int) -> None:
+        rng = random.Random(f"r{worker_id}-{thread_id}")
+        while time.monotonic() < deadline:
+            user_id = f"bench-{rng.randrange(20)}"
+            start = time.perf_counter()
+            try:
+                with db.session_scope() as session:
+                    repositories.get_expenses(session, user_id, date.today() - timedelta(days=30), date.today())
+                    repositories.get_monthly_totals(session, user_id)
+            except OperationalError as e:
+                with lock:
+                    result["locked" if "locked" in str(e) else "errors"] += 1
+                continue
+            with lock:
+                result["reads"] += 1
+                read_times.append(time.perf_counter() - start)
+            time.sleep(read_interval)
+
+    workers = [threading.Thread(target=writer, args=(index,)) for index in range(threads)]
+    workers += [threading.Thread(target=reader, args=(index,)) for index in range(readers)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    db.shutdown_write_executor()
+    result["write_times"] = write_times
+    result["read_times"] = read_times
+    return result
+
+
+def run_mode(mode: str, processes: int, threads: int, readers: int, read_interval: float, seconds: float) -> Dict[str, Any]:
+    """
+    Ejecuta un modo sobre una base nueva y agrega los resultados de sus procesos.
+    """
+    with tempfile.TemporaryDirectory(prefix="bench-sqlite-") as directory:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(directory, 'bench.db')}",
+            SQLITE_PROFILE=_MODES[mode],
+            LOG_LEVEL="WARNING",
+        )
+        subprocess.run(
+            [sys.executable, "-m", "app.persistence.migrate", "upgrade"], env=env, check=True, capture_output=True
+        )
+        command = [sys.executable, "-m", "app.maintenance.bench_sqlite", "--worker",
+                   "--threads", str(threads), "--readers", str(readers),
+                   "--read-interval", str(read_interval), "--seconds", str(seconds)]
+        children = [
+            subprocess.Popen(command + ["--worker-id", str(index)], env=env, stdout=subprocess.PIPE, text=True)
+            for index in range(processes)
+        ]
+        outputs = [json.loads(child.communicate()[0].strip().splitlines()[-1]) for child in children]
+
+    write_times = [value for output in outputs for value in output["write_times"]]
+    read_times = [value for output in outputs for value in output["read_times"]]
+    writes = sum(output["writes"] for output in outputs)
+    return {
+        "mode": mode,
+        "writes": writes,
+        "writes_per_second": round(writes / seconds, 1),
+        "locked_errors": sum(output["locked"] for output in outputs),
+        "other_errors": sum(output["errors"] for output in outputs),
+        "write_latency": _latencies(write_times),
+        "reads": sum(output["reads"] for output in outputs),
+        "read_latency": _latencies(read_times),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Escrituras concurrentes en SQLite con y sin el perfil de producción.")
+    parser.add_argument("--processes", type=int, default=2, help="Procesos escribiendo a la vez.")
+    parser.add_argument("--threads", type=int, default=4, help="Hilos escritores por proceso.")
+    parser.add_argument("--readers", type=int, default=2, help="Hilos lectores por proceso.")
+    parser.add_argument("--read-interval", type=float, default=0.005, help="Pausa (segundos) entre lecturas de cada lector.")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Duración de cada modo.")
+    parser.add_argument("--modes", default="default,profile", help="Modos a comparar, separados por comas.")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-id", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(_worker(args.threads, args.readers, args.read_interval, args.seconds, args.worker_id)))
+        return 0
+
+    logging.basicConfig(level=logging.INFO)
+    report = []
+    for mode in args.modes.split(","):
+        logger.info(f"Modo {mode}: {args.processes} procesos x {args.threads} escritores, {args.seconds}s...")
+        report.append(run_mode(mode, args.processes, args.threads, args.readers, args.read_interval, args.seconds))
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
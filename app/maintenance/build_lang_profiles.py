@@ -0,0 +1,187 @@
+"""
+Genera los perfiles de n-gramas de caracteres usados por language_detect.
+
+Uso:
+    python -m app.maintenance.build_lang_profiles [--top 600]
+
+El corpus de muestra está incluido aquí para que los perfiles se puedan
+regenerar de forma reproducible. Está orientado a mensajes cortos de gastos
+en español (México) e inglés.
+"""
+import argparse
+import json
+import math
+from collections import Counter
+
+from app.preprocessing import language_detect
+
+CORPUS = {
+    "es": """
+    comida con el equipo de trabajo en el centro
+    pagué la cena de ayer con tarjeta de crédito
+    gasolina para el coche esta mañana
+    compré un monitor nuevo para la oficina
+    croquetas para el perro y arena para el gato
+    renta del departamento de este mes
+    pago de luz y agua del bimestre
+    recibo de teléfono e internet
+    taxi al aeropuerto por la noche
+    despensa en el supermercado del fin de semana
+    café con un cliente antes de la junta
+    boletos de avión para el viaje de negocios
+    hospedaje en el hotel por tres noches
+    medicinas en la farmacia para mi hija
+    consulta con el doctor y estudios de laboratorio
+    colegiatura de la escuela de los niños
+    libros y material para el curso de inglés
+    suscripción mensual de la plataforma de música
+    mantenimiento del carro en el taller
+    estacionamiento en la plaza comercial
+    regalo de cumpleaños para mi mamá
+    comida rápida en la terminal de autobuses
+    papelería y artículos de oficina
+    dominio y hosting para la página web
+    cuota del gimnasio de octubre
+    lavandería y tintorería de la semana
+    propina para el mesero del restaurante
+    desayuno en la cafetería de la esquina
+    compras en línea de ropa y zapatos
+    reparación de la computadora portátil
+    seguro del coche pagado a meses sin intereses
+    factura del contador por la declaración anual
+    transporte público y metro durante la semana
+    gastos de envío del paquete por paquetería
+    cena familiar del domingo en casa de mis papás
+    pagué la mitad de la cuenta con mi amigo
+    entradas al cine y palomitas
+    material de limpieza para la casa
+    comisión del banco por transferencia
+    depósito para la renta del local
+    el proveedor envió la factura con el impuesto incluido
+    me cobraron de más en la tienda de conveniencia
+    fue un gasto personal no del negocio
+    hoy compré unas plumas y cuadernos
+    la semana pasada pagamos el internet
+    por favor registra este gasto como negocio
+    cuánto gasté este mes en comida
+    necesito el reporte de gastos del trimestre
+    gracias por la ayuda con las cuentas
+    el precio fue de doscientos cincuenta pesos
+    compra de verduras frutas y carne en el mercado
+    pago del préstamo y los intereses
+    anualidad de la tarjeta de crédito
+    reparación de la llave del baño con el plomero
+    una pizza para la reunión con los compañeros
+    viáticos del viaje a guadalajara
+    caseta de la autopista y gasolina
+    impresiones y copias en la papelería
+    cargo automático de la suscripción de video
+    pagué en efectivo al jardinero
+    """,
+    "en": """
+    lunch with colleagues at the office downtown
+    paid for dinner last night with my credit card
+    gas for the car this morning
+    bought a new monitor for the office
+    dog food and cat litter from the pet store
+    rent for the apartment this month
+    electricity and water bill for the month
+    phone and internet bill
+    taxi to the airport at night
+    groceries at the supermarket this weekend
+    coffee with a client before the meeting
+    plane tickets for the business trip
+    hotel stay for three nights
+    medicine from the pharmacy for my daughter
+    doctor appointment and lab tests
+    school tuition for the kids
+    books and supplies for the english course
+    monthly subscription to the music streaming service
+    car maintenance at the repair shop
+    parking at the shopping mall
+    birthday gift for my mom
+    fast food at the bus station
+    stationery and office supplies
+    domain and hosting for the website
+    gym membership for october
+    laundry and dry cleaning this week
+    tip for the waiter at the restaurant
+    breakfast at the coffee shop on the corner
+    online shopping for clothes and shoes
+    laptop repair at the computer store
+    car insurance paid in monthly installments
+    accountant invoice for the annual tax return
+    public transport and subway during the week
+    shipping fees for the package delivery
+    family dinner on sunday at my parents house
+    split the bill with my friend
+    movie tickets and popcorn
+    cleaning supplies for the house
+    bank fee for the wire transfer
+    deposit for the store rent
+    the vendor sent the invoice with tax included
+    they overcharged me at the convenience store
+    it was a personal expense not a business one
+    today i bought some pens and notebooks
+    last week we paid the internet
+    please log this expense as business
+    how much did i spend this month on food
+    i need the expense report for the quarter
+    thanks for the help with the accounts
+    the price was two hundred and fifty dollars
+    vegetables fruit and meat at the farmers market
+    loan payment and interest
+    annual fee for the credit card
+    plumber fixed the bathroom faucet
+    a pizza for the team meeting
+    travel allowance for the trip to new york
+    highway toll and gas
+    prints and copies at the print shop
+    automatic charge for the video subscription
+    paid the gardener in cash
+    """,
+}
+
+
+def build_profiles(top: int) -> dict:
+    """
+    Cuenta trigramas por idioma y guarda las probabilidades logarítmicas de los más frecuentes.
+    """
+    languages = {}
+    for language, text in CORPUS.items():
+        grams = Counter()
+        words = Counter()
+        for line in text.strip().splitlines():
+            tokens = language_detect.tokenize(line)
+            words.update(tokens)
+            for token in tokens:
+                grams.update(language_detect.token_ngrams(token))
+        total = sum(grams.values())
+        common = grams.most_common(top)
+        languages[language] = {
+            "grams": {gram: round(math.log(count / total), 3) for gram, count in common},
+            # Log-probabilidad asignada a los trigramas que no están en el perfil
+            "floor": round(math.log(0.5 / total), 3),
+            "words": {word for word, count in words.most_common(80) if len(word) > 1},
+        }
+    # Las palabras comunes a ambos idiomas ("internet", "monitor") no discriminan
+    shared = set.intersection(*(profile["words"] for profile in languages.values()))
+    for profile in languages.values():
+        profile["words"] = sorted(profile["words"] - shared)
+    return {"n": language_detect.NGRAM_SIZE, "languages": languages}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Genera los perfiles de idioma de language_detect.")
+    parser.add_argument("--top", type=int, default=600, help="Trigramas conservados por idioma.")
+    args = parser.parse_args(argv)
+
+    profiles = build_profiles(args.top)
+    with open(language_detect.PROFILES_PATH, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    print(f"Perfiles escritos en {language_detect.PROFILES_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,106 @@
+"""
+Comprueba con EXPLAIN que las consultas por usuario de los repositorios usan índices.
+
+Uso:
+    python -m app.maintenance.explain_queries [--user-id u1]
+
+Muestra el plan de cada consulta (rango de fechas, categoría, totales, totales
+por categoría, últimos confirmados y resumen mensual) en la base de
+DATABASE_URL y termina con código 1 si alguna recorre completa la tabla de
+gastos o la del resumen. Admite SQLite (EXPLAIN QUERY PLAN), MySQL/MariaDB y
+PostgreSQL (EXPLAIN). Conviene ejecutarlo tras cada migración que toque
+índices o consultas.
+"""
+import argparse
+import logging
+import sys
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.persistence import db as database
+from app.persistence import repositories
+
+logger = logging.getLogger(__name__)
+
+
+def _queries(user_id: str) -> List[Tuple[str, Optional[str], object]]:
+    """
+    (nombre, índice esperado, consulta) de cada consulta revisada.
+    """
+    today = date.today()
+    start, end = today - timedelta(days=30), today
+    return [
+        ("date_range", "ix_expenses_user_date", repositories._expenses_query(user_id, start, end)),
+        ("category_range", "ix_expenses_user_category_date", repositories._expenses_query(user_id, start, end, "Food")),
+        ("totals", "ix_expenses_user_date", repositories._totals_query(user_id, start, end)),
+        ("category_totals", "ix_expenses_user_date", repositories._category_totals_query(user_id, start, end)),
+        ("recent", "ix_expenses_user_confirmed_at", repositories._recent_query(user_id, datetime.now() - timedelta(days=7))),
+        # Clave primaria (user_id, year_month, ...) del resumen mensual; su nombre depende de la base
+        ("monthly_totals", None, repositories._monthly_totals_query(user_id, repositories.year_month(start), repositories.year_month(end))),
+    ]
+
+
+def _explain(connection, query) -> List[str]:
+    dialect = connection.dialect
+    sql = str(query.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    if dialect.name == "sqlite":
+        return [row[-1] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+    result = connection.execute(text(f"EXPLAIN {sql}"))
+    if dialect.name in ("mysql", "mariadb"):
+        return [
+            f"table={row['table']} type={row['type']} key={row['key']} rows={row['rows']} extra={row['Extra']}"
+            for row in result.mappings()
+        ]
+    return [row[0] for row in result]
+
+
+def _full_scan(dialect_name: str, plan: List[str]) -> bool:
+    for line in plan:
+        # expenses y expense_monthly_totals
+        if dialect_name == "sqlite" and line.startswith("SCAN expense") and "USING" not in line:
+            return True
+        if dialect_name in ("mysql", "mariadb") and "table=expense" in line and "type=ALL" in line:
+            return True
+        if dialect_name == "postgresql" and "Seq Scan on expense" in line:
+            return True
+    return False
+
+
+def explain_queries(user_id: str = "explain-user") -> List[dict]:
+    """
+    Plan de cada consulta, índice esperado y si recorre la tabla completa.
+    """
+    results = []
+    with database.engine.connect() as connection:
+        for name, expected, query in _queries(user_id):
+            plan = _explain(connection, query)
+            results.append({
+                "query": name,
+                "expected_index": expected,
+                "uses_expected_index": expected is None or any(expected in line for line in plan),
+                "full_scan": _full_scan(connection.dialect.name, plan),
+                "plan": plan,
+            })
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Verifica con EXPLAIN los planes de las consultas por usuario.")
+    parser.add_argument("--user-id", default="explain-user", help="Usuario de ejemplo para las consultas.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    results = explain_queries(args.user_id)
+    for result in results:
+        status = "SCAN COMPLETO" if result["full_scan"] else "ok"
+        index_note = "" if result["uses_expected_index"] else f" (no usa {result['expected_index']})"
+        print(f"{result['query']}: {status}{index_note}")
+        for line in result["plan"]:
+            print(f"    {line}")
+    return 1 if any(result["full_scan"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+Servidor local compatible con OpenAI para pruebas de carga.
+
+Uso:
+    python -m app.maintenance.fake_llm [--port 8090] [--latency-ms 800] [--latency-sigma 0.5]
+        [--error-rate 0.02] [--error-status 500] [--responses llm.ndjson] [--seed 1]
+
+La aplicación se apunta a él con OPENAI_BASE_URL=http://127.0.0.1:8090/v1.
+Responde /v1/chat/completions tras una latencia log-normal (mediana
+--latency-ms, dispersión --latency-sigma; 0 la hace constante) y falla una
+fracción --error-rate de las llamadas con --error-status (429 incluye
+Retry-After), de modo que se ejercitan los reintentos y el interruptor de
+circuito.
+
+Si la conversación aparece en --responses (grabado con RECORD_LLM_PATH), se
+devuelve esa respuesta; si no, una sintética según el prompt: la extracción
+toma el primer número del texto como monto y la auditoría devuelve
+--audit-confidence. GET /stats informa las llamadas atendidas y el máximo de
+llamadas simultáneas observado (max_in_flight).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import sys
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from app.ai.prompts import AUDITOR_PROMPT, BATCH_EXTRACTOR_PROMPT, EXTRACTOR_PROMPT
+from app.config import config
+from app.recording import message_key
+
+logger = logging.getLogger(__name__)
+
+_AMOUNT = re.compile(r"\d+(?:[.,]\d{1,2})?")
+_CURRENCY = re.compile(r"\b(usd|eur|mxn|clp|ars|cop|pen|gbp)\b", re.IGNORECASE)
+
+
+def _extract(text: str) -> Dict[str, Any]:
+    amount = _AMOUNT.search(text)
+    currency = _CURRENCY.search(text)
+    description = _AMOUNT.sub("", text).strip(" ,.-") or text
+    return {
+        "amount": float(amount.group(0).replace(",", ".")) if amount else None,
+        "currency": currency.group(1).upper() if currency else config.DEFAULT_CURRENCY,
+        "description": description[:80],
+        "date": date.today().isoformat(),
+        "category": "Other",
+    }
+
+
+def synthetic_content(messages: List[Dict[str, str]], audit_confidence: float) -> str:
+    """
+    Respuesta inventada según el prompt de sistema de la conversación.
+    """
+    system = messages[0].get("content", "") if messages else ""
+    user = messages[-1].get("content", "") if messages else ""
+    if system == AUDITOR_PROMPT:
+        return json.dumps({"confidence_score": audit_confidence, "audit_notes": "Respuesta del servidor de pruebas."})
+    if system == BATCH_EXTRACTOR_PROMPT:
+        items = json.loads(user).get("items", [])
+        return json.dumps({"items": [dict(_extract(item.get("text", "")), index=item.get("index")) for item in items]})
+    if system == EXTRACTOR_PROMPT:
+        return json.dumps(_extract(user))
+    return json.dumps({})
+
+
+def load_responses(path: Optional[str]) -> Dict[str, str]:
+    """
+    Lee las respuestas grabadas (una por clave; gana la última).
+    """
+    responses: Dict[str, str] = {}
+    if not path:
+        return responses
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                responses[entry["key"]] = entry["content"]
+    return responses
+
+
+def create_app(
+    latency_ms: float = 800.0,
+    latency_sigma: float = 0.5,
+    error_rate: float = 0.0,
+    error_status: int = 500,
+    responses: Optional[Dict[str, str]] = None,
+    audit_confidence: float = 0.9,
+    seed: Optional[int] = None,
+) -> FastAPI:
+    app = FastAPI(title="Servidor de pruebas compatible con OpenAI")
+    rng = random.Random(seed)
+    responses = responses or {}
+    stats = {"calls": 0, "errors": 0, "replayed": 0, "synthetic": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def _delay() -> float:
+        if latency_sigma <= 0:
+            return latency_ms / 1000
+        return rng.lognormvariate(0.0, latency_sigma) * latency_ms / 1000
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages") or []
+        stats["calls"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(_delay())
+        finally:
+            stats["in_flight"] -= 1
+
+        if rng.random() < error_rate:
+            stats["errors"] += 1
+            headers = {"Retry-After": "1"} if error_status == 429 else None
+            return JSONResponse({"error": {"message": "Error simulado."}}, status_code=error_status, headers=headers)
+
+        content = responses.get(message_key(messages[-1].get("content") or "")) if messages else None
+        if content is not None:
+            stats["replayed"] += 1
+        else:
+            stats["synthetic"] += 1
+            content = synthetic_content(messages, audit_confidence)
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        return {
+            "id": f"chatcmpl-fake-{stats['calls']}",
+            "object": "chat.completion",
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": prompt_tokens + len(content) // 4,
+            },
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Servidor local compatible con OpenAI para pruebas de carga.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="Latencia mediana de cada llamada.")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Dispersión log-normal (0: constante).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de llamadas que fallan (0-1).")
+    parser.add_argument("--error-status", type=int, default=500, help="Código HTTP de las llamadas fallidas.")
+    parser.add_argument("--responses", help="Respuestas grabadas con RECORD_LLM_PATH.")
+    parser.add_argument("--audit-confidence", type=float, default=0.9, help="Confianza de las auditorías sintéticas.")
+    parser.add_argument("--seed", type=int, help="Semilla para latencias y errores reproducibles.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    responses = load_responses(args.responses)
+    logger.info(f"{len(responses)} respuestas grabadas cargadas.")
+    app = create_app(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        responses=responses,
+        audit_confidence=args.audit_confidence,
+        seed=args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+"""
+Reproduce tráfico grabado contra la aplicación y mide su capacidad.
+
+Uso:
+    python -m app.maintenance.loadtest recording.ndjson [--url http://127.0.0.1:8000]
+        [--rate 20 | --speed 1.0] [--concurrency 200] [--passes 1] [--limit N]
+        [--keep-users] [--output report.json]
+
+La grabación se obtiene con RECORD_PATH (app.recording). Para no llamar a
+OpenAI, la aplicación se arranca contra el servidor falso:
+
+    python -m app.maintenance.fake_llm --port 8090 --latency-ms 800 --error-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 uvicorn app.main:app
+
+Las entradas se envían a /process-expense en lazo abierto: a --rate por
+segundo o, sin --rate, con los tiempos originales acelerados por --speed. Si
+hay --concurrency peticiones en curso, el envío espera; schedule_lag_ms indica
+cuánto se retrasó respecto al plan (si crece, el generador fue el cuello de
+botella y la tasa real es throughput_rps).
+
+Cada pasada usa usuarios nuevos (sufijo con la pasada y la corrida) para que
+la detección de duplicados no descarte las repeticiones; --keep-users
+conserva los seudónimos grabados.
+
+El informe JSON incluye throughput, latencia de extremo a extremo, p50/p95/p99
+de cada etapa del pipeline, de las llamadas al modelo y de la base (a partir
+de la diferencia de /metrics antes y después) y el crecimiento de la base
+(filas y bytes) leído de DATABASE_URL.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][\w:]*)(?:\{(.*)\})?\s+(\S+)$")
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+# Histogramas de /metrics incluidos en el informe: clave del informe -> (métrica, etiqueta de agrupación)
+_HISTOGRAMS = {
+    "stages": ("expense_pipeline_stage_seconds", "stage"),
+    "processing": ("expense_processing_seconds", "outcome"),
+    "llm": ("expense_llm_request_seconds", "purpose"),
+    "db_operations": ("expense_db_seconds", "operation"),
+}
+
+
+def read_recording(path: str) -> List[Dict[str, Any]]:
+    entries = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    entries.sort(key=lambda entry: entry.get("t", 0.0))
+    return entries
+
+
+def plan(entries: List[Dict[str, Any]], rate: float, speed: float, passes: int, limit: Optional[int]) -> List[Tuple[float, int, Dict[str, Any]]]:
+    """
+    Devuelve (segundo de envío, pasada, entrada) de cada petición.
+    """
+    if not entries:
+        return []
+    start = entries[0].get("t", 0.0)
+    span = entries[-1].get("t", 0.0) - start
+    schedule = []
+    for run in range(passes):
+        for entry in entries:
+            if limit is not None and len(schedule) >= limit:
+                return schedule
+            if rate > 0:
+                offset = len(schedule) / rate
+            else:
+                # Pasadas consecutivas con el mismo ritmo que la grabación (un segundo entre ellas)
+                offset = (run * (span + 1.0) + entry.get("t", 0.0) - start) / speed
+            schedule.append((offset, run, entry))
+    return schedule
+
+
+# --- Lectura de /metrics ---
+
+def parse_metrics(body: str) -> Dict[str, Dict[Tuple[Tuple[str, str], ...], float]]:
+    """
+    Convierte el texto de Prometheus en {muestra: {etiquetas: valor}}.
+    """
+    samples: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+    for line in body.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        key = tuple(sorted(_LABEL.findall(labels or "")))
+        samples.setdefault(name, {})[key] = float(value)
+    return samples
+
+
+def _quantile(buckets: List[Tuple[float, float]], q: float) -> Optional[float]:
+    """
+    Cuantil aproximado por interpolación lineal dentro de la cubeta (como histogram_quantile).
+    """
+    total = buckets[-1][1] if buckets else 0
+    if not total:
+        return None
+    target = q * total
+    lower, below = 0.0, 0.0
+    for bound, cumulative in buckets:
+        if cumulative >= target:
+            if bound == float("inf"):
+                return lower
+            inside = cumulative - below
+            return lower + (bound - lower) * ((target - below) / inside if inside else 1.0)
+        lower, below = bound, cumulative
+    return lower
+
+
+def histogram_summary(before: Dict, after: Dict, name: str, group: str) -> Dict[str, Dict[str, Any]]:
+    """
+    p50/p95/p99 (ms) y conteo de las observaciones hechas entre dos lecturas, por valor de group.
+    """
+    series: Dict[str, Dict[float, float]] = {}
+    sums: Dict[str, float] = {}
+    for labels, value in after.get(f"{name}_bucket", {}).items():
+        label_map = dict(labels)
+        delta = value - before.get(f"{name}_bucket", {}).get(labels, 0.0)
+        bound = float("inf") if label_map["le"] == "+Inf" else float(label_map["le"])
+        key = label_map.get(group, "")
+        # Se suman las demás etiquetas (p. ej. outcome de las llamadas al modelo)
+        series.setdefault(key, {})
+        series[key][bound] = series[key].get(bound, 0.0) + delta
+    for labels, value in after.get(f"{name}_sum", {}).items():
+        key = dict(labels).get(group, "")
+        sums[key] = sums.get(key, 0.0) + value - before.get(f"{name}_sum", {}).get(labels, 0.0)
+
+    summary = {}
+    for key, counts in sorted(series.items()):
+        buckets = sorted(counts.items())
+        count = buckets[-1][1] if buckets else 0
+        if not count:
+            continue
+        summary[key] = {"count": int(count), "mean_ms": round(sums.get(key, 0.0) / count * 1000, 2)}
+        for q in (0.5, 0.95, 0.99):
+            value = _quantile(buckets, q)
+            summary[key][f"p{int(q * 100)}_ms"] = round(value * 1000, 2) if value is not None else None
+    return summary
+
+
+def counter_delta(before: Dict, after: Dict, name: str) -> float:
+    return sum(value - before.get(name, {}).get(labels, 0.0) for labels, value in after.get(name, {}).items())
+
+
+# --- Base de datos ---
+
+def db_snapshot(database_url: str) -> Dict[str, Any]:
+    """
+    Filas de la tabla de gastos y bytes en disco (solo SQLite; incluye el WAL).
+    """
+    snapshot: Dict[str, Any] = {}
+    try:
+        engine = create_engine(database_url)
+        try:
+            with engine.connect() as connection:
+                snapshot["rows"] = connection.execute(text("SELECT COUNT(*) FROM expenses")).scalar()
+        finally:
+            engine.dispose()
+    except Exception as e:
+        logger.warning(f"No se pudo leer la base de datos: {e}")
+        return snapshot
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite" and url.database:
+        snapshot["bytes"] = sum(
+            os.path.getsize(path) for path in (url.database, f"{url.database}-wal") if os.path.exists(path)
+        )
+    return snapshot
+
+
+def _percentiles_ms(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1] * 1000, 2)}
+
+
+# --- Reproducción ---
+
+async def _send(client: httpx.AsyncClient, payload: Dict[str, Any]) -> Tuple[str, float]:
+    start = time.perf_counter()
+    try:
+        response = await client.post("/process-expense", json=payload)
+    except httpx.HTTPError as e:
+        return f"error_{type(e).__name__}", time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+    if response.status_code == 200:
+        return response.json().get("status", "ok"), elapsed
+    return f"http_{response.status_code}", elapsed
+
+
+async def replay(
+    schedule: List[Tuple[float, int, Dict[str, Any]]],
+    url: str,
+    concurrency: int,
+    timeout: float,
+    user_suffix: Optional[str],
+) -> Dict[str, Any]:
+    """
+    Envía las entradas según el plan y devuelve latencias, estados y retrasos.
+    """
+    statuses: Dict[str, int] = {}
+    latencies: List[float] = []
+    lags: List[float] = []
+    slots = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        async def one(payload: Dict[str, Any]) -> None:
+            try:
+                status, elapsed = await _send(client, payload)
+            finally:
+                slots.release()
+            statuses[status] = statuses.get(status, 0) + 1
+            latencies.append(elapsed)
+
+        tasks = []
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for offset, run, entry in schedule:
+            delay = start + offset - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await slots.acquire()
+            lags.append(max(0.0, loop.time() - start - offset))
+            user_id = entry["user_id"] if user_suffix is None else f"{entry['user_id']}~{user_suffix}-{run}"
+            payload = {"user_id": user_id, "type": entry.get("type", "text"), "data": entry["data"]}
+            tasks.append(asyncio.ensure_future(one(payload)))
+        await asyncio.gather(*tasks)
+        duration = loop.time() - start
+
+    return {"duration": duration, "statuses": statuses, "latencies": latencies, "lags": lags}
+
+
+async def _get_metrics(url: str) -> Dict:
+    try:
+        async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+            response = await client.get("/metrics")
+            response.raise_for_status()
+            return parse_metrics(response.text)
+    except httpx.HTTPError as e:
+        logger.warning(f"No se pudo leer /metrics: {e}")
+        return {}
+
+
+async def run(
+    recording: str,
+    url: str = "http://127.0.0.1:8000",
+    rate: float = 0.0,
+    speed: float = 1.0,
+    concurrency: int = 200,
+    passes: int = 1,
+    limit: Optional[int] = None,
+    keep_users: bool = False,
+    timeout: float = 120.0,
+    database_url: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Ejecuta una prueba de carga completa y devuelve el informe.
+    """
+    schedule = plan(read_recording(recording), rate, speed, passes, limit)
+    database_url = database_url if database_url is not None else config.DATABASE_URL
+    run_id = uuid.uuid4().hex[:6]
+
+    db_before = db_snapshot(database_url) if database_url else {}
+    metrics_before = await _get_metrics(url)
+    result = await replay(schedule, url, concurrency, timeout, None if keep_users else run_id)
+    metrics_after = await _get_metrics(url)
+    db_after = db_snapshot(database_url) if database_url else {}
+
+    duration = result["duration"]
+    report: Dict[str, Any] = {
+        "run": {
+            "id": run_id, "recording": recording, "url": url, "rate": rate, "speed": speed,
+            "concurrency": concurrency, "passes": passes, "started_at": time.time() - duration,
+        },
+        "requests": len(schedule),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(schedule) / duration, 2) if duration else None,
+        "statuses": dict(sorted(result["statuses"].items())),
+        "latency_ms": _percentiles_ms(result["latencies"]),
+        "schedule_lag_ms": _percentiles_ms(result["lags"]),
+    }
+    for key, (name, group) in _HISTOGRAMS.items():
+        report[key] = histogram_summary(metrics_before, metrics_after, name, group)
+
+    db = {"rows_written": int(counter_delta(metrics_before, metrics_after, "expense_db_rows_written_total"))}
+    if "rows" in db_before and "rows" in db_after:
+        db.update(rows_before=db_before["rows"], rows_after=db_after["rows"], rows_added=db_after["rows"] - db_before["rows"])
+    if "bytes" in db_before and "bytes" in db_after:
+        db.update(bytes_before=db_before["bytes"], bytes_after=db_after["bytes"], bytes_added=db_after["bytes"] - db_before["bytes"])
+        if db.get("rows_added"):
+            db["bytes_per_row"] = round(db["bytes_added"] / db["rows_added"], 1)
+    report["db"] = db
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Reproduce tráfico grabado contra la aplicación y mide su capacidad.")
+    parser.add_argument("recording", help="Archivo NDJSON grabado con RECORD_PATH.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="URL base de la aplicación.")
+    parser.add_argument("--rate", type=float, default=0.0, help="Peticiones por segundo (0: ritmo de la grabación).")
+    parser.add_argument("--speed", type=float, default=1.0, help="Aceleración del ritmo grabado si no hay --rate.")
+    parser.add_argument("--concurrency", type=int, default=200, help="Peticiones en curso como máximo.")
+    parser.add_argument("--passes", type=int, default=1, help="Veces que se reproduce la grabación.")
+    parser.add_argument("--limit", type=int, help="Número máximo de peticiones.")
+    parser.add_argument("--keep-users", action="store_true", help="Usa los seudónimos grabados sin sufijo.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Segundos de espera por petición.")
+    parser.add_argument("--database-url", help="Base a medir (por defecto DATABASE_URL; vacío lo omite).")
+    parser.add_argument("--output", help="Archivo del informe JSON (por defecto, la salida estándar).")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=config.LOG_LEVEL.upper())
+    report = asyncio.run(run(
+        args.recording, url=args.url, rate=args.rate, speed=args.speed, concurrency=args.concurrency,
+        passes=args.passes, limit=args.limit, keep_users=args.keep_users, timeout=args.timeout,
+        database_url=args.database_url,
+    ))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
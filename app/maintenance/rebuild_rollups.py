@@ -0,0 +1,43 @@
+"""
+Recalcula el resumen mensual (expense_monthly_totals) desde la tabla de gastos.
+
+Uso:
+    python -m app.maintenance.rebuild_rollups [--user-id u1] [--dry-run]
+
+Los repositorios mantienen el resumen en la misma transacción que cada gasto
+y cada corrección; este comando repara desviaciones de escrituras hechas por
+fuera (SQL a mano, restauraciones parciales). Compara el resumen con los
+agregados de los gastos y, si hay diferencias, lo reemplaza en una sola
+transacción. Con --dry-run solo informa cuántas filas difieren.
+"""
+import argparse
+import logging
+import sys
+
+from app.config import config
+from app.persistence import db as database
+from app.persistence import repositories
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Recalcula el resumen mensual de gastos.")
+    parser.add_argument("--user-id", help="Solo este usuario (por defecto, todos).")
+    parser.add_argument("--dry-run", action="store_true", help="Cuenta las filas que difieren sin escribirlas.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=config.LOG_LEVEL.upper())
+    if database.SessionLocal is None:
+        logger.critical("La base de datos no está configurada.")
+        return 1
+
+    with database.write_session_scope() as session:
+        stats = repositories.rebuild_monthly_totals(session, user_id=args.user_id, dry_run=args.dry_run)
+    action = "difieren" if args.dry_run or not stats["drifted"] else "corregidas"
+    logger.info(f"Resumen mensual: {stats['rows']} filas, {stats['drifted']} {action}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
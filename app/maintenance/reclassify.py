@@ -0,0 +1,99 @@
+"""
+Reclasificación masiva de gastos tras cambios en providers.csv / keywords.csv.
+
+Uso:
+    python -m app.maintenance.reclassify [--chunk-size 1000] [--dry-run]
+
+Recorre la tabla `expenses` por bloques, vuelve a aplicar el matcher a cada
+descripción y actualiza en bloque las filas cuya clasificación cambió. La
+memoria usada es constante respecto al tamaño de la tabla.
+"""
+import argparse
+import logging
+import sys
+
+from app.config import config
+from app.persistence import db as database
+from app.persistence import repositories
+from app.persistence.repositories import ExpenseDB
+from app.preprocessing import matcher
+
+logger = logging.getLogger(__name__)
+
+# Columnas de ExpenseDB que la reclasificación puede modificar
+_FIELDS = ("category", "subcategory", "expense_type")
+
+
+def _changes_for(row, metadata) -> dict:
+    """
+    Calcula las columnas que cambian para una fila según los metadatos del matcher.
+    """
+    changes = {}
+    for field in _FIELDS:
+        value = metadata.get(field)
+        if value and value != getattr(row, field):
+            changes[field] = value
+    if metadata.get("match_type") in ("provider", "fuzzy_provider") and metadata["matched_name"] != row.provider_name:
+        changes["provider_name"] = metadata["matched_name"]
+    return changes
+
+
+def reclassify_expenses(chunk_size: int = 1000, dry_run: bool = False) -> dict:
+    """
+    Reclasifica todos los gastos almacenados.
+
+    Args:
+        chunk_size: Filas leídas y actualizadas por transacción.
+        dry_run: Si es True, solo cuenta los cambios sin escribirlos.
+
+    Returns:
+        Un resumen con filas examinadas, coincidencias y filas actualizadas.
+    """
+    stats = {"scanned": 0, "matched": 0, "updated": 0}
+    session = database.SessionLocal()
+    try:
+        chunks = repositories.iter_expense_chunks(
+            session, chunk_size,
+            ExpenseDB.description, ExpenseDB.provider_name,
+            ExpenseDB.category, ExpenseDB.subcategory, ExpenseDB.expense_type,
+        )
+        for rows in chunks:
+            mappings = []
+            descriptions = (row.description or row.provider_name for row in rows)
+            for row, metadata in zip(rows, matcher.iter_metadata_from_matches(descriptions)):
+                if not metadata:
+                    continue
+                stats["matched"] += 1
+                changes = _changes_for(row, metadata)
+                if changes:
+                    changes["id"] = row.id
+                    mappings.append(changes)
+            stats["scanned"] += len(rows)
+            if dry_run:
+                stats["updated"] += len(mappings)
+            else:
+                stats["updated"] += repositories.bulk_update_expenses(session, mappings)
+            logger.info(f"Reclasificación: {stats['scanned']} filas examinadas, {stats['updated']} actualizadas.")
+    finally:
+        session.close()
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Reclasifica los gastos almacenados con la configuración actual.")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Filas por bloque y por transacción.")
+    parser.add_argument("--dry-run", action="store_true", help="Cuenta los cambios sin escribirlos.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=config.LOG_LEVEL.upper())
+    if database.SessionLocal is None:
+        logger.critical("La base de datos no está configurada.")
+        return 1
+
+    stats = reclassify_expenses(chunk_size=args.chunk_size, dry_run=args.dry_run)
+    logger.info(f"Reclasificación terminada: {stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
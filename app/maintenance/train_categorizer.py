@@ -0,0 +1,137 @@
+"""
+Entrena el categorizador local con el historial de gastos confirmados.
+
+Uso:
+    python -m app.maintenance.train_categorizer [--holdout 10] [--chunk-size 1000] [--output RUTA] [--dry-run]
+
+Lee la tabla `expenses` por bloques, reserva una fracción determinística de
+las filas (por ID) para evaluación y reporta, sobre esa fracción:
+
+- accuracy: aciertos sobre todas las filas reservadas.
+- coverage: proporción con confianza >= CATEGORIZER_MIN_CONFIDENCE (las que
+  el categorizador respondería en producción).
+- covered_accuracy: aciertos dentro de esa proporción.
+
+Después vuelve a entrenar con todas las filas y guarda el modelo en
+CATEGORIZER_MODEL_PATH (o --output), salvo con --dry-run.
+"""
+import argparse
+import logging
+import sys
+import time
+
+from app.ai import categorizer
+from app.config import config
+from app.persistence import db as database
+from app.persistence import repositories
+from app.persistence.repositories import ExpenseDB
+
+logger = logging.getLogger(__name__)
+
+
+def _iter_samples(chunk_size: int):
+    """
+    Recorre los gastos clasificados como (id, rasgos, etiqueta).
+    """
+    session = database.SessionLocal()
+    try:
+        chunks = repositories.iter_expense_chunks(
+            session, chunk_size,
+            ExpenseDB.user_id, ExpenseDB.description, ExpenseDB.provider_name,
+            ExpenseDB.category, ExpenseDB.subcategory, ExpenseDB.expense_type,
+        )
+        for rows in chunks:
+            for row in rows:
+                if row.category in categorizer.UNKNOWN_CATEGORIES:
+                    continue
+                description = row.description or row.provider_name
+                feats = categorizer.features(description, row.user_id)
+                if feats:
+                    yield row.id, feats, categorizer.label_of(row.category, row.subcategory, row.expense_type)
+    finally:
+        session.close()
+
+
+def evaluate(model: categorizer.CategorizerModel, samples, threshold: float) -> dict:
+    """
+    Calcula accuracy, coverage y covered_accuracy sobre pares (rasgos, etiqueta).
+    """
+    total = correct = covered = covered_correct = 0
+    elapsed = 0.0
+    for feats, label in samples:
+        start = time.perf_counter()
+        predicted, probability = model.predict(feats)
+        elapsed += time.perf_counter() - start
+        total += 1
+        hit = predicted == label
+        correct += hit
+        if probability >= threshold:
+            covered += 1
+            covered_correct += hit
+    return {
+        "holdout_rows": total,
+        "accuracy": round(correct / total, 4) if total else 0.0,
+        "coverage": round(covered / total, 4) if total else 0.0,
+        "covered_accuracy": round(covered_correct / covered, 4) if covered else 0.0,
+        "predict_ms": round(elapsed / total * 1000, 4) if total else 0.0,
+    }
+
+
+def train(holdout: int = 10, chunk_size: int = 1000, output: str = None, dry_run: bool = False) -> dict:
+    """
+    Evalúa el categorizador sobre una fracción reservada y guarda el modelo final.
+
+    Args:
+        holdout: Porcentaje de filas (por ID) reservadas para evaluación; 0 omite la evaluación.
+        chunk_size: Filas leídas por consulta.
+        output: Ruta del modelo; por defecto CATEGORIZER_MODEL_PATH.
+        dry_run: Si es True, no guarda el modelo.
+
+    Returns:
+        Un resumen con las filas usadas, las etiquetas y las métricas de evaluación.
+    """
+    report = {"rows": 0, "labels": 0}
+    if holdout > 0:
+        train_samples, heldout_samples = [], []
+        for row_id, feats, label in _iter_samples(chunk_size):
+            (heldout_samples if row_id % 100 < holdout else train_samples).append((feats, label))
+        model = categorizer.CategorizerModel.train(train_samples)
+        report.update(evaluate(model, heldout_samples, config.CATEGORIZER_MIN_CONFIDENCE))
+        del train_samples, heldout_samples
+
+    # El modelo que se publica aprende de todas las filas
+    def all_samples():
+        for _, feats, label in _iter_samples(chunk_size):
+            report["rows"] += 1
+            yield feats, label
+
+    model = categorizer.CategorizerModel.train(all_samples())
+    report["labels"] = len(model.labels)
+    report["features"] = len(model.weights)
+    if not dry_run:
+        path = output or config.CATEGORIZER_MODEL_PATH
+        model.save(path)
+        report["path"] = path
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Entrena el categorizador local con los gastos confirmados.")
+    parser.add_argument("--holdout", type=int, default=10, help="Porcentaje de filas reservadas para evaluación.")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Filas leídas por consulta.")
+    parser.add_argument("--output", default=None, help="Ruta del modelo (por defecto CATEGORIZER_MODEL_PATH).")
+    parser.add_argument("--dry-run", action="store_true", help="Evalúa sin guardar el modelo.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=config.LOG_LEVEL.upper())
+    if database.SessionLocal is None:
+        logger.critical("La base de datos no está configurada.")
+        return 1
+
+    report = train(holdout=args.holdout, chunk_size=args.chunk_size, output=args.output, dry_run=args.dry_run)
+    logger.info(f"Entrenamiento del categorizador terminado: {report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+"""
+Métricas de la aplicación en formato de texto de Prometheus.
+
+Contadores, gauges e histogramas propios, sin dependencias externas. Registrar
+una observación cuesta una búsqueda en un diccionario y un incremento bajo un
+candado (unos cientos de nanosegundos; se mide con
+`python -m app.maintenance.bench_metrics`), así que se pueden instrumentar
+las rutas calientes sin muestreo.
+
+Los módulos declaran sus métricas al importarse:
+
+    _STAGE_SECONDS = metrics.Histogram("expense_stage_seconds", "Duración por etapa.", ["stage"])
+    with _STAGE_SECONDS.time("ingest"):
+        ...
+
+Una métrica con `function` no guarda valores: la función devuelve
+{etiquetas: valor} en cada lectura. Así se exportan los contadores que los
+módulos ya llevan en sus diccionarios `stats`, y las profundidades de cola.
+
+Varios workers: con METRICS_MULTIPROC_DIR cada proceso escribe su estado en
+`<pid>.json` dentro de ese directorio cada METRICS_FLUSH_INTERVAL segundos, y
+/metrics suma los archivos de todos los procesos. Los contadores e
+histogramas de procesos terminados se conservan (un contador no debe
+retroceder); los gauges solo se suman para procesos vivos. El directorio debe
+vaciarse antes de arrancar el servidor.
+"""
+import bisect
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+# Segundos: desde una coincidencia local hasta una llamada lenta al modelo
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: Dict[str, "_Metric"] = {}
+_registry_lock = threading.Lock()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            if name in _registry:
+                raise ValueError(f"La métrica '{name}' ya está registrada.")
+            _registry[name] = self
+
+    def samples(self) -> List[List[Any]]:
+        """
+        Devuelve [[etiquetas, valor], ...] con el estado actual.
+        """
+        if self.function is not None:
+            try:
+                values = self.function()
+            except Exception as e:
+                logger.warning(f"No se pudo leer la métrica '{self.name}': {e}")
+                return []
+            return [[list(labels), value] for labels, value in values.items()]
+        with self._lock:
+            return [[list(labels), self._copy(value)] for labels, value in self._values.items()]
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        return value
+
+
+class Counter(_Metric):
+    """
+    Valor que solo crece. Por convención el nombre termina en _total.
+    """
+
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        if not config.METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Valor que sube y baja (profundidad de cola, trabajos en curso).
+    """
+
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        if not config.METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = value
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_start")
+
+    def __init__(self, histogram: "Histogram", labels: Tuple[str, ...]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(time.perf_counter() - self._start, *self._labels)
+
+
+class Histogram(_Metric):
+    """
+    Distribución de valores (normalmente segundos) en cubetas fijas.
+
+    Cada serie guarda el conteo de cada cubeta (sin acumular) más la suma; la
+    acumulación que exige el formato de Prometheus se hace al exportar.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        if not config.METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # len(buckets) cubetas + la de +Inf, y la suma al final
+                series = self._values[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labels: str) -> _Timer:
+        """
+        Context manager que observa la duración del bloque en segundos.
+        """
+        return _Timer(self, labels)
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        return list(value)
+
+
+_HANDLER_SECONDS = Histogram(
+    "expense_telegram_handler_seconds",
+    "Duración de los manejadores de Telegram; outcome error si lanzaron una excepción.",
+    ["handler", "outcome"],
+)
+
+
+def telegram_handler(name: str):
+    """
+    Decorador para manejadores asíncronos de Telegram: mide su duración y su resultado.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await fn(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                _HANDLER_SECONDS.observe(time.perf_counter() - start, name, outcome)
+        return wrapper
+    return decorator
+
+
+# --- Recolección y exportación ---
+
+def snapshot() -> Dict[str, Any]:
+    """
+    Estado de todas las métricas de este proceso, serializable como JSON.
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+    state = {}
+    for metric in metrics:
+        state[metric.name] = {
+            "kind": metric.kind,
+            "help": metric.documentation,
+            "labels": list(metric.labelnames),
+            "buckets": list(getattr(metric, "buckets", ())),
+            "samples": metric.samples(),
+        }
+    return {"pid": os.getpid(), "time": time.time(), "metrics": state}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(snapshots: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Suma las métricas de varios procesos serie a serie.
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for snap in snapshots:
+        alive = snap["pid"] == os.getpid() or _pid_alive(snap["pid"])
+        for name, metric in snap["metrics"].items():
+            if metric["kind"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, {**metric, "series": {}})
+            series = target["series"]
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                if metric["kind"] == "histogram":
+                    current = series.get(key)
+                    if current is None or len(current) != len(value):
+                        series[key] = list(value)
+                    else:
+                        series[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    series[key] = series.get(key, 0.0) + value
+    return merged
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not float(value).is_integer() else str(int(value))
+
+
+def render(merged: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Convierte métricas combinadas al formato de texto de Prometheus (0.0.4).
+    """
+    lines: List[str] = []
+    for name, metric in merged.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric["labels"]
+        for labels, value in sorted(metric["series"].items()):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_labels(names, labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric["buckets"] + [float("inf")], value[:-1]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{name}_bucket{_labels(names, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, labels)} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{_labels(names, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Modo multiproceso ---
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(config.METRICS_MULTIPROC_DIR, f"{pid}.json")
+
+
+def write_snapshot() -> None:
+    """
+    Escribe el estado de este proceso en METRICS_MULTIPROC_DIR (reemplazo atómico).
+    """
+    if not config.METRICS_MULTIPROC_DIR:
+        return
+    path = _snapshot_path(os.getpid())
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(snapshot(), fh, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"No se pudieron escribir las métricas en {path}: {e}")
+
+
+def _read_snapshots() -> List[Dict[str, Any]]:
+    snapshots = []
+    for path in glob.glob(os.path.join(config.METRICS_MULTIPROC_DIR, "*.json")):
+        try:
+            with open(path, encoding="utf-8") as fh:
+                snapshots.append(json.load(fh))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Archivo de métricas ilegible {path}: {e}")
+    return snapshots
+
+
+def generate_latest() -> str:
+    """
+    Texto para /metrics: este proceso, o la suma de todos los workers en modo multiproceso.
+    """
+    if not config.METRICS_MULTIPROC_DIR:
+        return render(_merge([snapshot()]))
+    own = snapshot()
+    snapshots = [s for s in _read_snapshots() if s.get("pid") != own["pid"]]
+    return render(_merge(snapshots + [own]))
+
+
+_flusher: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def _flush_loop() -> None:
+    while not _stop.wait(config.METRICS_FLUSH_INTERVAL):
+        write_snapshot()
+
+
+def start() -> None:
+    """
+    Arranca la escritura periódica del estado en modo multiproceso.
+    """
+    global _flusher
+    if not config.METRICS_MULTIPROC_DIR or _flusher is not None:
+        return
+    os.makedirs(config.METRICS_MULTIPROC_DIR, exist_ok=True)
+    _stop.clear()
+    _flusher = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+    _flusher.start()
+    write_snapshot()
+
+
+def shutdown() -> None:
+    """
+    Detiene la escritura periódica y deja el estado final en disco.
+    """
+    global _flusher
+    if _flusher is None:
+        return
+    _stop.set()
+    _flusher.join(timeout=5)
+    _flusher = None
+    write_snapshot()
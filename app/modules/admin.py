@@ -4,6 +4,9 @@ Handlers for admin-only commands.
 from telegram import Update
 from telegram.ext import ContextTypes
 
+from app import metrics
+
+@metrics.telegram_handler("admin")
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles an admin-specific command (stub)."""
     # You would add a permission check here
@@ -4,6 +4,9 @@ Handler for the /search command.
 from telegram import Update
 from telegram.ext import ContextTypes
 
+from app import metrics
+
+@metrics.telegram_handler("search")
 async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Searches the expense database (stub)."""
     await update.message.reply_text("Search command is not yet implemented.")
@@ -4,6 +4,9 @@ Manejador para el comando /start.
 from telegram import Update
 from telegram.ext import ContextTypes
 
+from app import metrics
+
+@metrics.telegram_handler("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Envía un mensaje de bienvenida cuando se emite el comando /start."""
     user = update.effective_user
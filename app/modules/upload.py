@@ -8,11 +8,23 @@ import logging
 from app.schema.base import RawInput
 # Esta es una integración simplificada. En una aplicación real, probablemente
 # tendrías una cola o una forma más robusta de activar el pipeline de procesamiento.
-from app.router import process_expense_input
-from app.persistence.db import get_db
+from app.router import aprocess_expense_input
+from app.ai.admission import AdmissionRejected
+from app.persistence.dedup import DuplicateExpenseError
+from app import metrics
 
 logger = logging.getLogger(__name__)
 
+# Un mensaje que empieza así confirma que es otro gasto igual a uno ya registrado
+_REPEAT_PREFIX = "+"
+
+_MESSAGES_TOTAL = metrics.Counter(
+    "expense_telegram_messages_total",
+    "Mensajes de Telegram por resultado: stored, duplicate, review, rejected, error o unsupported.",
+    ["result"],
+)
+
+@metrics.telegram_handler("message")
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Maneja mensajes regulares y activa el pipeline de procesamiento de gastos.
@@ -22,27 +34,49 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Este es un ejemplo muy simplificado.
     # Una implementación real necesita manejar archivos, voz, etc.
     if update.message.text:
+        text = update.message.text.strip()
+        repeat = text.startswith(_REPEAT_PREFIX)
         raw_input = RawInput(
             user_id=user_id,
             type="text",
-            data=update.message.text
+            data=text[len(_REPEAT_PREFIX):].lstrip() if repeat else text,
+            allow_duplicate=repeat,
         )
 
         try:
-            # Obtener una sesión de BD
-            db_session = next(get_db())
-            
-            # Ejecutar el pipeline de procesamiento
-            result = process_expense_input(db=db_session, raw_input=raw_input)
+            # Sin sesión propia: cada etapa del pipeline usa una de corta duración y la devuelve al pool
+            result = await aprocess_expense_input(db=None, raw_input=raw_input)
             
-            if result:
+            if result and result.duplicate_of:
+                _MESSAGES_TOTAL.inc("stored")
+                await update.message.reply_text(
+                    f"¡Gasto guardado con éxito! ID: {result.id}. "
+                    f"Se parece al gasto {result.duplicate_of}; revisa que no esté repetido."
+                )
+            elif result:
+                _MESSAGES_TOTAL.inc("stored")
                 await update.message.reply_text(f"¡Gasto guardado con éxito! ID: {result.id}")
             else:
+                _MESSAGES_TOTAL.inc("review")
                 await update.message.reply_text("No pude procesar eso completamente. Podría necesitar revisión manual.")
 
+        except DuplicateExpenseError as e:
+            _MESSAGES_TOTAL.inc("duplicate")
+            await update.message.reply_text(
+                f"Ese gasto ya estaba registrado con ID {e.existing_id}. "
+                f"Si es otro gasto igual, reenvíalo empezando con «{_REPEAT_PREFIX}» para guardarlo."
+            )
+        except AdmissionRejected as e:
+            logger.warning(f"Mensaje de {user_id} rechazado por el control de admisión: {e}")
+            _MESSAGES_TOTAL.inc("rejected")
+            await update.message.reply_text(
+                f"Estoy recibiendo muchos gastos ahora mismo. Inténtalo de nuevo en {int(e.retry_after)} segundos."
+            )
         except Exception as e:
             logger.error(f"Error al manejar el mensaje: {e}", exc_info=True)
+            _MESSAGES_TOTAL.inc("error")
             await update.message.reply_text("Lo siento, ocurrió un error al procesar tu solicitud.")
 
     else:
+        _MESSAGES_TOTAL.inc("unsupported")
         await update.message.reply_text("Actualmente solo puedo procesar mensajes de texto.")
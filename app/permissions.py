@@ -4,6 +4,7 @@ Handles user permissions and access control.
 Defines who is allowed to perform certain actions, such as uploading
 or querying expense data.
 """
+import hmac
 
 from app.config import config
 
@@ -18,3 +19,14 @@ def is_user_allowed(user_id: str) -> bool:
     # ALLOWED_USERS = config.ALLOWED_USER_IDS.split(',')
     # return user_id in ALLOWED_USERS
     return True # Allow all users for now
+
+def is_admin_token_valid(token: str) -> bool:
+    """
+    Checks the secret sent to operational endpoints (e.g. forcing a config reload).
+
+    Always False when ADMIN_TOKEN is not configured, so those endpoints are
+    disabled rather than left open.
+    """
+    if not config.ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode())
@@ -1,26 +1,206 @@
 """
 Conexión a la base de datos y gestión de sesiones.
+
+Hay dos motores sobre la misma base:
+
+- Síncrono (engine / SessionLocal): escrituras del pipeline, lotes y scripts de
+  mantenimiento, siempre dentro de session_scope().
+- Asíncrono (get_async_engine / async_session_scope): lecturas desde código
+  asíncrono sin ocupar un hilo. La URL se deduce de DATABASE_URL (aiosqlite,
+  aiomysql o asyncpg) salvo que se indique DATABASE_ASYNC_URL. Las conexiones
+  asíncronas pertenecen al bucle de eventos que las abrió, así que hay un motor
+  por bucle (el de FastAPI y el de IA no comparten conexiones).
+
+Ambos pools usan DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+DB_POOL_RECYCLE y DB_POOL_PRE_PING, y miden cuánto se espera para obtener una
+conexión (expense_db_pool_wait_seconds) y cuántas están en uso
+(expense_db_pool_connections, /db/stats).
+
+Las escrituras de la aplicación usan write_session_scope() desde el hilo de
+get_write_executor(). Con SQLite en archivo y SQLITE_PROFILE, cada conexión
+aplica WAL y los PRAGMA de SQLITE_* (los lectores no esperan al escritor y un
+bloqueo se espera SQLITE_BUSY_TIMEOUT_MS en lugar de fallar con "database is
+locked"), y las escrituras van por un motor aparte con una única conexión que
+abre sus transacciones con BEGIN IMMEDIATE: toma el bloqueo de escritura al
+empezar, así que dos procesos no se bloquean mutuamente a mitad de una
+transacción. Las lecturas siguen usando el pool de engine. En el resto de
+bases write_session_scope() usa el mismo motor que session_scope().
 """
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import asyncio
 import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
+from app import metrics
 from app.config import config
 
 logger = logging.getLogger(__name__)
 
-try:
-    # El argumento 'check_same_thread' es específico de SQLite.
-    engine_args = {"check_same_thread": False} if config.DATABASE_URL.startswith("sqlite") else {}
-    
-    engine = create_engine(
-        config.DATABASE_URL,
-        connect_args=engine_args
+_POOL_WAIT = metrics.Histogram(
+    "expense_db_pool_wait_seconds",
+    "Espera para obtener una conexión del pool (incluye abrirla si hace falta).",
+    ["engine"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+_POOL_TIMEOUTS = metrics.Counter(
+    "expense_db_pool_timeouts_total", "Peticiones de conexión que agotaron DB_POOL_TIMEOUT.", ["engine"]
+)
+
+# Controladores asíncronos por base de datos
+_ASYNC_DRIVERS = {"sqlite": "aiosqlite", "mysql": "aiomysql", "postgresql": "asyncpg"}
+
+
+class _TimedPool:
+    """
+    Mezcla para pools de cola que mide la espera de cada conexión.
+    """
+
+    engine_label = "sync"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            _POOL_TIMEOUTS.inc(self.engine_label)
+            raise
+        finally:
+            _POOL_WAIT.observe(time.perf_counter() - start, self.engine_label)
+
+
+class _TimedQueuePool(_TimedPool, QueuePool):
+    pass
+
+
+class _TimedAsyncPool(_TimedPool, AsyncAdaptedQueuePool):
+    engine_label = "async"
+
+
+class _TimedWritePool(_TimedPool, QueuePool):
+    engine_label = "write"
+
+
+def _is_memory(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+# --- Perfil de SQLite ---
+
+_SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+def uses_sqlite_profile(database_url: Optional[str] = None) -> bool:
+    """
+    Indica si se aplica el perfil de SQLite (solo a bases en archivo).
+    """
+    url = make_url(database_url or config.DATABASE_URL)
+    return config.SQLITE_PROFILE and url.get_backend_name() == "sqlite" and not _is_memory(url)
+
+
+def sqlite_pragmas() -> List[str]:
+    if config.SQLITE_SYNCHRONOUS not in _SYNCHRONOUS_MODES:
+        raise ValueError(f"SQLITE_SYNCHRONOUS debe ser uno de {', '.join(_SYNCHRONOUS_MODES)}.")
+    return [
+        # WAL es persistente en el archivo; repetirlo en cada conexión no cuesta nada
+        "PRAGMA journal_mode=WAL",
+        # En WAL, NORMAL solo sincroniza en los checkpoints: un corte de luz puede perder las últimas
+        # transacciones, pero no corromper la base
+        f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}",
+        # Un valor negativo se interpreta en KiB en lugar de páginas
+        f"PRAGMA cache_size={-int(config.SQLITE_CACHE_SIZE_KB)}",
+        f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}",
+    ]
+
+
+def _apply_sqlite_profile(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def _manual_transactions(dbapi_connection, connection_record) -> None:
+    # pysqlite abre las transacciones por su cuenta (y sin IMMEDIATE): se le quita ese control
+    dbapi_connection.isolation_level = None
+
+
+def _begin_immediate(connection) -> None:
+    connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _enable_sqlite_profile(sync_engine, writer: bool = False) -> None:
+    event.listen(sync_engine, "connect", _apply_sqlite_profile)
+    if writer:
+        event.listen(sync_engine, "connect", _manual_transactions)
+        event.listen(sync_engine, "begin", _begin_immediate)
+
+
+def _engine_options(database_url: str, asynchronous: bool = False, writer: bool = False) -> Dict[str, Any]:
+    """
+    Argumentos de create_engine: pool explícito salvo en SQLite en memoria.
+
+    El motor de escritura (writer) tiene una sola conexión, sin desborde.
+    """
+    url = make_url(database_url)
+    options: Dict[str, Any] = {}
+    if url.get_backend_name() == "sqlite" and not asynchronous:
+        # El argumento 'check_same_thread' es específico de SQLite.
+        options["connect_args"] = {"check_same_thread": False}
+    if _is_memory(url):
+        # Una base en memoria vive en una sola conexión: se deja el pool por defecto de SQLAlchemy
+        return options
+    options.update(
+        poolclass=_TimedAsyncPool if asynchronous else _TimedWritePool if writer else _TimedQueuePool,
+        pool_size=1 if writer else config.DB_POOL_SIZE,
+        max_overflow=0 if writer else config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
     )
+    return options
+
+
+def async_database_url(database_url: Optional[str] = None) -> str:
+    """
+    URL del motor asíncrono: DATABASE_ASYNC_URL o DATABASE_URL con el controlador asíncrono.
+    """
+    if config.DATABASE_ASYNC_URL:
+        return config.DATABASE_ASYNC_URL
+    url = make_url(database_url or config.DATABASE_URL)
+    driver = _ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No hay un controlador asíncrono conocido para {url.get_backend_name()}; usa DATABASE_ASYNC_URL.")
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+
+try:
+    engine = create_engine(config.DATABASE_URL, **_engine_options(config.DATABASE_URL))
 
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+    # Sin perfil de SQLite, las escrituras usan el mismo motor que las lecturas
+    write_engine = engine
+    WriteSessionLocal = SessionLocal
+    if uses_sqlite_profile():
+        _enable_sqlite_profile(engine)
+        write_engine = create_engine(config.DATABASE_URL, **_engine_options(config.DATABASE_URL, writer=True))
+        _enable_sqlite_profile(write_engine, writer=True)
+        WriteSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
+
     Base = declarative_base()
 
     logger.info("Motor de base de datos creado con éxito.")
@@ -30,17 +210,185 @@ except Exception as e:
     # Salir o manejar el error crítico apropiadamente
     engine = None
     SessionLocal = None
+    write_engine = None
+    WriteSessionLocal = None
     Base = None
 
+
+@contextmanager
+def _scope(factory) -> Iterator[Session]:
+    if factory is None:
+        raise RuntimeError("La base de datos no está configurada; no se puede crear una sesión.")
+    session = factory()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def session_scope():
+    """
+    Sesión síncrona que siempre se cierra (y devuelve su conexión al pool) al salir del bloque.
+
+    Lo no confirmado se descarta al cerrar; los repositorios confirman por su cuenta.
+    """
+    return _scope(SessionLocal)
+
+
+def write_session_scope():
+    """
+    Como session_scope(), pero sobre la conexión de escritura (ver el docstring del módulo).
+
+    Con el perfil de SQLite solo hay una conexión: conviene usarla desde get_write_executor().
+    """
+    return _scope(WriteSessionLocal)
+
+
+_write_executor: Optional[ThreadPoolExecutor] = None
+_write_executor_lock = threading.Lock()
+
+
+def get_write_executor() -> ThreadPoolExecutor:
+    """
+    Hilo único por el que pasan las escrituras de la aplicación (pipeline, escritor agrupado y lotes).
+    """
+    global _write_executor
+    with _write_executor_lock:
+        if _write_executor is None:
+            _write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        return _write_executor
+
+
+def shutdown_write_executor() -> None:
+    """
+    Espera a que terminen las escrituras en curso y libera el hilo.
+    """
+    global _write_executor
+    with _write_executor_lock:
+        executor, _write_executor = _write_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
 def get_db():
     """
     Dependencia para que las rutas de FastAPI obtengan una sesión de BD.
     """
-    if SessionLocal is None:
-        raise Exception("Database is not configured. Cannot create session.")
-    
-    db = SessionLocal()
-    try:
+    with session_scope() as db:
         yield db
+
+
+# --- Motor asíncrono ---
+
+_async_engines: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+_async_sessionmakers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+
+
+def get_async_engine():
+    """
+    Motor asíncrono del bucle de eventos actual (se crea la primera vez).
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    loop = asyncio.get_running_loop()
+    async_engine = _async_engines.get(loop)
+    if async_engine is None:
+        url = async_database_url()
+        async_engine = create_async_engine(url, **_engine_options(url, asynchronous=True))
+        if uses_sqlite_profile():
+            _enable_sqlite_profile(async_engine.sync_engine)
+        _async_engines[loop] = async_engine
+        logger.info("Motor asíncrono de base de datos creado.")
+    return async_engine
+
+
+def _get_async_sessionmaker():
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    loop = asyncio.get_running_loop()
+    maker = _async_sessionmakers.get(loop)
+    if maker is None:
+        maker = _async_sessionmakers[loop] = async_sessionmaker(
+            get_async_engine(), autoflush=False, expire_on_commit=False
+        )
+    return maker
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncIterator[Any]:
+    """
+    Sesión asíncrona que siempre se cierra al salir del bloque, también si la tarea se cancela.
+    """
+    session = _get_async_sessionmaker()()
+    try:
+        yield session
     finally:
-        db.close()
+        # Protegido de la cancelación: una conexión a medio cerrar no volvería al pool
+        await asyncio.shield(session.close())
+
+
+async def get_async_db():
+    """
+    Dependencia para que las rutas asíncronas de FastAPI obtengan una sesión asíncrona.
+    """
+    async with async_session_scope() as db:
+        yield db
+
+
+async def dispose_async_engine() -> None:
+    """
+    Cierra las conexiones del motor asíncrono del bucle actual.
+    """
+    loop = asyncio.get_running_loop()
+    _async_sessionmakers.pop(loop, None)
+    async_engine = _async_engines.pop(loop, None)
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+# --- Estado de los pools ---
+
+def _pool_stats(pool, max_overflow: int) -> Dict[str, Any]:
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    capacity = pool.size() + max_overflow
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "capacity": capacity,
+        "checked_out": checked_out,
+        "idle": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        "utilization": round(checked_out / capacity, 3) if capacity else 0.0,
+    }
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Conexiones en uso, libres y de desborde de cada pool, y su utilización (0-1).
+    """
+    stats: Dict[str, Any] = {}
+    if engine is not None:
+        stats["sync"] = _pool_stats(engine.pool, config.DB_MAX_OVERFLOW)
+    if write_engine is not None and write_engine is not engine:
+        stats["write"] = _pool_stats(write_engine.pool, 0)
+    for index, async_engine in enumerate(list(_async_engines.values())):
+        stats[f"async_{index}"] = _pool_stats(async_engine.sync_engine.pool, config.DB_MAX_OVERFLOW)
+    return stats
+
+
+def _pool_gauges() -> Dict[tuple, float]:
+    values = {}
+    for name, pool in get_pool_stats().items():
+        for state in ("checked_out", "idle", "overflow", "capacity", "utilization"):
+            if state in pool:
+                values[(name, state)] = pool[state]
+    return values
+
+
+metrics.Gauge(
+    "expense_db_pool_connections",
+    "Conexiones por pool y estado (checked_out, idle, overflow, capacity) y utilización (0-1).",
+    ["engine", "state"],
+    function=_pool_gauges,
+)
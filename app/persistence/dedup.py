@@ -0,0 +1,300 @@
+"""
+Detección de gastos duplicados (tasks.md 4.3).
+
+Cada gasto guardado lleva una huella normalizada: usuario, monto en
+centavos, moneda, fecha y las palabras de la descripción (o del proveedor),
+sin números ni orden. Dos gastos con la misma huella son el mismo gasto: un
+recibo reenviado o un reintento tras un tiempo de espera.
+
+- Duplicado exacto: misma huella. No se guarda; se informa el ID existente
+  (DuplicateExpenseError) para que el usuario confirme si es otro gasto
+  igual. El índice único (user_id, fingerprint) lo garantiza también con
+  inserciones concurrentes desde varios workers.
+- Repetición confirmada (allow_duplicate): dos cafés iguales el mismo día
+  son gastos distintos. Se guarda con la huella de la siguiente ocurrencia
+  libre (la misma clave con un contador) y duplicate_of apuntando al
+  original, de modo que un reenvío de esa repetición vuelve a detectarse.
+- Posible duplicado: mismo usuario, monto y moneda con una fecha a
+  DEDUP_WINDOW_DAYS días o menos. Se guarda, pero con duplicate_of
+  apuntando al gasto anterior para que el usuario lo revise.
+
+Para no consultar la base en cada gasto, cada usuario tiene un filtro de
+Bloom en memoria con sus huellas y sus claves (monto, moneda, día). Si el
+filtro dice que no hay nada parecido, no hay duplicado y no se consulta la
+base; solo los "quizás" (duplicados reales y falsos positivos, ~1%) cuestan
+una consulta indexada. El filtro de un usuario se carga de la base la primera
+vez, se actualiza con las filas nuevas cada DEDUP_REFRESH_INTERVAL segundos
+(las insertadas por otros workers) y se reconstruye al doble de tamaño
+cuando se llena.
+
+Este módulo solo tiene las estructuras en memoria; las consultas están en
+app.persistence.repositories.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from datetime import date, timedelta
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from app import metrics
+from app.config import config
+from app.preprocessing.normalize_text import normalize_for_matching
+
+# Tamaño mínimo (en claves) del filtro de un usuario
+_MIN_CAPACITY = 1024
+
+# Candados por franjas de usuarios: serializan comprobación e inserción de un mismo usuario
+_LOCK_STRIPES = 64
+
+
+class DuplicateExpenseError(Exception):
+    """
+    El gasto ya estaba registrado; existing_id es el ID del registro original.
+    """
+
+    def __init__(self, existing_id: int):
+        super().__init__(
+            f"El gasto ya estaba registrado con ID {existing_id}; "
+            "si es otro gasto igual, envíalo con allow_duplicate para guardarlo."
+        )
+        self.existing_id = existing_id
+
+
+class DuplicateCheck(NamedTuple):
+    kind: Optional[str]  # None, "exact" o "near"
+    expense_id: Optional[int]
+
+
+def amount_cents(amount: float) -> int:
+    return int(round(amount * 100))
+
+
+def fingerprint(
+    user_id: str, amount: float, currency: str, expense_date: date, text: Optional[str], occurrence: int = 0
+) -> str:
+    """
+    Huella normalizada de un gasto (32 caracteres hexadecimales).
+
+    El texto es la descripción o, si falta, el proveedor. Se normaliza y se
+    reduce al conjunto ordenado de sus palabras sin números, de modo que
+    "Uber 120 ayer" y "ayer uber" producen la misma huella. occurrence
+    distingue las repeticiones confirmadas de un mismo gasto (0 es el original).
+    """
+    words = sorted({w for w in normalize_for_matching(text or "").split() if not w.isdigit()})
+    key = "\x1f".join((user_id, str(amount_cents(amount)), (currency or "").upper(), expense_date.isoformat(), " ".join(words)))
+    if occurrence:
+        key += f"\x1f#{occurrence}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def near_key(amount: float, currency: str, expense_date: date) -> str:
+    return f"n:{amount_cents(amount)}:{(currency or '').upper()}:{expense_date.isoformat()}"
+
+
+def near_keys(amount: float, currency: str, expense_date: date, window_days: int) -> List[str]:
+    """
+    Claves (monto, moneda, día) de todos los días de la ventana alrededor de expense_date.
+    """
+    return [
+        near_key(amount, currency, expense_date + timedelta(days=offset))
+        for offset in range(-window_days, window_days + 1)
+    ]
+
+
+class BloomFilter:
+    """
+    Filtro de Bloom: responde "seguro que no" o "quizás" sin guardar las claves.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(1, capacity)
+        bits = int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.size = max(64, bits)
+        self.hashes = max(1, int(round(self.size / self.capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> Iterator[int]:
+        # Doble hashing: k posiciones a partir de dos valores de 64 bits
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def full(self) -> bool:
+        return self.count > self.capacity
+
+
+class _UserFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.max_id = 0
+        self.refreshed_at = 0.0
+
+
+# Fila cargada de la base: (id, huella, monto, moneda, fecha)
+Row = Tuple[int, Optional[str], float, str, date]
+
+
+class DuplicateIndex:
+    """
+    Filtros de Bloom por usuario, con un máximo de usuarios en memoria (LRU).
+    """
+
+    def __init__(self, max_users: int, error_rate: float, refresh_interval: float, window_days: int):
+        self.max_users = max_users
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.window_days = window_days
+        self._filters: "OrderedDict[str, _UserFilter]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+        self.stats: Dict[str, int] = {
+            "checks": 0, "filtered": 0, "db_lookups": 0, "false_positives": 0,
+            "exact": 0, "near": 0, "loads": 0, "repeats": 0,
+        }
+
+    @contextmanager
+    def locked(self, user_ids: Iterable[str]):
+        """
+        Serializa comprobación e inserción para los usuarios dados (candados en orden fijo).
+        """
+        stripes = sorted({hash(user_id) % _LOCK_STRIPES for user_id in user_ids})
+        with ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self._stripes[stripe])
+            yield
+
+    def pending_load(self, user_id: str) -> Optional[int]:
+        """
+        Devuelve el ID a partir del cual hay que cargar filas del usuario
+        (0 para una carga completa), o None si el filtro está al día.
+        """
+        with self._lock:
+            user_filter = self._filters.get(user_id)
+            if user_filter is None or user_filter.bloom.full:
+                return 0
+            self._filters.move_to_end(user_id)
+            if time.monotonic() - user_filter.refreshed_at >= self.refresh_interval:
+                return user_filter.max_id
+            return None
+
+    def load(self, user_id: str, since_id: int, rows: List[Row]) -> None:
+        """
+        Añade al filtro del usuario las filas leídas de la base (todas si since_id es 0).
+        """
+        with self._lock:
+            user_filter = self._filters.get(user_id)
+            if since_id == 0 or user_filter is None:
+                # Dos claves por fila y margen para crecer antes de reconstruir
+                user_filter = _UserFilter(max(_MIN_CAPACITY, 4 * len(rows)), self.error_rate)
+                self._filters[user_id] = user_filter
+                self._filters.move_to_end(user_id)
+                self.stats["loads"] += 1
+                while len(self._filters) > self.max_users:
+                    self._filters.popitem(last=False)
+            for row_id, row_fingerprint, amount, currency, expense_date in rows:
+                self._add(user_filter, row_id, row_fingerprint, amount, currency, expense_date)
+            user_filter.refreshed_at = time.monotonic()
+
+    def add(self, user_id: str, expense_id: int, expense_fingerprint: Optional[str], amount: float, currency: str, expense_date: date) -> None:
+        """
+        Registra un gasto recién guardado en el filtro de su usuario, si está cargado.
+        """
+        with self._lock:
+            user_filter = self._filters.get(user_id)
+            if user_filter is not None:
+                self._add(user_filter, expense_id, expense_fingerprint, amount, currency, expense_date)
+
+    @staticmethod
+    def _add(user_filter: _UserFilter, row_id: int, row_fingerprint: Optional[str], amount: float, currency: str, expense_date: date) -> None:
+        if row_fingerprint:
+            user_filter.bloom.add("f:" + row_fingerprint)
+        user_filter.bloom.add(near_key(amount, currency, expense_date))
+        if row_id and row_id > user_filter.max_id:
+            user_filter.max_id = row_id
+
+    def probe(self, user_id: str, expense_fingerprint: str, keys: List[str]) -> Tuple[bool, bool]:
+        """
+        Devuelve (quizás exacto, quizás cercano). (False, False) significa que seguro no hay duplicado.
+        """
+        with self._lock:
+            self.stats["checks"] += 1
+            user_filter = self._filters.get(user_id)
+            if user_filter is None:
+                return True, True
+            bloom = user_filter.bloom
+            maybe_exact = ("f:" + expense_fingerprint) in bloom
+            maybe_near = maybe_exact or any(key in bloom for key in keys)
+            if not maybe_near:
+                self.stats["filtered"] += 1
+            return maybe_exact, maybe_near
+
+    def record(self, result: DuplicateCheck) -> None:
+        with self._lock:
+            self.stats["db_lookups"] += 1
+            if result.kind is None:
+                self.stats["false_positives"] += 1
+            else:
+                self.stats[result.kind] += 1
+
+    def record_repeat(self) -> None:
+        with self._lock:
+            self.stats["repeats"] += 1
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["users"] = len(self._filters)
+        checks = stats["checks"]
+        stats["filtered_share"] = round(stats["filtered"] / checks, 4) if checks else 0.0
+        return stats
+
+
+_index: Optional[DuplicateIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> DuplicateIndex:
+    """
+    Devuelve el índice de duplicados del proceso.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DuplicateIndex(
+                    max_users=config.DEDUP_MAX_USERS,
+                    error_rate=config.DEDUP_BLOOM_ERROR_RATE,
+                    refresh_interval=config.DEDUP_REFRESH_INTERVAL,
+                    window_days=config.DEDUP_WINDOW_DAYS,
+                )
+    return _index
+
+
+def get_stats() -> Dict[str, float]:
+    if _index is None:
+        return {}
+    return _index.get_stats()
+
+
+metrics.Counter(
+    "expense_dedup_total",
+    "Comprobaciones de duplicados: checks, filtered (resueltas en memoria), db_lookups, false_positives, exact, near, "
+    "loads y repeats (repeticiones confirmadas guardadas).",
+    ["event"],
+    function=lambda: {(key,): value for key, value in get_stats().items() if key not in ("users", "filtered_share")},
+)
@@ -0,0 +1,88 @@
+"""
+Migraciones del esquema con Alembic (app/persistence/migrations).
+
+Uso:
+    python -m app.persistence.migrate upgrade [revisión]      (por defecto, head)
+    python -m app.persistence.migrate downgrade <revisión>
+    python -m app.persistence.migrate current | history
+    python -m app.persistence.migrate revision -m "mensaje" [--autogenerate]
+
+La aplicación aplica las migraciones pendientes al arrancar
+(upgrade_database). Una base creada antes con create_tables() no tiene
+alembic_version: la revisión inicial detecta la tabla y solo completa lo que
+falta, así que no hace falta marcarla a mano.
+"""
+import argparse
+import logging
+import os
+import sys
+from typing import Optional
+
+from alembic import command
+from alembic.config import Config
+
+from app.config import config
+from app.persistence import db as database
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def alembic_config(database_url: Optional[str] = None) -> Config:
+    """
+    Configuración de Alembic sin alembic.ini: scripts en MIGRATIONS_DIR y URL de DATABASE_URL.
+    """
+    alembic_cfg = Config()
+    alembic_cfg.set_main_option("script_location", MIGRATIONS_DIR)
+    # ConfigParser interpreta '%': las contraseñas codificadas en la URL deben escaparse
+    alembic_cfg.set_main_option("sqlalchemy.url", (database_url or config.DATABASE_URL).replace("%", "%%"))
+    return alembic_cfg
+
+
+def upgrade_database(revision: str = "head") -> None:
+    """
+    Aplica las migraciones pendientes hasta revision con el motor de la aplicación.
+    """
+    if database.engine is None:
+        logger.error("No se pueden aplicar las migraciones, el motor de base de datos no está disponible.")
+        return
+    logger.info(f"Aplicando migraciones de base de datos hasta {revision}...")
+    with database.engine.begin() as connection:
+        alembic_cfg = alembic_config()
+        alembic_cfg.attributes["connection"] = connection
+        command.upgrade(alembic_cfg, revision)
+    logger.info("Esquema de base de datos actualizado.")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migraciones de la base de datos de gastos.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    upgrade = commands.add_parser("upgrade", help="Aplica las migraciones pendientes.")
+    upgrade.add_argument("revision", nargs="?", default="head")
+    downgrade = commands.add_parser("downgrade", help="Revierte hasta una revisión.")
+    downgrade.add_argument("revision")
+    commands.add_parser("current", help="Muestra la revisión aplicada.")
+    commands.add_parser("history", help="Lista las revisiones.")
+    revision = commands.add_parser("revision", help="Crea una revisión nueva.")
+    revision.add_argument("-m", "--message", required=True)
+    revision.add_argument("--autogenerate", action="store_true", help="Compara los modelos con la base.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    alembic_cfg = alembic_config()
+    if args.command == "upgrade":
+        upgrade_database(args.revision)
+    elif args.command == "downgrade":
+        command.downgrade(alembic_cfg, args.revision)
+    elif args.command == "current":
+        command.current(alembic_cfg, verbose=True)
+    elif args.command == "history":
+        command.history(alembic_cfg)
+    else:
+        command.revision(alembic_cfg, message=args.message, autogenerate=args.autogenerate)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
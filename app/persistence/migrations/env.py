@@ -0,0 +1,53 @@
+"""
+Entorno de Alembic para la tabla de gastos.
+
+La URL sale de sqlalchemy.url (app.persistence.migrate la toma de
+DATABASE_URL). Si quien llama ya tiene una conexión abierta la pasa en
+config.attributes["connection"] y la migración corre dentro de su transacción.
+"""
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+from app.persistence.db import Base
+from app.persistence import repositories  # noqa: F401  (registra los modelos en Base.metadata)
+
+target_metadata = Base.metadata
+
+
+def _configure(**options) -> None:
+    context.configure(target_metadata=target_metadata, compare_type=True, **options)
+
+
+def run_migrations_offline() -> None:
+    """
+    Genera el SQL sin conectarse (alembic upgrade --sql).
+    """
+    _configure(
+        url=context.config.get_main_option("sqlalchemy.url"),
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connection = context.config.attributes.get("connection")
+    if connection is not None:
+        _configure(connection=connection, render_as_batch=connection.dialect.name == "sqlite")
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
+    connectable = create_engine(context.config.get_main_option("sqlalchemy.url"), poolclass=pool.NullPool)
+    with connectable.connect() as connection:
+        # SQLite no admite la mayoría de ALTER TABLE: Alembic recrea la tabla en modo batch
+        _configure(connection=connection, render_as_batch=connection.dialect.name == "sqlite")
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
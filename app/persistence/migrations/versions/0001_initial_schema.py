@@ -0,0 +1,67 @@
+"""Tabla de gastos inicial (la que creaba create_tables()).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+
+Las bases creadas antes con create_tables() ya tienen la tabla: en ese caso
+solo se añaden las columnas e índices de la detección de duplicados que falten
+(las huellas de las filas antiguas las calcula app.maintenance.backfill_fingerprints).
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if "expenses" not in inspector.get_table_names():
+        op.create_table(
+            "expenses",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.String(), nullable=False),
+            sa.Column("provider_name", sa.String(), nullable=False),
+            sa.Column("amount", sa.Float(), nullable=False),
+            sa.Column("currency", sa.String(length=3), nullable=False),
+            sa.Column("expense_date", sa.Date(), nullable=False),
+            sa.Column("description", sa.Text(), nullable=True),
+            sa.Column("category", sa.String(), nullable=False),
+            sa.Column("subcategory", sa.String(), nullable=True),
+            sa.Column("expense_type", sa.String(), nullable=False),
+            sa.Column("confirmed_at", sa.DateTime(), nullable=False),
+            sa.Column("initial_processing_method", sa.String(), nullable=True),
+            sa.Column("fingerprint", sa.String(length=32), nullable=True),
+            sa.Column("duplicate_of", sa.Integer(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("user_id", "fingerprint", name="uq_expenses_user_fingerprint"),
+        )
+        op.create_index("ix_expenses_id", "expenses", ["id"])
+        op.create_index("ix_expenses_user_id", "expenses", ["user_id"])
+        op.create_index("ix_expenses_user_amount_date", "expenses", ["user_id", "amount", "expense_date"])
+        return
+
+    columns = {column["name"] for column in inspector.get_columns("expenses")}
+    if "fingerprint" not in columns:
+        op.add_column("expenses", sa.Column("fingerprint", sa.String(length=32), nullable=True))
+    if "duplicate_of" not in columns:
+        op.add_column("expenses", sa.Column("duplicate_of", sa.Integer(), nullable=True))
+    indexes = {index["name"] for index in inspector.get_indexes("expenses")}
+    indexes |= {constraint["name"] for constraint in inspector.get_unique_constraints("expenses")}
+    if "uq_expenses_user_fingerprint" not in indexes:
+        op.create_index("uq_expenses_user_fingerprint", "expenses", ["user_id", "fingerprint"], unique=True)
+    if "ix_expenses_user_amount_date" not in indexes:
+        op.create_index("ix_expenses_user_amount_date", "expenses", ["user_id", "amount", "expense_date"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("expenses")
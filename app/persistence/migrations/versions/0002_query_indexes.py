@@ -0,0 +1,35 @@
+"""Índices compuestos para las consultas por usuario.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:01
+
+- (user_id, expense_date): gastos y totales de un usuario en un rango de fechas.
+- (user_id, category, expense_date): lo mismo filtrando por categoría, ya ordenado por fecha.
+- (user_id, confirmed_at): últimos gastos confirmados (estado, exportaciones incrementales).
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_expenses_user_date", "expenses", ["user_id", "expense_date"])
+    op.create_index("ix_expenses_user_category_date", "expenses", ["user_id", "category", "expense_date"])
+    op.create_index("ix_expenses_user_confirmed_at", "expenses", ["user_id", "confirmed_at"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_expenses_user_confirmed_at", table_name="expenses")
+    op.drop_index("ix_expenses_user_category_date", table_name="expenses")
+    op.drop_index("ix_expenses_user_date", table_name="expenses")
@@ -0,0 +1,61 @@
+"""Resumen mensual por usuario, categoría y moneda.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:02
+
+Crea expense_monthly_totals y lo llena con los gastos existentes. A partir de
+aquí lo mantienen los repositorios en la misma transacción que cada gasto.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    monthly_totals = op.create_table(
+        "expense_monthly_totals",
+        sa.Column("user_id", sa.String(), nullable=False),
+        sa.Column("year_month", sa.String(length=7), nullable=False),
+        sa.Column("category", sa.String(), nullable=False),
+        sa.Column("currency", sa.String(length=3), nullable=False),
+        sa.Column("total", sa.Float(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("min_amount", sa.Float(), nullable=False),
+        sa.Column("max_amount", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("user_id", "year_month", "category", "currency"),
+    )
+
+    expenses = sa.table(
+        "expenses",
+        sa.column("user_id"), sa.column("expense_date"), sa.column("category"),
+        sa.column("currency"), sa.column("amount"),
+    )
+    dialect_name = op.get_bind().dialect.name
+    if dialect_name == "sqlite":
+        month = sa.func.strftime("%Y-%m", expenses.c.expense_date)
+    elif dialect_name in ("mysql", "mariadb"):
+        month = sa.func.date_format(expenses.c.expense_date, "%Y-%m")
+    else:
+        month = sa.func.to_char(expenses.c.expense_date, "YYYY-MM")
+    op.execute(monthly_totals.insert().from_select(
+        ["user_id", "year_month", "category", "currency", "total", "count", "min_amount", "max_amount"],
+        sa.select(
+            expenses.c.user_id, month, expenses.c.category, expenses.c.currency,
+            sa.func.sum(expenses.c.amount), sa.func.count(), sa.func.min(expenses.c.amount), sa.func.max(expenses.c.amount),
+        ).group_by(expenses.c.user_id, month, expenses.c.category, expenses.c.currency),
+    ))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("expense_monthly_totals")
@@ -2,15 +2,32 @@
 Capa de acceso a datos para la persistencia.
 Contiene funciones para interactuar con la base de datos.
 """
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text, Index, UniqueConstraint, bindparam, case, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Container, Iterator, List, Dict, Any, NamedTuple, Optional
 import logging
 
-from app.persistence.db import Base, engine
+from app import metrics
+from app.config import config
+from app.persistence import dedup
+from app.persistence.db import Base
 from app.schema.base import FinalExpense
 
+if TYPE_CHECKING:
+    # sqlalchemy.ext.asyncio exige greenlet; solo se importa para las anotaciones
+    from sqlalchemy.ext.asyncio import AsyncSession
+
 logger = logging.getLogger(__name__)
 
+_DB_SECONDS = metrics.Histogram("expense_db_seconds", "Duración de las operaciones del repositorio.", ["operation"])
+_DB_ROWS = metrics.Counter("expense_db_rows_written_total", "Gastos insertados en la base de datos.")
+
+# Campos de FinalExpense que pertenecen al flujo de confirmación, no a la tabla
+_CONFIRMATION_FIELDS = {"confirmed_by", "audit_log", "status", "allow_duplicate"}
+
 # --- Modelo ORM de Base de Datos ---
 class ExpenseDB(Base):
     __tablename__ = "expenses"
@@ -31,36 +48,850 @@ class ExpenseDB(Base):
     confirmed_at = Column(DateTime, nullable=False)
     initial_processing_method = Column(String)
 
+    # Detección de duplicados (ver app.persistence.dedup): huella normalizada y, en los
+    # posibles duplicados, el ID del gasto parecido anterior
+    fingerprint = Column(String(32), nullable=True)
+    duplicate_of = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        # Único por usuario: dos inserciones concurrentes del mismo gasto no pueden pasar ambas
+        UniqueConstraint("user_id", "fingerprint", name="uq_expenses_user_fingerprint"),
+        Index("ix_expenses_user_amount_date", "user_id", "amount", "expense_date"),
+        # Consultas por usuario (migración 0002): rango de fechas, categoría y fecha, y últimos confirmados
+        Index("ix_expenses_user_date", "user_id", "expense_date"),
+        Index("ix_expenses_user_category_date", "user_id", "category", "expense_date"),
+        Index("ix_expenses_user_confirmed_at", "user_id", "confirmed_at"),
+    )
+
+class ExpenseMonthlyTotal(Base):
+    """
+    Resumen mensual por usuario, categoría y moneda.
+
+    Se mantiene en la misma transacción que las inserciones y correcciones de
+    gastos, así que los informes leen una fila por mes y categoría en lugar de
+    recorrer los gastos. app.maintenance.rebuild_rollups lo recalcula si se desvía.
+    """
+    __tablename__ = "expense_monthly_totals"
+
+    user_id = Column(String, primary_key=True)
+    year_month = Column(String(7), primary_key=True)  # "AAAA-MM"
+    category = Column(String, primary_key=True)
+    currency = Column(String(3), primary_key=True)
+
+    total = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False)
+    min_amount = Column(Float, nullable=False)
+    max_amount = Column(Float, nullable=False)
+
+class SavedExpense(NamedTuple):
+    """
+    Resultado de guardar un gasto de un lote.
+
+    duplicate indica un duplicado exacto que no se guardó (expense_id es el
+    registro existente); duplicate_of, un posible duplicado que sí se guardó.
+    """
+    expense_id: int
+    duplicate_of: Optional[int] = None
+    duplicate: bool = False
+
+    @property
+    def id(self) -> int:
+        # Mismo nombre que ExpenseDB.id: los llamadores tratan ambos resultados igual
+        return self.expense_id
+
 def create_tables():
     """
-    Crea todas las tablas de la base de datos definidas por los modelos que heredan de Base.
+    Crea o actualiza las tablas aplicando las migraciones de Alembic pendientes.
+
+    El esquema ya no sale de Base.metadata.create_all: los cambios se publican
+    como revisiones en app/persistence/migrations (ver app.persistence.migrate).
+    """
+    # Import diferido: el entorno de Alembic importa este módulo para leer los modelos
+    from app.persistence import migrate
+
+    migrate.upgrade_database()
+
+# --- Duplicados ---
+def expense_fingerprint(expense: FinalExpense, occurrence: int = 0) -> str:
+    return dedup.fingerprint(
+        expense.user_id, expense.amount, expense.currency, expense.expense_date,
+        expense.description or expense.provider_name, occurrence,
+    )
+
+def _find_by_fingerprint(db: Session, user_id: str, fingerprint: str) -> Optional[int]:
+    row = db.query(ExpenseDB.id).filter(ExpenseDB.user_id == user_id, ExpenseDB.fingerprint == fingerprint).first()
+    return row.id if row else None
+
+def _repeat_fingerprint(db: Session, expense: FinalExpense, taken: Container[str] = ()) -> str:
     """
-    if engine:
-        logger.info("Creando tablas de base de datos si no existen...")
-        Base.metadata.create_all(bind=engine)
-        logger.info("Tablas creadas con éxito.")
-    else:
-        logger.error("No se pueden crear las tablas, el motor de base de datos no está disponible.")
+    Huella de la siguiente repetición libre de un gasto ya registrado (allow_duplicate).
+
+    Cada candidata cuesta una consulta por el índice (user_id, fingerprint);
+    taken son las huellas ya usadas en el grupo que se está guardando.
+    """
+    occurrence = 1
+    while True:
+        candidate = expense_fingerprint(expense, occurrence)
+        if candidate not in taken and _find_by_fingerprint(db, expense.user_id, candidate) is None:
+            dedup.get_index().record_repeat()
+            return candidate
+        occurrence += 1
+
+def find_duplicate(db: Session, expense: FinalExpense, fingerprint: str) -> dedup.DuplicateCheck:
+    """
+    Busca un duplicado exacto o un posible duplicado de un gasto.
+
+    Primero consulta el filtro de Bloom del usuario; solo si responde "quizás"
+    se hace una consulta, siempre por índice: (user_id, fingerprint) para el
+    exacto y (user_id, amount, expense_date) para la ventana de días.
+
+    Args:
+        db: La sesión de la base de datos.
+        expense: El gasto a comprobar.
+        fingerprint: Su huella (expense_fingerprint).
+
+    Returns:
+        DuplicateCheck con kind None, "exact" o "near" y el ID del gasto encontrado.
+    """
+    index = dedup.get_index()
+    since_id = index.pending_load(expense.user_id)
+    if since_id is not None:
+        with _DB_SECONDS.time("dedup_load"):
+            rows = (
+                db.query(ExpenseDB.id, ExpenseDB.fingerprint, ExpenseDB.amount, ExpenseDB.currency, ExpenseDB.expense_date)
+                .filter(ExpenseDB.user_id == expense.user_id, ExpenseDB.id > since_id)
+                .all()
+            )
+        index.load(expense.user_id, since_id, [tuple(row) for row in rows])
+
+    window = timedelta(days=index.window_days)
+    keys = dedup.near_keys(expense.amount, expense.currency, expense.expense_date, index.window_days)
+    maybe_exact, maybe_near = index.probe(expense.user_id, fingerprint, keys)
+    if not maybe_near:
+        return dedup.DuplicateCheck(None, None)
+
+    result = dedup.DuplicateCheck(None, None)
+    with _DB_SECONDS.time("dedup_lookup"):
+        existing_id = _find_by_fingerprint(db, expense.user_id, fingerprint) if maybe_exact else None
+        if existing_id is not None:
+            result = dedup.DuplicateCheck("exact", existing_id)
+        else:
+            # Montos en centavos: se compara un rango para no depender de la igualdad de flotantes
+            cents = dedup.amount_cents(expense.amount)
+            row = (
+                db.query(ExpenseDB.id)
+                .filter(
+                    ExpenseDB.user_id == expense.user_id,
+                    ExpenseDB.amount >= (cents - 0.5) / 100,
+                    ExpenseDB.amount < (cents + 0.5) / 100,
+                    ExpenseDB.expense_date.between(expense.expense_date - window, expense.expense_date + window),
+                    ExpenseDB.currency == expense.currency,
+                )
+                .order_by(ExpenseDB.id.desc())
+                .first()
+            )
+            if row:
+                result = dedup.DuplicateCheck("near", row.id)
+    index.record(result)
+    return result
+
+def _remember(record: ExpenseDB) -> None:
+    dedup.get_index().add(record.user_id, record.id, record.fingerprint, record.amount, record.currency, record.expense_date)
+
+# --- Resumen mensual ---
+_ROLLUP_KEY = ("user_id", "year_month", "category", "currency")
+
+def year_month(day: date) -> str:
+    return day.strftime("%Y-%m")
+
+def _month_bounds(month: str):
+    year, number = int(month[:4]), int(month[5:7])
+    start = date(year, number, 1)
+    end = date(year + 1, 1, 1) if number == 12 else date(year, number + 1, 1)
+    return start, end
+
+def _year_month_column(dialect_name: str):
+    """
+    Expresión SQL "AAAA-MM" de expense_date en cada base.
+    """
+    if dialect_name == "sqlite":
+        return func.strftime("%Y-%m", ExpenseDB.expense_date)
+    if dialect_name in ("mysql", "mariadb"):
+        return func.date_format(ExpenseDB.expense_date, "%Y-%m")
+    return func.to_char(ExpenseDB.expense_date, "YYYY-MM")
+
+def _add_to_monthly_totals(db: Session, records: List[ExpenseDB]) -> None:
+    """
+    Suma los gastos nuevos al resumen mensual con un upsert por grupo (sin confirmar).
+    """
+    deltas: Dict[tuple, List[float]] = {}
+    for record in records:
+        key = (record.user_id, year_month(record.expense_date), record.category, record.currency)
+        delta = deltas.get(key)
+        if delta is None:
+            deltas[key] = [record.amount, 1, record.amount, record.amount]
+        else:
+            delta[0] += record.amount
+            delta[1] += 1
+            delta[2] = min(delta[2], record.amount)
+            delta[3] = max(delta[3], record.amount)
+    if not deltas:
+        return
+    rows = [
+        dict(zip(_ROLLUP_KEY, key), total=total, count=count, min_amount=low, max_amount=high)
+        for key, (total, count, low, high) in deltas.items()
+    ]
+    table = ExpenseMonthlyTotal.__table__
+    dialect_name = db.get_bind().dialect.name
+    with _DB_SECONDS.time("monthly_totals_add"):
+        # Sentencia sin valores y filas como parámetros (executemany): queda en la caché de
+        # sentencias compiladas, a diferencia de un VALUES multi-fila
+        if dialect_name in ("sqlite", "postgresql"):
+            if dialect_name == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+                least, greatest = func.min, func.max  # min()/max() con dos argumentos son escalares en SQLite
+            else:
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+                least, greatest = func.least, func.greatest
+            statement = dialect_insert(table)
+            new = statement.excluded
+            db.execute(statement.on_conflict_do_update(
+                index_elements=list(_ROLLUP_KEY),
+                set_={
+                    "total": table.c.total + new.total,
+                    "count": table.c.count + new.count,
+                    "min_amount": least(table.c.min_amount, new.min_amount),
+                    "max_amount": greatest(table.c.max_amount, new.max_amount),
+                },
+            ), rows)
+        elif dialect_name in ("mysql", "mariadb"):
+            from sqlalchemy.dialects.mysql import insert as dialect_insert
+
+            statement = dialect_insert(table)
+            new = statement.inserted
+            db.execute(statement.on_duplicate_key_update(
+                total=table.c.total + new.total,
+                count=table.c.count + new.count,
+                min_amount=func.least(table.c.min_amount, new.min_amount),
+                max_amount=func.greatest(table.c.max_amount, new.max_amount),
+            ), rows)
+        else:
+            for row in rows:
+                key = [table.c[column] == row[column] for column in _ROLLUP_KEY]
+                updated = db.execute(update(table).where(*key).values(
+                    total=table.c.total + row["total"],
+                    count=table.c.count + row["count"],
+                    min_amount=case((table.c.min_amount < row["min_amount"], table.c.min_amount), else_=row["min_amount"]),
+                    max_amount=case((table.c.max_amount > row["max_amount"], table.c.max_amount), else_=row["max_amount"]),
+                )).rowcount
+                if not updated:
+                    db.execute(insert(table).values(row))
+
+# Columnas de un gasto que cuentan en el resumen mensual (su grupo o su monto)
+_ROLLUP_COLUMNS = ("amount", "currency", "category", "expense_date")
+
+def _changed_monthly_keys(db: Session, mappings: List[Dict[str, Any]]) -> set:
+    """
+    Grupos del resumen mensual que cambian con estas actualizaciones, antes y después.
+
+    Solo cuentan los gastos cuyo monto, moneda, categoría o fecha cambia de
+    verdad; una huella, una marca de duplicado o una subcategoría no tocan el resumen.
+    """
+    candidates = {mapping["id"]: mapping for mapping in mappings if any(column in mapping for column in _ROLLUP_COLUMNS)}
+    if not candidates:
+        return set()
+    rows = db.execute(
+        select(ExpenseDB.id, ExpenseDB.user_id, *(getattr(ExpenseDB, column) for column in _ROLLUP_COLUMNS))
+        .where(ExpenseDB.id.in_(list(candidates)))
+    ).all()
+    keys = set()
+    for row in rows:
+        current = dict(zip(_ROLLUP_COLUMNS, row[2:]))
+        updated = {column: candidates[row.id].get(column, value) for column, value in current.items()}
+        if updated == current:
+            continue
+        # Una corrección puede mover el gasto de grupo: se recalculan el de origen y el de destino
+        for values in (current, updated):
+            keys.add((row.user_id, year_month(values["expense_date"]), values["category"], values["currency"]))
+    return keys
+
+def _refresh_monthly_totals(db: Session, keys: set) -> None:
+    """
+    Recalcula desde los gastos las filas del resumen indicadas (sin confirmar).
+
+    Restar un gasto no permite saber el nuevo mínimo o máximo, así que las
+    correcciones recalculan sus grupos; cada uno es un mes de una categoría y
+    se resuelve con el índice (user_id, category, expense_date).
+    """
+    table = ExpenseMonthlyTotal.__table__
+    with _DB_SECONDS.time("monthly_totals_refresh"):
+        for user_id, month, category, currency in keys:
+            start, end = _month_bounds(month)
+            total, count, low, high = db.execute(
+                select(func.sum(ExpenseDB.amount), func.count(ExpenseDB.id), func.min(ExpenseDB.amount), func.max(ExpenseDB.amount))
+                .where(
+                    ExpenseDB.user_id == user_id,
+                    ExpenseDB.category == category,
+                    ExpenseDB.expense_date >= start,
+                    ExpenseDB.expense_date < end,
+                    ExpenseDB.currency == currency,
+                )
+            ).one()
+            key = dict(zip(_ROLLUP_KEY, (user_id, month, category, currency)))
+            db.execute(table.delete().where(*[table.c[column] == value for column, value in key.items()]))
+            if count:
+                db.execute(insert(table).values(dict(key, total=total, count=count, min_amount=low, max_amount=high)))
+
+def _monthly_totals_select(dialect_name: str, user_id: Optional[str] = None):
+    month = _year_month_column(dialect_name)
+    query = select(
+        ExpenseDB.user_id, month, ExpenseDB.category, ExpenseDB.currency,
+        func.sum(ExpenseDB.amount), func.count(ExpenseDB.id), func.min(ExpenseDB.amount), func.max(ExpenseDB.amount),
+    ).group_by(ExpenseDB.user_id, month, ExpenseDB.category, ExpenseDB.currency)
+    if user_id is not None:
+        query = query.where(ExpenseDB.user_id == user_id)
+    return query
+
+def rebuild_monthly_totals(db: Session, user_id: Optional[str] = None, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Recalcula el resumen mensual desde la tabla de gastos y lo reemplaza en una transacción.
+
+    Args:
+        db: La sesión de la base de datos.
+        user_id: Solo este usuario (por defecto, todos).
+        dry_run: Si es True, solo cuenta las filas que difieren sin escribir.
+
+    Returns:
+        Filas del resumen esperadas (rows) y filas que faltaban, sobraban o diferían (drifted).
+    """
+    table = ExpenseMonthlyTotal.__table__
+    columns = [table.c[column] for column in _ROLLUP_KEY] + [table.c.total, table.c.count, table.c.min_amount, table.c.max_amount]
+    expected_query = _monthly_totals_select(db.get_bind().dialect.name, user_id)
+    current_query = select(*columns)
+    if user_id is not None:
+        current_query = current_query.where(table.c.user_id == user_id)
+
+    with _DB_SECONDS.time("monthly_totals_rebuild"):
+        expected = {tuple(row[:4]): tuple(row[4:]) for row in db.execute(expected_query)}
+        current = {tuple(row[:4]): tuple(row[4:]) for row in db.execute(current_query)}
+        drifted = sum(
+            1 for key in expected.keys() | current.keys()
+            if key not in expected or key not in current
+            # Tolerancia para las sumas en coma flotante acumuladas en distinto orden
+            or abs(expected[key][0] - current[key][0]) > 1e-6 * max(1.0, abs(expected[key][0]))
+            or expected[key][1:] != current[key][1:]
+        )
+        if not dry_run and drifted:
+            delete = table.delete()
+            if user_id is not None:
+                delete = delete.where(table.c.user_id == user_id)
+            db.execute(delete)
+            db.execute(insert(table).from_select([column.key for column in columns], expected_query))
+            db.commit()
+    return {"rows": len(expected), "drifted": drifted}
+
+def _monthly_totals_query(
+    user_id: str,
+    start_month: Optional[str] = None,
+    end_month: Optional[str] = None,
+    category: Optional[str] = None,
+):
+    query = select(ExpenseMonthlyTotal).where(ExpenseMonthlyTotal.user_id == user_id)
+    if start_month is not None:
+        query = query.where(ExpenseMonthlyTotal.year_month >= start_month)
+    if end_month is not None:
+        query = query.where(ExpenseMonthlyTotal.year_month <= end_month)
+    if category is not None:
+        query = query.where(ExpenseMonthlyTotal.category == category)
+    return query.order_by(ExpenseMonthlyTotal.year_month, ExpenseMonthlyTotal.category, ExpenseMonthlyTotal.currency)
+
+def get_monthly_totals(
+    db: Session,
+    user_id: str,
+    start_month: Optional[str] = None,
+    end_month: Optional[str] = None,
+    category: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Totales mensuales de un usuario por categoría y moneda, leídos del resumen.
+
+    El coste depende del número de meses y categorías, no del número de gastos.
+
+    Args:
+        db: La sesión de la base de datos.
+        user_id: El usuario.
+        start_month: Primer mes ("AAAA-MM", incluido), o None para no acotar.
+        end_month: Último mes ("AAAA-MM", incluido), o None para no acotar.
+        category: Filtrar por categoría.
+
+    Returns:
+        Diccionarios con year_month, category, currency, total, count, min y max,
+        ordenados por mes y categoría.
+    """
+    with _DB_SECONDS.time("monthly_totals"):
+        rows = db.execute(_monthly_totals_query(user_id, start_month, end_month, category)).scalars().all()
+    return [
+        {
+            "year_month": row.year_month, "category": row.category, "currency": row.currency,
+            "total": row.total, "count": row.count, "min": row.min_amount, "max": row.max_amount,
+        }
+        for row in rows
+    ]
 
 # --- Funciones del Repositorio ---
 def save_final_expense(db: Session, expense: FinalExpense) -> ExpenseDB:
     """
     Guarda un gasto confirmado por el usuario en la base de datos.
 
+    Con DEDUP_ENABLED, un duplicado exacto no se guarda (salvo con
+    allow_duplicate, que lo guarda como una repetición) y un posible duplicado
+    se guarda con duplicate_of apuntando al gasto parecido.
+
     Args:
         db: La sesión de la base de datos.
         expense: El objeto FinalExpense a guardar.
 
     Returns:
         El objeto ExpenseDB creado.
+
+    Raises:
+        DuplicateExpenseError: Si el gasto ya estaba registrado y no se pidió allow_duplicate.
     """
     logger.info(f"Guardando gasto final para el usuario {expense.user_id} en la base de datos.")
     
-    db_expense = ExpenseDB(**expense.dict())
-    
-    db.add(db_expense)
-    db.commit()
-    db.refresh(db_expense)
-    
+    db_expense = ExpenseDB(**expense.dict(exclude=_CONFIRMATION_FIELDS))
+
+    lock = dedup.get_index().locked([expense.user_id]) if config.DEDUP_ENABLED else nullcontext()
+    with lock:
+        if config.DEDUP_ENABLED:
+            db_expense.fingerprint = expense_fingerprint(expense)
+            check = find_duplicate(db, expense, db_expense.fingerprint)
+            if check.kind == "exact":
+                if not expense.allow_duplicate:
+                    raise dedup.DuplicateExpenseError(check.expense_id)
+                # Repetición confirmada por el usuario: se guarda marcada como duplicado del original
+                db_expense.fingerprint = _repeat_fingerprint(db, expense)
+            db_expense.duplicate_of = check.expense_id
+
+        try:
+            with _DB_SECONDS.time("save"):
+                db.add(db_expense)
+                db.flush()
+                # El resumen mensual se actualiza en la misma transacción que el gasto
+                _add_to_monthly_totals(db, [db_expense])
+                db.commit()
+                db.refresh(db_expense)
+        except IntegrityError:
+            db.rollback()
+            # Otro worker guardó el mismo gasto entre la comprobación y la inserción
+            existing_id = _find_by_fingerprint(db, expense.user_id, db_expense.fingerprint) if db_expense.fingerprint else None
+            if existing_id is None:
+                raise
+            raise dedup.DuplicateExpenseError(existing_id)
+        if config.DEDUP_ENABLED:
+            _remember(db_expense)
+    _DB_ROWS.inc()
+
+    if db_expense.duplicate_of:
+        logger.warning(f"Gasto {db_expense.id} marcado como posible duplicado de {db_expense.duplicate_of}.")
     logger.info(f"Gasto guardado con éxito con ID {db_expense.id}.")
     return db_expense
+
+def _insert_one_by_one(db: Session, records: List[ExpenseDB]) -> List[Optional[int]]:
+    """
+    Inserta los registros uno a uno con un punto de guardado cada uno.
+
+    Devuelve el ID de cada registro, o None si chocó con un duplicado exacto.
+    """
+    ids: List[Optional[int]] = []
+    for record in records:
+        try:
+            with db.begin_nested():
+                db.add(record)
+            ids.append(record.id)
+        except IntegrityError:
+            ids.append(None)
+    return ids
+
+# Filas por sentencia INSERT multi-fila: con 14 columnas queda lejos del límite de
+# parámetros de SQLite (32766) y de max_allowed_packet en MySQL
+_INSERT_CHUNK = 500
+
+def _insert_many(db: Session, records: List[ExpenseDB]) -> List[int]:
+    """
+    Inserta los registros y devuelve sus IDs en el mismo orden, sin recargar ninguna fila.
+
+    En SQLite se emite un único INSERT ... VALUES (...), (...) RETURNING id por
+    cada _INSERT_CHUNK filas. SQLite no garantiza el orden de RETURNING, pero un
+    solo escritor asigna rowids consecutivos en el orden de VALUES, así que
+    basta con ordenarlos. En el resto de bases se usa el flush del ORM, que
+    agrupa las filas con RETURNING donde el controlador lo permite (PostgreSQL,
+    MariaDB) y en MySQL inserta fila por fila dentro de la misma transacción.
+    """
+    dialect = db.get_bind().dialect
+    if dialect.name != "sqlite" or not dialect.insert_returning:
+        db.add_all(records)
+        # flush asigna los IDs; leerlos antes del commit evita recargar cada fila después
+        db.flush()
+        return [record.id for record in records]
+
+    table = ExpenseDB.__table__
+    columns = [column.key for column in table.columns if column.key != "id"]
+    rows = [{key: getattr(record, key) for key in columns} for record in records]
+    ids: List[int] = []
+    for start in range(0, len(rows), _INSERT_CHUNK):
+        result = db.execute(insert(table).values(rows[start:start + _INSERT_CHUNK]).returning(table.c.id))
+        ids.extend(sorted(result.scalars()))
+    return ids
+
+def save_final_expenses(db: Session, expenses: List[FinalExpense]) -> List[SavedExpense]:
+    """
+    Guarda varios gastos confirmados en una sola transacción.
+
+    Si la transacción falla no se guarda ninguno. Con DEDUP_ENABLED los
+    duplicados exactos (contra la base o dentro del mismo grupo) no se guardan,
+    salvo los que traen allow_duplicate, y los posibles duplicados se guardan marcados.
+
+    Args:
+        db: La sesión de la base de datos.
+        expenses: Los objetos FinalExpense a guardar.
+
+    Returns:
+        Un SavedExpense por gasto, en el mismo orden que expenses.
+    """
+    if not expenses:
+        return []
+    dedup_enabled = config.DEDUP_ENABLED
+    results: List[Optional[SavedExpense]] = [None] * len(expenses)
+    pending: List[int] = []  # posiciones que se insertan
+    records: Dict[int, ExpenseDB] = {}
+    same_as: Dict[int, int] = {}  # posición -> posición del gasto igual o parecido dentro del grupo
+    seen: Dict[str, int] = {}
+    seen_near: Dict[str, int] = {}
+
+    lock = dedup.get_index().locked({e.user_id for e in expenses}) if dedup_enabled else nullcontext()
+    with lock:
+        try:
+            with _DB_SECONDS.time("save_batch"):
+                for position, expense in enumerate(expenses):
+                    record = ExpenseDB(**expense.dict(exclude=_CONFIRMATION_FIELDS))
+                    if dedup_enabled:
+                        record.fingerprint = expense_fingerprint(expense)
+                        same_in_group = seen.get(record.fingerprint)
+                        if same_in_group is not None and not expense.allow_duplicate:
+                            same_as[position] = same_in_group
+                            continue
+                        check = find_duplicate(db, expense, record.fingerprint)
+                        if check.kind == "exact" and not expense.allow_duplicate:
+                            results[position] = SavedExpense(check.expense_id, duplicate=True)
+                            continue
+                        if check.kind == "exact" or same_in_group is not None:
+                            # Repetición confirmada: huella de la siguiente ocurrencia libre
+                            record.fingerprint = _repeat_fingerprint(db, expense, seen)
+                        record.duplicate_of = check.expense_id
+                        keys = dedup.near_keys(expense.amount, expense.currency, expense.expense_date, config.DEDUP_WINDOW_DAYS)
+                        earlier = same_in_group
+                        if earlier is None:
+                            earlier = next((seen_near[key] for key in keys if key in seen_near), None)
+                        if record.duplicate_of is None and earlier is not None:
+                            same_as[position] = earlier
+                        seen[record.fingerprint] = position
+                        seen_near.setdefault(keys[len(keys) // 2], position)
+                    records[position] = record
+                    pending.append(position)
+
+                try:
+                    ids = _insert_many(db, [records[p] for p in pending])
+                except IntegrityError:
+                    if not dedup_enabled:
+                        raise
+                    # Otro worker insertó alguno de estos gastos a la vez: se reintenta fila por fila
+                    db.rollback()
+                    ids = _insert_one_by_one(db, [records[p] for p in pending])
+
+                id_by_position = dict(zip(pending, ids))
+                marks: List[Dict[str, int]] = []
+                for position, expense_id in id_by_position.items():
+                    record = records[position]
+                    if expense_id is None:
+                        results[position] = SavedExpense(
+                            _find_by_fingerprint(db, record.user_id, record.fingerprint), duplicate=True
+                        )
+                        continue
+                    record.id = expense_id
+                    if position in same_as and id_by_position[same_as[position]] is not None:
+                        # Posible duplicado de otro gasto del mismo grupo: ahora ya tiene ID
+                        record.duplicate_of = id_by_position[same_as[position]]
+                        marks.append({"row_id": expense_id, "earlier_id": record.duplicate_of})
+                    if dedup_enabled:
+                        _remember(record)
+                    results[position] = SavedExpense(expense_id, record.duplicate_of)
+                _add_to_monthly_totals(db, [records[p] for p in pending if id_by_position[p] is not None])
+                if marks:
+                    table = ExpenseDB.__table__
+                    db.execute(
+                        update(table).where(table.c.id == bindparam("row_id")).values(duplicate_of=bindparam("earlier_id")),
+                        marks,
+                    )
+                db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.expunge_all()
+
+    for position, earlier in same_as.items():
+        if position not in records:
+            # Repetido dentro del mismo grupo: se informa el ID del primero
+            results[position] = SavedExpense(results[earlier].expense_id, duplicate=True)
+
+    stored = sum(1 for result in results if not result.duplicate)
+    _DB_ROWS.inc(amount=stored)
+    logger.info(f"{stored} gastos guardados en una sola transacción ({len(results) - stored} duplicados).")
+    return results
+
+def _amount_stats_query(user_id: str, provider_name: Optional[str], category: Optional[str]):
+    query = select(
+        func.count(ExpenseDB.id),
+        func.avg(ExpenseDB.amount),
+        func.avg(ExpenseDB.amount * ExpenseDB.amount),
+        func.min(ExpenseDB.amount),
+        func.max(ExpenseDB.amount),
+    ).where(ExpenseDB.user_id == user_id)
+    if provider_name:
+        query = query.where(ExpenseDB.provider_name == provider_name)
+    elif category:
+        query = query.where(ExpenseDB.category == category)
+    return query
+
+def _amount_stats(row) -> Dict[str, Any]:
+    count, mean, mean_sq, low, high = row
+    if not count:
+        return {"count": 0}
+    # Varianza poblacional a partir de E[x^2] - E[x]^2 (portable a SQLite, que no tiene STDDEV)
+    variance = max(0.0, mean_sq - mean * mean)
+    return {"count": count, "mean": mean, "stddev": variance ** 0.5, "min": low, "max": high}
+
+def get_amount_stats(
+    db: Session,
+    user_id: str,
+    provider_name: Optional[str] = None,
+    category: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Calcula estadísticas de los montos de un usuario para un proveedor o una categoría.
+
+    Se resuelve con una sola consulta de agregados, sin cargar filas.
+
+    Args:
+        db: La sesión de la base de datos.
+        user_id: El usuario.
+        provider_name: Filtrar por proveedor (tiene prioridad sobre la categoría).
+        category: Filtrar por categoría.
+
+    Returns:
+        Un diccionario con count, mean, stddev, min y max (count 0 si no hay historial).
+    """
+    with _DB_SECONDS.time("amount_stats"):
+        row = db.execute(_amount_stats_query(user_id, provider_name, category)).one()
+    return _amount_stats(row)
+
+async def aget_amount_stats(
+    db: "AsyncSession",
+    user_id: str,
+    provider_name: Optional[str] = None,
+    category: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Versión asíncrona de get_amount_stats para sesiones de async_session_scope.
+    """
+    with _DB_SECONDS.time("amount_stats_async"):
+        row = (await db.execute(_amount_stats_query(user_id, provider_name, category))).one()
+    return _amount_stats(row)
+
+# --- Consultas por usuario ---
+# Los filtros siguen el orden de los índices compuestos: user_id, luego categoría y luego
+# fecha. El filtrado, el orden y los agregados se resuelven en SQL.
+
+def _expense_filters(user_id: str, start: Optional[date], end: Optional[date], category: Optional[str]) -> list:
+    conditions = [ExpenseDB.user_id == user_id]
+    if category is not None:
+        conditions.append(ExpenseDB.category == category)
+    if start is not None:
+        conditions.append(ExpenseDB.expense_date >= start)
+    if end is not None:
+        conditions.append(ExpenseDB.expense_date <= end)
+    return conditions
+
+def _expenses_query(
+    user_id: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    category: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+):
+    # Orden por (fecha, id): es el orden del índice, así que no hace falta ordenar aparte
+    query = (
+        select(ExpenseDB)
+        .where(*_expense_filters(user_id, start, end, category))
+        .order_by(ExpenseDB.expense_date, ExpenseDB.id)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    if offset:
+        query = query.offset(offset)
+    return query
+
+def _totals_query(user_id: str, start: Optional[date] = None, end: Optional[date] = None, category: Optional[str] = None):
+    return (
+        select(ExpenseDB.currency, func.sum(ExpenseDB.amount), func.count(ExpenseDB.id))
+        .where(*_expense_filters(user_id, start, end, category))
+        .group_by(ExpenseDB.currency)
+    )
+
+def _category_totals_query(user_id: str, start: Optional[date] = None, end: Optional[date] = None):
+    total = func.sum(ExpenseDB.amount)
+    return (
+        select(ExpenseDB.category, ExpenseDB.currency, total, func.count(ExpenseDB.id))
+        .where(*_expense_filters(user_id, start, end, None))
+        .group_by(ExpenseDB.category, ExpenseDB.currency)
+        .order_by(total.desc())
+    )
+
+def _recent_query(user_id: str, since: Optional[datetime] = None, limit: int = 20):
+    query = select(ExpenseDB).where(ExpenseDB.user_id == user_id)
+    if since is not None:
+        query = query.where(ExpenseDB.confirmed_at >= since)
+    return query.order_by(ExpenseDB.confirmed_at.desc()).limit(limit)
+
+def get_expenses(
+    db: Session,
+    user_id: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    category: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> List[ExpenseDB]:
+    """
+    Gastos de un usuario entre dos fechas (incluidas), opcionalmente de una categoría.
+
+    Args:
+        db: La sesión de la base de datos.
+        user_id: El usuario.
+        start: Primera fecha del rango, o None para no acotar.
+        end: Última fecha del rango, o None para no acotar.
+        category: Filtrar por categoría.
+        limit: Máximo de gastos devueltos.
+        offset: Gastos a saltar (paginación).
+
+    Returns:
+        Los gastos ordenados por fecha y luego por ID.
+    """
+    with _DB_SECONDS.time("expenses_range"):
+        return list(db.execute(_expenses_query(user_id, start, end, category, limit, offset)).scalars())
+
+def get_totals(
+    db: Session,
+    user_id: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    category: Optional[str] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Total y número de gastos de un usuario por moneda en un rango de fechas.
+
+    Returns:
+        {moneda: {"total": suma, "count": gastos}}; vacío si no hay gastos.
+    """
+    with _DB_SECONDS.time("totals"):
+        rows = db.execute(_totals_query(user_id, start, end, category)).all()
+    return {currency: {"total": total, "count": count} for currency, total, count in rows}
+
+def get_category_totals(
+    db: Session,
+    user_id: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Total y número de gastos de un usuario por categoría y moneda en un rango de fechas.
+
+    Returns:
+        Diccionarios con category, currency, total y count, de mayor a menor total.
+    """
+    with _DB_SECONDS.time("category_totals"):
+        rows = db.execute(_category_totals_query(user_id, start, end)).all()
+    return [
+        {"category": category, "currency": currency, "total": total, "count": count}
+        for category, currency, total, count in rows
+    ]
+
+def get_recent_expenses(db: Session, user_id: str, since: Optional[datetime] = None, limit: int = 20) -> List[ExpenseDB]:
+    """
+    Últimos gastos confirmados de un usuario, del más reciente al más antiguo.
+
+    Args:
+        db: La sesión de la base de datos.
+        user_id: El usuario.
+        since: Solo los confirmados a partir de este momento.
+        limit: Máximo de gastos devueltos.
+    """
+    with _DB_SECONDS.time("recent_expenses"):
+        return list(db.execute(_recent_query(user_id, since, limit)).scalars())
+
+def iter_expense_chunks(db: Session, chunk_size: int = 1000, *columns) -> Iterator[List[Any]]:
+    """
+    Recorre la tabla de gastos en bloques ordenados por ID (paginación por clave).
+
+    Solo selecciona las columnas pedidas, sin cargar entidades ORM, de modo que la
+    memoria usada depende del tamaño del bloque y no del tamaño de la tabla.
+
+    Args:
+        db: La sesión de la base de datos.
+        chunk_size: Número de filas por bloque.
+        columns: Columnas de ExpenseDB a seleccionar además del ID.
+
+    Yields:
+        Listas de filas (id, *columns).
+    """
+    last_id = 0
+    while True:
+        rows = (
+            db.query(ExpenseDB.id, *columns)
+            .filter(ExpenseDB.id > last_id)
+            .order_by(ExpenseDB.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+def bulk_update_expenses(db: Session, mappings: List[Dict[str, Any]]) -> int:
+    """
+    Actualiza varios gastos en una sola operación y confirma la transacción.
+
+    Los grupos del resumen mensual afectados se recalculan en la misma
+    transacción; si ningún gasto cambia de monto, moneda, categoría o fecha
+    (huellas, marcas de duplicado, subcategorías) no se toca el resumen.
+
+    Args:
+        db: La sesión de la base de datos.
+        mappings: Diccionarios con la clave primaria 'id' y las columnas a cambiar.
+
+    Returns:
+        El número de filas enviadas a actualizar.
+    """
+    if not mappings:
+        return 0
+    affected = _changed_monthly_keys(db, mappings)
+    db.bulk_update_mappings(ExpenseDB, mappings)
+    if affected:
+        _refresh_monthly_totals(db, affected)
+    db.commit()
+    # Evitar que el mapa de identidad crezca entre bloques
+    db.expunge_all()
+    return len(mappings)
@@ -0,0 +1,187 @@
+"""
+Escritor con confirmación agrupada (group commit) para los gastos confirmados.
+
+Guardar cada gasto por separado cuesta un INSERT, un COMMIT (con su fsync) y
+un SELECT para recargar la fila. El escritor junta los gastos que llegan a la
+vez desde peticiones concurrentes y los guarda con
+repositories.save_final_expenses: un INSERT multi-fila y un solo COMMIT por
+grupo, con los IDs devueltos por el propio INSERT.
+
+Cada llamador recibe un futuro que se resuelve con su SavedExpense cuando el
+grupo está confirmado (o con la excepción si la transacción falla). Un grupo
+se cierra al llegar a WRITER_MAX_BATCH gastos o tras WRITER_MAX_DELAY_MS
+desde el primero; si ya hay gastos esperando no se espera nada. Mientras un
+grupo se escribe, el siguiente se va llenando. El búfer admite
+WRITER_BUFFER_SIZE gastos: cuando se llena, submit() espera (contrapresión).
+
+Vive en el bucle de IA (app.ai.client), como el pipeline; las escrituras se
+hacen en el hilo de escritura de app.persistence.db para no competir por los
+bloqueos de la base.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import metrics
+from app.config import config
+from app.persistence import repositories
+from app.persistence.db import get_write_executor, write_session_scope
+from app.schema.base import FinalExpense
+
+logger = logging.getLogger(__name__)
+
+_GROUP_SIZE = metrics.Histogram(
+    "expense_writer_group_size",
+    "Gastos confirmados en cada transacción del escritor.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+_WAIT_SECONDS = metrics.Histogram(
+    "expense_writer_wait_seconds", "Tiempo desde que se entrega un gasto hasta que es durable."
+)
+
+_STOP = object()
+
+_Entry = Tuple[FinalExpense, "asyncio.Future", float]
+
+
+def _write(expenses: List[FinalExpense]) -> List[repositories.SavedExpense]:
+    with write_session_scope() as session:
+        return repositories.save_final_expenses(session, expenses)
+
+
+class GroupCommitWriter:
+    """
+    Búfer acotado de gastos y tarea que los confirma por grupos.
+    """
+
+    def __init__(self, max_batch: int, max_delay: float, buffer_size: int):
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max(0.0, max_delay)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, buffer_size))
+        self._closed = False
+        self._task = asyncio.ensure_future(self._run())
+        self.stats = {"submitted": 0, "stored": 0, "duplicates": 0, "groups": 0, "failed_groups": 0, "largest_group": 0}
+
+    async def submit(self, expense: FinalExpense) -> "asyncio.Future":
+        """
+        Entrega un gasto y devuelve el futuro de su SavedExpense.
+
+        Si el búfer está lleno, espera a que haya sitio.
+        """
+        if self._closed:
+            raise RuntimeError("El escritor de gastos está detenido.")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((expense, future, time.monotonic()))
+        self.stats["submitted"] += 1
+        return future
+
+    async def save(self, expense: FinalExpense) -> repositories.SavedExpense:
+        """
+        Guarda un gasto y espera a que su grupo esté confirmado.
+        """
+        return await (await self.submit(expense))
+
+    async def _collect(self) -> Tuple[List[_Entry], bool]:
+        first = await self._queue.get()
+        if first is _STOP:
+            return [], True
+        if self._queue.empty() and self.max_delay:
+            # Un momento para que lleguen más gastos; con carga, el grupo se llena sin esperar
+            await asyncio.sleep(self.max_delay)
+        group = [first]
+        while len(group) < self.max_batch and not self._queue.empty():
+            entry = self._queue.get_nowait()
+            if entry is _STOP:
+                return group, True
+            group.append(entry)
+        return group, False
+
+    async def _run(self) -> None:
+        while True:
+            group, stop = await self._collect()
+            if group:
+                await self._flush(group)
+            if stop:
+                return
+
+    async def _flush(self, group: List[_Entry]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            saved = await loop.run_in_executor(get_write_executor(), _write, [expense for expense, _, _ in group])
+        except Exception as e:
+            logger.error(f"No se pudo guardar un grupo de {len(group)} gastos: {e}", exc_info=True)
+            self.stats["failed_groups"] += 1
+            for _, future, _ in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        now = time.monotonic()
+        for (_, future, submitted_at), result in zip(group, saved):
+            _WAIT_SECONDS.observe(now - submitted_at)
+            if not future.done():
+                # Un llamador cancelado no impide que el resto reciba su resultado
+                future.set_result(result)
+        duplicates = sum(1 for result in saved if result.duplicate)
+        self.stats["stored"] += len(saved) - duplicates
+        self.stats["duplicates"] += duplicates
+        self.stats["groups"] += 1
+        self.stats["largest_group"] = max(self.stats["largest_group"], len(group))
+        _GROUP_SIZE.observe(len(group))
+
+    async def stop(self) -> None:
+        """
+        Deja de aceptar gastos y confirma los que quedan en el búfer.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        await self._queue.put(_STOP)
+        await self._task
+        logger.info(f"Escritor de gastos detenido tras {self.stats['groups']} grupos.")
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["buffered"] = self._queue.qsize()
+        stats["mean_group"] = round(self.stats["stored"] / self.stats["groups"], 2) if self.stats["groups"] else 0.0
+        return stats
+
+
+_writer: Optional[GroupCommitWriter] = None
+
+
+def get_writer() -> GroupCommitWriter:
+    """
+    Escritor del bucle actual (se crea la primera vez; llamar desde el bucle de IA).
+    """
+    global _writer
+    if _writer is None:
+        _writer = GroupCommitWriter(
+            config.WRITER_MAX_BATCH, config.WRITER_MAX_DELAY_MS / 1000, config.WRITER_BUFFER_SIZE
+        )
+    return _writer
+
+
+async def shutdown() -> None:
+    """
+    Confirma los gastos pendientes y detiene el escritor.
+    """
+    global _writer
+    if _writer is not None:
+        writer, _writer = _writer, None
+        await writer.stop()
+
+
+def get_stats() -> Dict[str, Any]:
+    return _writer.get_stats() if _writer is not None else {}
+
+
+metrics.Counter(
+    "expense_writer_total",
+    "Eventos del escritor agrupado (submitted, stored, duplicates, groups, failed_groups).",
+    ["event"],
+    function=lambda: {
+        (event,): value for event, value in get_stats().items()
+        if event in ("submitted", "stored", "duplicates", "groups", "failed_groups")
+    },
+)
@@ -0,0 +1,200 @@
+"""
+Pipeline por etapas con colas acotadas.
+
+Cada etapa tiene su propia cola de entrada con tamaño máximo y un número fijo
+de trabajadores (tareas asíncronas). Cuando una cola se llena, los
+trabajadores de la etapa anterior esperan antes de entregar el trabajo, de
+modo que la presión se propaga hacia atrás hasta submit() en lugar de
+acumular trabajo en memoria.
+
+El pipeline no sabe qué hace cada etapa: el manejador de la etapa recibe el
+trabajo, lo completa (en el propio bucle, en un pool de procesos o en un
+hilo dedicado) y puede terminarlo antes de tiempo con Job.finish().
+"""
+import asyncio
+import logging
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Pipelines vivos, para exportar la profundidad de sus colas
+_pipelines: "weakref.WeakSet[Pipeline]" = weakref.WeakSet()
+
+
+def _queue_gauges(field: str) -> Callable[[], Dict[tuple, float]]:
+    def collect() -> Dict[tuple, float]:
+        return {
+            (pipeline.name, name): stats[field]
+            for pipeline in list(_pipelines)
+            for name, stats in pipeline.get_stats().items()
+        }
+    return collect
+
+
+_STAGE_SECONDS = metrics.Histogram(
+    "expense_pipeline_stage_seconds", "Duración del manejador de cada etapa del pipeline.", ["pipeline", "stage"]
+)
+_STAGE_TOTAL = metrics.Counter(
+    "expense_pipeline_stage_total",
+    "Trabajos procesados por etapa; outcome ok, finished (terminó antes de tiempo) o error.",
+    ["pipeline", "stage", "outcome"],
+)
+metrics.Gauge(
+    "expense_pipeline_queue_depth", "Trabajos esperando en la cola de cada etapa.",
+    ["pipeline", "stage"], function=_queue_gauges("queue_depth"),
+)
+metrics.Gauge(
+    "expense_pipeline_in_flight", "Trabajos en curso en cada etapa.",
+    ["pipeline", "stage"], function=_queue_gauges("in_flight"),
+)
+
+
+class Job:
+    """
+    Un elemento que recorre el pipeline. Las etapas guardan sus resultados como atributos.
+    """
+
+    def __init__(self, **fields: Any):
+        self.__dict__.update(fields)
+        self.future: Optional[asyncio.Future] = None
+        self.started_at = time.monotonic()
+        self.stage_times: Dict[str, float] = {}
+
+    def finish(self, result: Any = None) -> None:
+        """
+        Termina el trabajo con un resultado sin pasar por las etapas restantes.
+        """
+        if not self.future.done():
+            self.future.set_result(result)
+
+    def fail(self, error: BaseException) -> None:
+        if not self.future.done():
+            self.future.set_exception(error)
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+
+class Stage:
+    """
+    Una etapa: manejador asíncrono, número de trabajadores y tamaño de la cola de entrada.
+
+    El valor devuelto por el manejador de la última etapa es el resultado del trabajo.
+    """
+
+    def __init__(self, name: str, handler: Callable[[Job], Awaitable[Any]], workers: int, queue_size: int):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.in_flight = 0
+        self.stats: Dict[str, int] = {"processed": 0, "failed": 0}
+
+
+class Pipeline:
+    """
+    Encadena etapas y reparte los trabajos entre sus trabajadores.
+
+    Debe usarse siempre desde el mismo bucle de eventos.
+    """
+
+    def __init__(self, name: str, stages: List[Stage]):
+        self.name = name
+        self.stages = stages
+        self._tasks: List[asyncio.Task] = []
+        _pipelines.add(self)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        for index, stage in enumerate(self.stages):
+            stage.queue = asyncio.Queue(maxsize=stage.queue_size)
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            for n in range(stage.workers):
+                self._tasks.append(asyncio.ensure_future(self._worker(stage, next_stage)))
+        logger.info(
+            f"Pipeline '{self.name}' iniciado: "
+            + ", ".join(f"{s.name}={s.workers}" for s in self.stages)
+        )
+
+    async def stop(self) -> None:
+        """
+        Detiene los trabajadores. Los trabajos pendientes fallan con CancelledError,
+        tanto los que esperan en una cola como los que un trabajador tiene en curso.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for stage in self.stages:
+            while stage.queue is not None and not stage.queue.empty():
+                stage.queue.get_nowait().fail(asyncio.CancelledError())
+
+    async def submit(self, job: Job) -> Any:
+        """
+        Entrega un trabajo a la primera etapa y espera su resultado.
+
+        Si la primera cola está llena, espera a que haya sitio (contrapresión).
+        """
+        self.start()
+        job.future = asyncio.get_running_loop().create_future()
+        await self.stages[0].queue.put(job)
+        return await job.future
+
+    async def _worker(self, stage: Stage, next_stage: Optional[Stage]) -> None:
+        while True:
+            job = await stage.queue.get()
+            if job.done:
+                continue
+            stage.in_flight += 1
+            start = time.monotonic()
+            try:
+                result = await stage.handler(job)
+            except asyncio.CancelledError:
+                # stop(): el trabajo en curso no debe dejar a su llamador esperando
+                job.fail(asyncio.CancelledError())
+                raise
+            except Exception as e:
+                stage.stats["failed"] += 1
+                _STAGE_TOTAL.inc(self.name, stage.name, "error")
+                job.fail(e)
+                continue
+            finally:
+                stage.in_flight -= 1
+                elapsed = job.stage_times[stage.name] = time.monotonic() - start
+                _STAGE_SECONDS.observe(elapsed, self.name, stage.name)
+            stage.stats["processed"] += 1
+            if job.done:
+                _STAGE_TOTAL.inc(self.name, stage.name, "finished")
+                continue
+            _STAGE_TOTAL.inc(self.name, stage.name, "ok")
+            if next_stage is None:
+                job.finish(result)
+            else:
+                # Si la siguiente etapa está saturada, este trabajador espera
+                try:
+                    await next_stage.queue.put(job)
+                except asyncio.CancelledError:
+                    job.fail(asyncio.CancelledError())
+                    raise
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Profundidad de cola, trabajos en curso y contadores de cada etapa.
+        """
+        return {
+            stage.name: {
+                "workers": stage.workers,
+                "queue_depth": stage.queue.qsize() if stage.queue is not None else 0,
+                "queue_capacity": stage.queue_size,
+                "in_flight": stage.in_flight,
+                **stage.stats,
+            }
+            for stage in self.stages
+        }
@@ -0,0 +1,111 @@
+"""
+Autómata Aho-Corasick para la búsqueda simultánea de muchos patrones.
+
+Se compila una sola vez a partir de la configuración y después recorre la
+descripción en una sola pasada, sin importar cuántos proveedores, alias o
+palabras clave existan.
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class Automaton:
+    """
+    Autómata de coincidencia de múltiples patrones (Aho-Corasick).
+
+    Cada patrón se registra junto con una carga útil (payload) arbitraria. El
+    orden de inserción se conserva y se usa como criterio de desempate.
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]):
+        # Tabla de transiciones: una lista de diccionarios indexada por estado
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Para cada estado, los índices de patrón que terminan en él
+        # (incluyendo los heredados por los enlaces de fallo)
+        self._out: List[Tuple[int, ...]] = [()]
+        self._lengths: List[int] = []
+        self._payloads: List[Any] = []
+        self.max_length = 0
+
+        seen = set()
+        for pattern, payload in patterns:
+            if not pattern or pattern in seen:
+                # Un patrón repetido lo resuelve la primera entrada de la configuración
+                continue
+            seen.add(pattern)
+            self._add(pattern, len(self._payloads))
+            self._lengths.append(len(pattern))
+            self._payloads.append(payload)
+            self.max_length = max(self.max_length, len(pattern))
+
+        self._build_failure_links()
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def _add(self, pattern: str, index: int) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = next_state
+        self._out[state] = self._out[state] + (index,)
+
+    def _build_failure_links(self) -> None:
+        # Recorrido en anchura: los enlaces de fallo de un nivel dependen del anterior
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """
+        Genera todas las coincidencias como tuplas (inicio, fin, payload),
+        en el orden en que terminan dentro del texto.
+        """
+        for end, index in self._scan(text):
+            yield end - self._lengths[index], end, self._payloads[index]
+
+    def find(self, text: str) -> Optional[Any]:
+        """
+        Devuelve el payload de la mejor coincidencia, o None.
+
+        Semántica explícita:
+        1. Gana la coincidencia que empieza más a la izquierda en el texto.
+        2. Si varias empiezan en la misma posición, gana la más larga.
+        3. Si persiste el empate, gana la que aparece primero en la configuración.
+        """
+        best: Optional[Tuple[int, int, int]] = None
+        for end, index in self._scan(text):
+            start = end - self._lengths[index]
+            key = (start, -self._lengths[index], index)
+            if best is None or key < best:
+                best = key
+            # Ninguna coincidencia posterior puede empezar antes que la mejor actual
+            if end - self.max_length >= best[0]:
+                break
+        return self._payloads[best[2]] if best is not None else None
+
+    def _scan(self, text: str) -> Iterator[Tuple[int, int]]:
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in out[state]:
+                yield position + 1, index
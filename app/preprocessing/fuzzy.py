@@ -0,0 +1,111 @@
+"""
+Coincidencia difusa de proveedores mediante un índice invertido de trigramas.
+
+Pensado para descripciones con errores de OCR o de transcripción ("amazn",
+"ofice depo"). El índice preselecciona unos pocos candidatos por trigramas
+compartidos y solo esos se puntúan con una medida de similitud más costosa,
+de modo que el trabajo por llamada está acotado aunque el catálogo crezca.
+"""
+import re
+from difflib import SequenceMatcher
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Límites que acotan el trabajo por llamada
+MAX_TOKENS = 32          # Solo se examinan los primeros tokens de la descripción
+MAX_POSTINGS = 512       # Trigramas más comunes que esto no discriminan y se ignoran
+SHORTLIST_SIZE = 8       # Candidatos que pasan a la puntuación final
+MIN_PATTERN_LENGTH = 4   # Fragmentos más cortos solo coinciden de forma exacta
+
+
+def trigrams(text: str) -> Set[str]:
+    """
+    Devuelve el conjunto de trigramas de un texto, con relleno en los bordes.
+    """
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Índice invertido trigrama -> patrones para la búsqueda aproximada.
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]):
+        self._patterns: List[str] = []
+        self._payloads: List[Any] = []
+        self._sizes: List[int] = []
+        self._postings: Dict[str, List[int]] = {}
+        self.max_words = 1
+
+        seen = set()
+        for pattern, payload in patterns:
+            pattern = " ".join(_TOKEN_RE.findall(pattern or ""))
+            if len(pattern) < MIN_PATTERN_LENGTH or pattern in seen:
+                continue
+            seen.add(pattern)
+            index = len(self._patterns)
+            grams = trigrams(pattern)
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(index)
+            self._patterns.append(pattern)
+            self._payloads.append(payload)
+            self._sizes.append(len(grams))
+            self.max_words = max(self.max_words, pattern.count(" ") + 1)
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def _windows(self, text: str) -> List[str]:
+        tokens = _TOKEN_RE.findall(text)[:MAX_TOKENS]
+        windows = []
+        for size in range(1, self.max_words + 1):
+            for start in range(len(tokens) - size + 1):
+                window = " ".join(tokens[start:start + size])
+                if len(window) >= MIN_PATTERN_LENGTH:
+                    windows.append(window)
+        return windows
+
+    def search(self, text: str, threshold: float) -> Optional[Tuple[Any, float, str]]:
+        """
+        Busca el patrón más parecido a algún fragmento del texto.
+
+        Returns:
+            Una tupla (payload, puntuación, patrón) si la mejor similitud alcanza
+            el umbral, o None.
+        """
+        if not self._patterns:
+            return None
+
+        # 1. Preselección: trigramas compartidos por ventana de tokens (coeficiente de Dice)
+        candidates: Dict[Tuple[int, str], float] = {}
+        for window in self._windows(text):
+            grams = trigrams(window)
+            shared: Dict[int, int] = {}
+            for gram in grams:
+                posting = self._postings.get(gram)
+                if posting is None or len(posting) > MAX_POSTINGS:
+                    continue
+                for index in posting:
+                    shared[index] = shared.get(index, 0) + 1
+            for index, count in shared.items():
+                dice = 2.0 * count / (len(grams) + self._sizes[index])
+                # Con una cota laxa se descartan pronto los candidatos sin opciones
+                if dice >= threshold * 0.5:
+                    candidates[(index, window)] = dice
+        if not candidates:
+            return None
+
+        shortlist = sorted(candidates.items(), key=lambda item: item[1], reverse=True)[:SHORTLIST_SIZE]
+
+        # 2. Puntuación fina solo sobre la lista corta
+        best = None
+        for (index, window), _ in shortlist:
+            score = SequenceMatcher(None, window, self._patterns[index]).ratio()
+            if best is None or score > best[1] or (score == best[1] and index < best[0]):
+                best = (index, score)
+        if best is None or best[1] < threshold:
+            return None
+        index, score = best
+        return self._payloads[index], round(score, 3), self._patterns[index]
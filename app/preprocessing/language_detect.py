@@ -1,11 +1,110 @@
 """
 Language detection functions.
+
+An offline character trigram identifier tuned for short Spanish/English
+expense messages. Profiles are shipped as a compact JSON file in
+`app/preprocessing/data` (regenerate with `python -m app.maintenance.build_lang_profiles`)
+and loaded once per process. Results are memoized, so repeated messages cost
+a dictionary lookup.
 """
+import json
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "lang_profiles.json")
+
+NGRAM_SIZE = 3
+
+# Letters only: digits, currency and punctuation carry no language signal
+_TOKEN_RE = re.compile(r"[^\W\d_]+")
+
+# Characters that only appear in Spanish among the supported languages
+_SPANISH_MARKERS = frozenset("ñáéíóú¿¡")
 
-def detect_language(text: str) -> str:
+# Log-probability bonus for a token found in a language's common-word list
+_WORD_BONUS = 2.0
+
+# Minimum log-likelihood gap between the two best languages; below it the
+# text is too short or too neutral (brand names, amounts) to decide
+_MIN_MARGIN = 7.0
+
+_PROFILES = None
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lowercase letter-only tokens.
+    """
+    return _TOKEN_RE.findall(text.lower())
+
+
+def token_ngrams(token: str) -> List[str]:
+    """
+    Returns the padded character n-grams of a single token.
+    """
+    padded = f" {token} "
+    return [padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)]
+
+
+def _load_profiles() -> Dict[str, Tuple[Dict[str, float], float, frozenset]]:
+    global _PROFILES
+    if _PROFILES is None:
+        profiles = {}
+        try:
+            with open(PROFILES_PATH, encoding="utf-8") as f:
+                data = json.load(f)
+            for language, profile in data["languages"].items():
+                profiles[language] = (profile["grams"], profile["floor"], frozenset(profile["words"]))
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Could not load language profiles from {PROFILES_PATH}: {e}")
+        _PROFILES = profiles
+    return _PROFILES
+
+
+@lru_cache(maxsize=4096)
+def _detect(text: str, default: str) -> str:
+    profiles = _load_profiles()
+    tokens = tokenize(text)
+    if not tokens or not profiles:
+        return default
+
+    scores = {}
+    for language, (grams, floor, words) in profiles.items():
+        score = 0.0
+        for token in tokens:
+            for gram in token_ngrams(token):
+                score += grams.get(gram, floor)
+            if token in words:
+                score += _WORD_BONUS
+        scores[language] = score
+
+    if "es" in scores and any(char in _SPANISH_MARKERS for char in text.lower()):
+        scores["es"] += _WORD_BONUS
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    best, best_score = ranked[0]
+    if len(ranked) > 1 and best_score - ranked[1][1] < _MIN_MARGIN:
+        return default
+    return best
+
+
+def detect_language(text: str, default: Optional[str] = None) -> str:
     """
     Detects the language of a given text.
-    Stub function.
+
+    Returns an ISO 639-1 code ("es" or "en"). Falls back to `default`
+    (config.DEFAULT_LANGUAGE when omitted) for empty or ambiguous text such as
+    "uber 120".
     """
-    # In a real app, use a library like 'langdetect' or 'google-cloud-translate'
-    return "en" # Assume English for now
+    if default is None:
+        default = config.DEFAULT_LANGUAGE
+    if not text:
+        return default
+    return _detect(text, default)
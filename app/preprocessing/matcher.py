@@ -1,90 +1,290 @@
 """
 Lógica de coincidencia para proveedores y palabras clave.
+
+Los nombres, alias y palabras clave se compilan una sola vez en autómatas
+Aho-Corasick, de modo que cada descripción se recorre en una sola pasada
+independientemente del tamaño del catálogo.
+
+Tanto los patrones (al cargar la configuración) como las descripciones pasan
+por `normalize_for_matching`, así que "cómputo" coincide con "computo".
+
+La configuración vive en una instantánea versionada que se reemplaza de forma
+atómica cuando cambian los archivos CSV, sin reiniciar el proceso.
 """
 import logging
-from typing import Optional, Dict, Any
-from app.preprocessing.config_loader import load_providers, load_keywords
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, Iterable, Iterator, Tuple
+
+from app.config import config
+from app.preprocessing import config_loader
+from app.preprocessing.automaton import Automaton
+from app.preprocessing.fuzzy import TrigramIndex
+from app.preprocessing.normalize_text import normalize_for_matching
 
 logger = logging.getLogger(__name__)
 
-# Caché global para la configuración
-_PROVIDERS = None
-_KEYWORDS = None
+def _provider_patterns(providers):
+    """
+    Genera los patrones normalizados (nombre y alias) de cada proveedor, en orden.
+    """
+    for p in providers:
+        yield normalize_for_matching(p.get('provider_name') or ''), p
+        for alias in p.get('aliases', []):
+            yield normalize_for_matching(alias), p
+
+def build_provider_automaton(providers) -> Automaton:
+    """
+    Compila nombres y alias de proveedores en un único autómata.
+    El orden de la configuración (nombre antes que sus alias) decide los empates.
+    """
+    return Automaton(_provider_patterns(providers))
+
+def build_fuzzy_index(providers) -> TrigramIndex:
+    """
+    Construye el índice de trigramas sobre nombres y alias de proveedores.
+    """
+    return TrigramIndex(_provider_patterns(providers))
+
+def build_keyword_automaton(keywords) -> Automaton:
+    """
+    Compila las palabras clave en un único autómata.
+    """
+    return Automaton((normalize_for_matching(k.get('keyword') or ''), k) for k in keywords)
+
+class ConfigSnapshot:
+    """
+    Instantánea inmutable de la configuración de coincidencia.
+
+    Contiene la salida de los cargadores y los autómatas compilados a partir de
+    ella. Se construye completa antes de publicarse, por lo que un lector nunca
+    observa un estado a medio construir.
+    """
+    __slots__ = ("version", "fingerprint", "loaded_at", "providers", "keywords",
+                 "provider_automaton", "keyword_automaton", "fuzzy_index")
+
+    def __init__(self, version: int, fingerprint: Tuple, providers, keywords):
+        self.version = version
+        self.fingerprint = fingerprint
+        self.loaded_at = time.time()
+        self.providers = providers
+        self.keywords = keywords
+        self.provider_automaton = build_provider_automaton(providers)
+        self.keyword_automaton = build_keyword_automaton(keywords)
+        self.fuzzy_index = build_fuzzy_index(providers)
+
+# Instantánea activa. Se reemplaza con una sola asignación (atómica en CPython).
+_SNAPSHOT: Optional[ConfigSnapshot] = None
+_BUILD_LOCK = threading.Lock()
+_CHECK_LOCK = threading.Lock()
+_next_check = 0.0
+
+def _file_fingerprint() -> Tuple:
+    """
+    Huella barata de los archivos de configuración (mtime y tamaño).
+    """
+    stats = []
+    for path in (config_loader.PROVIDERS_PATH, config_loader.KEYWORDS_PATH):
+        try:
+            st = os.stat(path)
+            stats.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stats.append(None)
+    return tuple(stats)
+
+def _build_snapshot(version: int, strict: bool = True) -> Optional[ConfigSnapshot]:
+    """
+    Carga y compila una nueva instantánea. En modo estricto devuelve None si los
+    archivos cambiaron mientras se leían (p. ej. un editor guardando a medias).
+    """
+    fingerprint = _file_fingerprint()
+    snapshot = ConfigSnapshot(version, fingerprint, config_loader.load_providers(), config_loader.load_keywords())
+    if strict and _file_fingerprint() != fingerprint:
+        logger.warning("La configuración cambió durante la recarga; se reintentará en la próxima verificación.")
+        return None
+    return snapshot
+
+def reload_config() -> int:
+    """
+    Fuerza la recarga síncrona de la configuración y devuelve la versión activa.
+    """
+    global _SNAPSHOT
+    with _BUILD_LOCK:
+        current = _SNAPSHOT
+        # La primera carga siempre se publica para que nunca falte una instantánea
+        snapshot = _build_snapshot(current.version + 1 if current else 1, strict=current is not None)
+        if snapshot is not None:
+            _SNAPSHOT = snapshot
+            logger.info(
+                f"Configuración de coincidencia v{snapshot.version} activa: "
+                f"{len(snapshot.provider_automaton)} patrones de proveedor, "
+                f"{len(snapshot.keyword_automaton)} palabras clave."
+            )
+        return _SNAPSHOT.version if _SNAPSHOT else 0
+
+def _background_reload():
+    try:
+        reload_config()
+    except Exception as e:
+        logger.error(f"Error al recargar la configuración de coincidencia: {e}")
+    finally:
+        _CHECK_LOCK.release()
+
+def _check_for_changes(snapshot: ConfigSnapshot) -> None:
+    """
+    Compara la huella de los archivos como máximo una vez por intervalo y, si
+    cambió, reconstruye la instantánea en un hilo aparte.
+    """
+    global _next_check
+    if time.monotonic() < _next_check or not _CHECK_LOCK.acquire(blocking=False):
+        return
+    _next_check = time.monotonic() + config.MATCHER_RELOAD_INTERVAL
+    if _file_fingerprint() == snapshot.fingerprint:
+        _CHECK_LOCK.release()
+        return
+    logger.info("Cambios detectados en la configuración de coincidencia; recargando en segundo plano.")
+    # El candado se libera al terminar la recarga, evitando recargas simultáneas
+    threading.Thread(target=_background_reload, name="matcher-reload", daemon=True).start()
+
+def get_snapshot() -> ConfigSnapshot:
+    """
+    Devuelve la instantánea activa, cargándola la primera vez.
+    """
+    snapshot = _SNAPSHOT
+    if snapshot is None:
+        reload_config()
+        return _SNAPSHOT
+    if config.MATCHER_RELOAD_INTERVAL > 0:
+        _check_for_changes(snapshot)
+    return snapshot
+
+def get_config_version() -> Dict[str, Any]:
+    """
+    Describe la instantánea activa para depuración.
+    """
+    snapshot = get_snapshot()
+    return {
+        "version": snapshot.version,
+        "loaded_at": snapshot.loaded_at,
+        "providers": len(snapshot.providers),
+        "keywords": len(snapshot.keywords),
+    }
 
 def get_config():
     """
-    Devuelve la configuración cargada, utilizando la caché si está disponible.
+    Devuelve la configuración cargada de la instantánea activa.
+    """
+    snapshot = get_snapshot()
+    return snapshot.providers, snapshot.keywords
+
+def get_automata() -> Tuple[Automaton, Automaton]:
+    """
+    Devuelve los autómatas compilados de la instantánea activa.
     """
-    global _PROVIDERS, _KEYWORDS
-    if _PROVIDERS is None:
-        _PROVIDERS = load_providers()
-    if _KEYWORDS is None:
-        _KEYWORDS = load_keywords()
-    return _PROVIDERS, _KEYWORDS
+    snapshot = get_snapshot()
+    return snapshot.provider_automaton, snapshot.keyword_automaton
 
-def match_provider(description: str) -> Optional[Dict[str, Any]]:
+def match_provider(description: str, normalized: bool = False) -> Optional[Dict[str, Any]]:
     """
     Busca un nombre de proveedor o alias en la descripción.
+    Gana la coincidencia más a la izquierda; en empate, la más larga.
+    Con normalized=True se asume que la descripción ya pasó por normalize_for_matching.
     """
-    providers, _ = get_config()
-    desc_lower = description.lower()
-    
-    for p in providers:
-        name = p.get('provider_name', '').lower()
-        aliases = p.get('aliases', [])
-        
-        # Verificar nombre
-        if name and name in desc_lower:
-            return p
-        
-        # Verificar alias
-        for alias in aliases:
-            if alias and alias in desc_lower:
-                return p
-                
-    return None
-
-def match_keywords(description: str) -> Optional[Dict[str, Any]]:
+    provider_automaton, _ = get_automata()
+    return provider_automaton.find(description if normalized else normalize_for_matching(description))
+
+def match_keywords(description: str, normalized: bool = False) -> Optional[Dict[str, Any]]:
     """
     Busca palabras clave en la descripción.
+    Gana la coincidencia más a la izquierda; en empate, la más larga.
+    Con normalized=True se asume que la descripción ya pasó por normalize_for_matching.
     """
-    _, keywords = get_config()
-    desc_lower = description.lower()
-    
-    for k in keywords:
-        keyword = k.get('keyword', '').lower()
-        if keyword and keyword in desc_lower:
-            return k
-            
-    return None
+    _, keyword_automaton = get_automata()
+    return keyword_automaton.find(description if normalized else normalize_for_matching(description))
 
-def get_metadata_from_match(description: str) -> Dict[str, Any]:
+def match_provider_fuzzy(description: str, normalized: bool = False) -> Optional[Tuple[Dict[str, Any], float]]:
     """
-    Intenta encontrar metadatos (categoría, subcategoría, etc.) para una descripción.
-    Prioridad: Coincidencia de Proveedor > Coincidencia de Palabra Clave.
+    Busca un proveedor de forma aproximada (errores de OCR o voz).
+    Devuelve el proveedor y su puntuación de similitud, o None si no supera el umbral.
+    """
+    if config.MATCHER_FUZZY_THRESHOLD <= 0:
+        return None
+    if not normalized:
+        description = normalize_for_matching(description)
+    result = get_snapshot().fuzzy_index.search(description, config.MATCHER_FUZZY_THRESHOLD)
+    if result is None:
+        return None
+    provider, score, _ = result
+    return provider, score
+
+def _provider_metadata(provider: Dict[str, Any], match_type: str) -> Dict[str, Any]:
+    return {
+        "category": provider.get('categoria_principal'),
+        "subcategory": provider.get('subcategoria'),
+        "expense_type": provider.get('tipo_gasto_default'),
+        "match_type": match_type,
+        "matched_name": provider['provider_name']
+    }
+
+def _keyword_metadata(keyword: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "category": keyword.get('categoria_principal'),
+        "subcategory": keyword.get('subcategoria'),
+        "expense_type": keyword.get('tipo_gasto_default'),
+        "match_type": "keyword",
+        "matched_name": keyword['keyword']
+    }
+
+def _match_with_snapshot(snapshot: ConfigSnapshot, desc_norm: str) -> Dict[str, Any]:
+    """
+    Aplica los niveles de coincidencia sobre una instantánea concreta, sin registrar nada.
+    La descripción debe llegar ya normalizada.
     """
-    # 1. Intentar coincidencia de proveedor
-    provider = match_provider(description)
+
+    provider = snapshot.provider_automaton.find(desc_norm)
     if provider:
-        logger.info(f"Proveedor coincidente: {provider['provider_name']}")
-        return {
-            "category": provider.get('categoria_principal'),
-            "subcategory": provider.get('subcategoria'),
-            "expense_type": provider.get('tipo_gasto_default'),
-            "match_type": "provider",
-            "matched_name": provider['provider_name']
-        }
-    
-    # 2. Intentar coincidencia de palabra clave
-    keyword = match_keywords(description)
+        return _provider_metadata(provider, "provider")
+
+    keyword = snapshot.keyword_automaton.find(desc_norm)
     if keyword:
-        logger.info(f"Palabra clave coincidente: {keyword['keyword']}")
-        return {
-            "category": keyword.get('categoria_principal'),
-            "subcategory": keyword.get('subcategoria'),
-            "expense_type": keyword.get('tipo_gasto_default'),
-            "match_type": "keyword",
-            "matched_name": keyword['keyword']
-        }
-        
+        return _keyword_metadata(keyword)
+
+    if config.MATCHER_FUZZY_THRESHOLD > 0:
+        fuzzy = snapshot.fuzzy_index.search(desc_norm, config.MATCHER_FUZZY_THRESHOLD)
+        if fuzzy:
+            provider, score, _ = fuzzy
+            metadata = _provider_metadata(provider, "fuzzy_provider")
+            metadata["score"] = score
+            return metadata
+
     return {}
+
+def get_metadata_from_match(description: str, normalized: bool = False) -> Dict[str, Any]:
+    """
+    Intenta encontrar metadatos (categoría, subcategoría, etc.) para una descripción.
+    Prioridad: Coincidencia de Proveedor > Coincidencia de Palabra Clave > Proveedor Aproximado.
+    Con normalized=True se asume que la descripción ya pasó por normalize_for_matching.
+    """
+    if not normalized:
+        description = normalize_for_matching(description)
+    metadata = _match_with_snapshot(get_snapshot(), description)
+    if metadata.get("match_type") == "provider":
+        logger.info(f"Proveedor coincidente: {metadata['matched_name']}")
+    elif metadata.get("match_type") == "keyword":
+        logger.info(f"Palabra clave coincidente: {metadata['matched_name']}")
+    elif metadata.get("match_type") == "fuzzy_provider":
+        logger.info(f"Proveedor aproximado: {metadata['matched_name']} (puntuación {metadata['score']})")
+    return metadata
+
+def iter_metadata_from_matches(descriptions: Iterable[Optional[str]]) -> Iterator[Dict[str, Any]]:
+    """
+    Versión por lotes de get_metadata_from_match para reprocesos masivos.
+
+    Consume las descripciones de forma perezosa y genera un diccionario de
+    metadatos por cada una, en el mismo orden. Toda la secuencia usa una misma
+    instantánea de configuración y no registra una línea por elemento.
+    """
+    snapshot = get_snapshot()
+    for description in descriptions:
+        yield _match_with_snapshot(snapshot, normalize_for_matching(description)) if description else {}
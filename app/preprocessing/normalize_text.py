@@ -1,11 +1,91 @@
 """
 Text normalization functions.
+
+All text goes through a single normalization stage: Unicode NFKC, lowercasing,
+accent folding and whitespace collapsing, with optional removal of currency
+symbols and punctuation. The character mappings are compiled once into
+translation tables at import time so each call is a handful of C-level passes.
 """
+import re
+import unicodedata
+from typing import Dict
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Only scan the blocks where Latin letters, punctuation and currency symbols live
+_SCAN_LIMIT = 0x3000
+
+
+def _build_tables():
+    accents: Dict[int, str] = {}
+    currency: Dict[int, str] = {}
+    punctuation: Dict[int, str] = {}
+    for codepoint in range(_SCAN_LIMIT):
+        char = chr(codepoint)
+        category = unicodedata.category(char)
+        if category == "Mn":
+            # Stray combining marks that NFKC could not compose
+            accents[codepoint] = None
+        elif category.startswith("L"):
+            base = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+            if base and base != char:
+                accents[codepoint] = base
+        elif category == "Sc":
+            currency[codepoint] = " "
+        elif category.startswith("P"):
+            punctuation[codepoint] = " "
+    return accents, currency, punctuation
+
+
+_ACCENTS, _CURRENCY, _PUNCTUATION = _build_tables()
+
+# One merged table per option combination: (fold_accents, strip_currency, strip_punctuation)
+_TABLES = {}
+for _fold in (False, True):
+    for _currency in (False, True):
+        for _punct in (False, True):
+            _table = {}
+            if _fold:
+                _table.update(_ACCENTS)
+            if _currency:
+                _table.update(_CURRENCY)
+            if _punct:
+                _table.update(_PUNCTUATION)
+            _TABLES[(_fold, _currency, _punct)] = _table
 
-def normalize_text(text: str) -> str:
+
+def normalize_text(
+    text: str,
+    fold_accents: bool = True,
+    strip_currency: bool = False,
+    strip_punctuation: bool = False,
+) -> str:
     """
-    Normalizes a string by converting it to lowercase and stripping whitespace.
+    Normalizes a string in a single stage.
+
+    Applies NFKC, lowercases, optionally folds accents ("cómputo" -> "computo"),
+    optionally replaces currency symbols and punctuation with spaces, and
+    collapses runs of whitespace.
     """
     if not text:
         return ""
-    return text.lower().strip()
+    text = unicodedata.normalize("NFKC", text).lower()
+    table = _TABLES[(fold_accents, strip_currency, strip_punctuation)]
+    if table:
+        text = text.translate(table)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def normalize_for_matching(text: str, normalized: bool = False) -> str:
+    """
+    Normalizes a string for provider/keyword matching: accents folded and
+    currency symbols and punctuation removed.
+
+    With normalized=True the text already went through normalize_text (as the
+    ingestion stage does), so only the currency and punctuation passes run.
+    """
+    if normalized:
+        if not text:
+            return ""
+        return _WHITESPACE_RE.sub(" ", text.translate(_TABLES[(False, True, True)])).strip()
+    return normalize_text(text, fold_accents=True, strip_currency=True, strip_punctuation=True)
@@ -0,0 +1,199 @@
+"""
+Grabación de tráfico real para pruebas de carga (app.maintenance.loadtest).
+
+Con RECORD_PATH, cada entrada de /process-expense se añade como una línea
+NDJSON: hora de llegada (epoch, comparable entre workers que graban en el
+mismo archivo), usuario seudonimizado, tipo y datos. Los textos se limpian de correos y de secuencias largas de dígitos
+(teléfonos, tarjetas, cuentas); los montos se conservan porque definen qué
+camino sigue cada gasto. Las imágenes, audios y PDF solo se graban con
+RECORD_MEDIA, ya que no se pueden anonimizar.
+
+Con RECORD_LLM_PATH también se graban las respuestas del modelo, indexadas
+por un hash del último mensaje (limpio), para que el servidor falso
+(app.maintenance.fake_llm) las repita en lugar de inventarlas.
+
+Las líneas se escriben desde un hilo en segundo plano por archivo: grabar
+desde un manejador asíncrono o desde el bucle de IA no espera al disco.
+
+El usuario se reemplaza por un HMAC con RECORD_SALT: el mismo usuario recibe
+el mismo seudónimo dentro de una grabación (se conserva la distribución por
+usuario) sin que se pueda recuperar el ID original. Sin RECORD_SALT se usa
+una sal aleatoria por proceso.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config import config
+from app.schema.base import RawInput
+
+logger = logging.getLogger(__name__)
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+# 9 dígitos o más (con espacios o guiones): teléfonos, tarjetas, cuentas. Los montos son más
+# cortos y las fechas ISO se respetan
+_LONG_NUMBER = re.compile(r"(?<![\d-])(?!\d{4}-\d{1,2}-\d{1,2}(?![\d-]))\d(?:[\d \-]{7,}\d)")
+
+_salt = (config.RECORD_SALT or os.urandom(16).hex()).encode("utf-8")
+
+
+def scrub(text: str) -> str:
+    """
+    Quita correos y números largos de un texto, conservando su forma y longitud aproximada.
+    """
+    text = _EMAIL.sub("user@example.com", text)
+    return _LONG_NUMBER.sub(lambda m: re.sub(r"\d", "0", m.group(0)), text)
+
+
+def pseudonym(user_id: str) -> str:
+    return "u" + hmac.new(_salt, user_id.encode("utf-8"), hashlib.sha256).hexdigest()[:12]
+
+
+def message_key(content: str) -> str:
+    """
+    Clave de una respuesta grabada: hash del contenido limpio del último mensaje.
+    """
+    return hashlib.sha256(scrub(content).encode("utf-8")).hexdigest()[:32]
+
+
+# Líneas pendientes por grabación; si el disco no da abasto se descartan en lugar de crecer sin límite
+_MAX_PENDING = 10000
+
+_STOP = None
+
+
+class _Recorder:
+    """
+    Escritor NDJSON de solo añadir.
+
+    write() solo encola la línea: la serialización y la escritura en disco las
+    hace un hilo en segundo plano, así que grabar no bloquea el bucle de eventos
+    del llamador (el de FastAPI o el de IA). Las líneas que llegan juntas se
+    escriben con un solo flush.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=_MAX_PENDING)
+        self._thread = threading.Thread(target=self._run, name="recording-writer", daemon=True)
+        self._thread.start()
+        self.lines = 0
+        self.dropped = 0
+
+    def write(self, line: Dict[str, Any]) -> None:
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        fh = None
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for line in batch:
+                if line is _STOP:
+                    stop = True
+                    break
+                lines.append(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+            if not lines:
+                continue
+            try:
+                if fh is None:
+                    fh = open(self.path, "a", encoding="utf-8")
+                fh.write("".join(lines))
+                fh.flush()
+                self.lines += len(lines)
+            except OSError as e:
+                logger.warning(f"No se pudo escribir la grabación en {self.path}: {e}")
+        if fh is not None:
+            fh.close()
+
+    def close(self) -> None:
+        """
+        Escribe las líneas pendientes y cierra el archivo.
+        """
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5)
+
+
+_inputs: Optional[_Recorder] = None
+_llm: Optional[_Recorder] = None
+_recorders_lock = threading.Lock()
+
+
+def _get(path: str, current: Optional[_Recorder]) -> Optional[_Recorder]:
+    if not path:
+        return None
+    if current is None or current.path != path:
+        if current is not None:
+            current.close()
+        current = _Recorder(path)
+    return current
+
+
+def record_input(raw_input: RawInput) -> None:
+    """
+    Graba una entrada anonimizada si RECORD_PATH está configurado.
+    """
+    global _inputs
+    if not config.RECORD_PATH:
+        return
+    if raw_input.input_type != "text" and not config.RECORD_MEDIA:
+        return
+    with _recorders_lock:
+        _inputs = _get(config.RECORD_PATH, _inputs)
+        recorder = _inputs
+    data = scrub(raw_input.data) if raw_input.input_type == "text" else raw_input.data
+    recorder.write({
+        "t": round(time.time(), 3),
+        "user_id": pseudonym(raw_input.user_id),
+        "type": raw_input.input_type,
+        "data": data,
+    })
+
+
+def record_llm(messages: List[Dict[str, str]], content: str) -> None:
+    """
+    Graba la respuesta del modelo a una conversación si RECORD_LLM_PATH está configurado.
+    """
+    global _llm
+    if not config.RECORD_LLM_PATH or not messages:
+        return
+    with _recorders_lock:
+        _llm = _get(config.RECORD_LLM_PATH, _llm)
+        recorder = _llm
+    recorder.write({"key": message_key(messages[-1].get("content") or ""), "content": scrub(content)})
+
+
+def get_stats() -> Dict[str, int]:
+    return {
+        "inputs": _inputs.lines if _inputs else 0,
+        "llm_responses": _llm.lines if _llm else 0,
+        "dropped": sum(recorder.dropped for recorder in (_inputs, _llm) if recorder is not None),
+    }
+
+
+def shutdown() -> None:
+    """
+    Escribe lo pendiente y detiene los hilos de grabación.
+    """
+    global _inputs, _llm
+    with _recorders_lock:
+        recorders, _inputs, _llm = (_inputs, _llm), None, None
+    for recorder in recorders:
+        if recorder is not None:
+            recorder.close()
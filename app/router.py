@@ -3,70 +3,165 @@ Enrutador principal de la aplicación.
 
 Orquesta todo el flujo de trabajo de procesamiento de gastos, desde la entrada hasta la persistencia.
 """
+import asyncio
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
-from app.schema.base import RawInput, ProvisionalExpense, FinalExpense, ExpenseStatus
-from app.ingestion import text, image, audio, document
-from app.ai import extractor, classifier
+from app.schema.base import RawInput, ExtractedExpense, ProvisionalExpense, FinalExpense, ExpenseStatus
+from app.ingestion import text, image, audio, document, executor as ingestion_executor
+from app.ai import client, extractor, classifier, categorizer
+from app.ai.admission import Priority
 from app.preprocessing import matcher
-from app.persistence import repositories
+from app.preprocessing.language_detect import detect_language
+from app.preprocessing.normalize_text import normalize_for_matching, normalize_text
+from app.persistence import repositories, writer as expense_writer
+from app.persistence.dedup import DuplicateExpenseError
+from app.persistence.db import (
+    async_session_scope, dispose_async_engine, get_write_executor, session_scope, shutdown_write_executor,
+    write_session_scope,
+)
+from app.pipeline import Job, Pipeline, Stage
+from app.config import config
+from app import metrics
 from sqlalchemy.orm import Session
 
 logger = logging.getLogger(__name__)
 
-def process_expense_input(db: Session, raw_input: RawInput) -> FinalExpense:
-    """
-    Pipeline completo para procesar una entrada sin procesar.
+_PROCESSING_SECONDS = metrics.Histogram(
+    "expense_processing_seconds",
+    "Tiempo total de una entrada en el pipeline; outcome stored, review, prepared, duplicate o error.",
+    ["outcome"],
+)
+_MATCH_SECONDS = metrics.Histogram(
+    "expense_match_seconds", "Duración de la coincidencia determinística y del categorizador aprendido."
+)
+_MATCH_TOTAL = metrics.Counter(
+    "expense_match_total", "Descripciones por tipo de coincidencia (none si no hubo).", ["match_type"]
+)
+
+# La detección de idioma solo necesita el comienzo del texto (un OCR puede ser largo)
+_LANGUAGE_SAMPLE_CHARS = 500
 
+def _ingest(raw_input: RawInput) -> str:
+    """
     1. Ingestión: Convertir la entrada (texto, imagen, etc.) en texto sin procesar.
-    2. Extracción por IA: Analizar el texto sin procesar en datos estructurados.
-    3. Clasificación/Auditoría por IA: Validar y categorizar el gasto.
-    4. Persistencia: Guardar el gasto final confirmado en la base de datos.
     """
-    logger.info(f"El enrutador está procesando la entrada para el usuario {raw_input.user_id} de tipo {raw_input.input_type}")
-
-    # 1. Ingestión
-    raw_text = ""
     if raw_input.input_type == "text":
-        raw_text = text.process_text_input(raw_input.data)
+        return text.process_text_input(raw_input.data)
     elif raw_input.input_type == "image":
         # En una aplicación real, los datos serían bytes, no una ruta de cadena
-        raw_text = image.process_image_input(raw_input.data.encode()) 
+        return image.process_image_input(raw_input.data.encode())
     elif raw_input.input_type == "audio":
-        raw_text = audio.process_audio_input(raw_input.data.encode())
+        return audio.process_audio_input(raw_input.data.encode())
     elif raw_input.input_type == "document":
-        raw_text = document.process_document_input(raw_input.data.encode())
+        return document.process_document_input(raw_input.data.encode())
     else:
         raise ValueError(f"Tipo de entrada no soportado: {raw_input.input_type}")
 
-    if not raw_text:
-        logger.error("La fase de ingestión resultó en un texto vacío. Abortando.")
-        # Podríamos querer devolver un estado específico aquí
-        return None
+def _match_expense(raw_input: RawInput, extracted_data: ExtractedExpense, description_normalized: bool = False):
+    """
+    Paso 3 (preparación): gasto provisional y coincidencia determinística.
 
-    # 2. Extracción por IA
-    extracted_data = extractor.extract_expense_data(raw_text)
+    description_normalized indica que la descripción es un fragmento del texto
+    ya normalizado en la ingestión (camino rápido), así que no se repite la normalización.
+
+    Returns:
+        Una tupla (gasto provisional, metadatos del matcher), o None si la
+        extracción no encontró los datos clave.
+    """
     if not extracted_data.amount or not extracted_data.description:
         logger.error("La extracción por IA no pudo encontrar detalles clave. Abortando.")
         return None
 
-    # 3. Clasificación y Confirmación por IA (simplificado)
     # En un bot real, presentarías esto al usuario para su confirmación.
     provisional_expense = ProvisionalExpense(
         user_id=raw_input.user_id,
         extracted_data=extracted_data,
-        confidence_score=0.0 # Será establecido por el clasificador
+        confidence_score=0.0, # Será establecido por el clasificador
+        processing_method="ai_inference"
     )
-    
-    audited_expense = classifier.classify_and_audit(provisional_expense)
-    
+
     # 3.5 Coincidencia Determinística (Fase 3)
     # Enriquecer los datos con categorías de proveedores/palabras clave si están disponibles
-    match_metadata = matcher.get_metadata_from_match(extracted_data.description)
-    
+    # La descripción se normaliza a lo sumo una vez y el matcher la usa tal cual
+    # Sin coincidencia en la configuración, se consulta el categorizador aprendido del historial
+    with _MATCH_SECONDS.time():
+        desc_norm = normalize_for_matching(extracted_data.description, normalized=description_normalized)
+        match_metadata = (
+            matcher.get_metadata_from_match(desc_norm, normalized=True)
+            or categorizer.get_metadata(desc_norm, raw_input.user_id, normalized=True)
+        )
+    _MATCH_TOTAL.inc((match_metadata or {}).get("match_type") or "none")
+    return provisional_expense, match_metadata
+
+def _amount_stats_filter(match_metadata: Optional[dict]) -> Optional[dict]:
+    """
+    Filtro del historial de montos: el proveedor reconocido o, si no, la categoría.
+    """
+    if not match_metadata:
+        return None
+    if match_metadata.get("match_type") in ("provider", "fuzzy_provider"):
+        return {"provider_name": match_metadata["matched_name"]}
+    if match_metadata.get("category"):
+        return {"category": match_metadata["category"]}
+    return None
+
+def _prepare_classification(
+    db: Session, raw_input: RawInput, extracted_data: ExtractedExpense, description_normalized: bool = False
+):
+    """
+    Paso 3 (preparación): coincidencia determinística e historial de montos del usuario.
+
+    Returns:
+        Una tupla (gasto provisional, metadatos del matcher, estadísticas de montos),
+        o None si la extracción no encontró los datos clave.
+    """
+    matched = _match_expense(raw_input, extracted_data, description_normalized)
+    if matched is None:
+        return None
+    provisional_expense, match_metadata = matched
+
+    # Montos habituales del usuario para el proveedor (o la categoría) reconocidos
+    amount_stats = None
+    filters = _amount_stats_filter(match_metadata)
+    if filters:
+        amount_stats = repositories.get_amount_stats(db, raw_input.user_id, **filters)
+
+    return provisional_expense, match_metadata, amount_stats
+
+async def _aprepare_classification(
+    raw_input: RawInput, extracted_data: ExtractedExpense, description_normalized: bool = False
+):
+    """
+    Versión de _prepare_classification con el motor asíncrono: solo la coincidencia usa un hilo.
+    """
+    matched = await asyncio.get_running_loop().run_in_executor(
+        _db_pool, _match_expense, raw_input, extracted_data, description_normalized
+    )
+    if matched is None:
+        return None
+    provisional_expense, match_metadata = matched
+
+    amount_stats = None
+    filters = _amount_stats_filter(match_metadata)
+    if filters:
+        async with async_session_scope() as session:
+            amount_stats = await repositories.aget_amount_stats(session, raw_input.user_id, **filters)
+
+    return provisional_expense, match_metadata, amount_stats
+
+def _build_final_expense(raw_input: RawInput, audited_expense: ProvisionalExpense, match_metadata: dict) -> Optional[FinalExpense]:
+    """
+    Paso 4 (decisión): auto-confirma el gasto si la confianza es alta.
+
+    Returns:
+        El gasto final a guardar, o None si requiere confirmación manual.
+    """
     # Por ahora, auto-confirmamos si la confianza es alta.
-    if audited_expense.confidence_score > 0.7:
-        final_expense = FinalExpense(
+    if audited_expense.confidence_score > config.CONFIDENCE_AUTO_CONFIRM:
+        return FinalExpense(
             user_id=audited_expense.user_id,
             provider_name=match_metadata.get("matched_name") or audited_expense.extracted_data.description,
             amount=audited_expense.extracted_data.amount,
@@ -76,15 +171,210 @@ def process_expense_input(db: Session, raw_input: RawInput) -> FinalExpense:
             category=match_metadata.get("category") or audited_expense.category,
             expense_type=match_metadata.get("expense_type") or "personal",
             initial_processing_method=match_metadata.get("match_type") or audited_expense.processing_method,
-            confirmed_by="auto-confirm"
+            confirmed_by="auto-confirm",
+            allow_duplicate=raw_input.allow_duplicate,
         )
-        
-        # 4. Persistencia
-        db_record = repositories.save_final_expense(db, final_expense)
-        logger.info(f"Gasto procesado y guardado con éxito ID {db_record.id}")
-        return db_record
-    
-    else:
-        logger.warning(f"El gasto para el usuario {raw_input.user_id} tiene baja confianza. Esperando confirmación manual.")
-        # Aquí guardarías el gasto provisional y notificarías al usuario
+
+    logger.warning(f"El gasto para el usuario {raw_input.user_id} tiene baja confianza. Esperando confirmación manual.")
+    # Aquí guardarías el gasto provisional y notificarías al usuario
+    return None
+
+def _store(db: Session, raw_input: RawInput, audited_expense: ProvisionalExpense, match_metadata: dict) -> FinalExpense:
+    """
+    Paso 4: auto-confirmación y persistencia.
+    """
+    final_expense = _build_final_expense(raw_input, audited_expense, match_metadata)
+    if final_expense is None:
         return None
+
+    # 4. Persistencia
+    db_record = repositories.save_final_expense(db, final_expense)
+    logger.info(f"Gasto procesado y guardado con éxito ID {db_record.id}")
+    return db_record
+
+# --- Pipeline por etapas ---
+# ingestión (procesos del ejecutor de ingestión) -> extracción (tareas asíncronas) ->
+# clasificación (tareas asíncronas) -> persistencia (escritor agrupado, app.persistence.writer).
+# Todo corre en el bucle de IA; las etapas se conectan con colas acotadas.
+
+_pipeline: Optional[Pipeline] = None
+_db_pool: Optional[ThreadPoolExecutor] = None
+
+def _run_with_session(db: Optional[Session], fn, *args):
+    """
+    Ejecuta fn(session, *args) con la sesión del llamador o con una propia de corta duración.
+    """
+    if db is not None:
+        return fn(db, *args)
+    with session_scope() as session:
+        return fn(session, *args)
+
+def _run_with_write_session(db: Optional[Session], fn, *args):
+    """
+    Como _run_with_session, pero con la sesión de escritura si el llamador no trae la suya.
+    """
+    if db is not None:
+        return fn(db, *args)
+    with write_session_scope() as session:
+        return fn(session, *args)
+
+async def _stage_ingest(job: Job) -> None:
+    if job.raw_input.input_type in ingestion_executor.HANDLERS:
+        # OCR, PDF y audio son pesados: se ejecutan en los procesos del ejecutor de ingestión
+        source_text = await ingestion_executor.get_executor().run(
+            job.raw_input.input_type, job.raw_input.data.encode()
+        )
+        # La normalización común se aplica una sola vez aquí; las etapas siguientes no la repiten
+        job.raw_text = normalize_text(source_text)
+    else:
+        # El texto solo se normaliza: enviarlo a otro proceso costaría más que hacerlo aquí
+        source_text = job.raw_input.data
+        job.raw_text = _ingest(job.raw_input)
+    # El idioma se detecta sobre el texto original: los acentos y la ñ ayudan a distinguirlo
+    job.language = detect_language((source_text or "")[:_LANGUAGE_SAMPLE_CHARS])
+    if not job.raw_text:
+        logger.error("La fase de ingestión resultó en un texto vacío. Abortando.")
+        job.finish(None)
+
+async def _stage_extract(job: Job) -> None:
+    # job.raw_text ya está normalizado: el camino rápido y la clave de caché lo usan tal cual.
+    # El idioma detectado en la ingestión se indica al modelo
+    job.extracted_data, source = await extractor.aextract_with_source(
+        job.raw_text, job.raw_input.user_id, job.priority, normalized=True, language=job.language
+    )
+    job.description_normalized = source in extractor.NORMALIZED_SOURCES
+
+async def _stage_classify(job: Job) -> None:
+    if config.DB_ASYNC_ENABLED and job.db is None:
+        prepared = await _aprepare_classification(job.raw_input, job.extracted_data, job.description_normalized)
+    else:
+        # La lectura del historial de montos es bloqueante: se hace fuera del bucle
+        prepared = await asyncio.get_running_loop().run_in_executor(
+            _db_pool, _run_with_session, job.db, _prepare_classification,
+            job.raw_input, job.extracted_data, job.description_normalized,
+        )
+    if prepared is None:
+        job.finish(None)
+        return
+    provisional_expense, job.match_metadata, amount_stats = prepared
+    job.audited_expense = await classifier.aclassify_and_audit(
+        provisional_expense, job.match_metadata, amount_stats, job.priority
+    )
+
+async def _stage_persist(job: Job) -> FinalExpense:
+    if not job.persist:
+        # El llamador agrupa las escrituras (lotes): solo se decide la auto-confirmación
+        return _build_final_expense(job.raw_input, job.audited_expense, job.match_metadata)
+    if config.WRITER_ENABLED and job.db is None:
+        final_expense = _build_final_expense(job.raw_input, job.audited_expense, job.match_metadata)
+        if final_expense is None:
+            return None
+        # Confirmación agrupada: el gasto se guarda junto con los que llegan a la vez
+        saved = await expense_writer.get_writer().save(final_expense)
+        if saved.duplicate:
+            raise DuplicateExpenseError(saved.expense_id)
+        logger.info(f"Gasto procesado y guardado con éxito ID {saved.expense_id}")
+        return saved
+    return await asyncio.get_running_loop().run_in_executor(
+        get_write_executor(), _run_with_write_session, job.db, _store, job.raw_input, job.audited_expense, job.match_metadata
+    )
+
+def _get_pipeline() -> Pipeline:
+    global _pipeline, _db_pool
+    if _pipeline is None:
+        _db_pool = ThreadPoolExecutor(max_workers=config.PIPELINE_CLASSIFY_WORKERS, thread_name_prefix="classify-db")
+        queue_size = config.PIPELINE_QUEUE_SIZE
+        _pipeline = Pipeline("expenses", [
+            # El doble de trabajadores que procesos: mientras unos esperan un OCR, los textos siguen fluyendo
+            Stage("ingest", _stage_ingest, config.PIPELINE_INGEST_WORKERS * 2, queue_size),
+            Stage("extract", _stage_extract, config.PIPELINE_EXTRACT_WORKERS, queue_size),
+            Stage("classify", _stage_classify, config.PIPELINE_CLASSIFY_WORKERS, queue_size),
+            # Varios trabajadores esperando al escritor agrupado para que sus gastos compartan transacción
+            Stage("persist", _stage_persist, config.WRITER_MAX_BATCH if config.WRITER_ENABLED else 1, queue_size),
+        ])
+    return _pipeline
+
+async def _submit(db: Optional[Session], raw_input: RawInput, priority: Priority, persist: bool = True) -> FinalExpense:
+    job = Job(db=db, raw_input=raw_input, priority=priority, persist=persist)
+    outcome = "error"
+    try:
+        result = await _get_pipeline().submit(job)
+        outcome = "review" if result is None else "stored" if persist else "prepared"
+        return result
+    except DuplicateExpenseError:
+        outcome = "duplicate"
+        raise
+    finally:
+        _PROCESSING_SECONDS.observe(time.monotonic() - job.started_at, outcome)
+
+def get_pipeline_stats() -> dict:
+    """
+    Profundidad de cola, trabajos en curso y contadores de cada etapa del pipeline.
+    """
+    if _pipeline is None:
+        return {}
+    stats = _pipeline.get_stats()
+    stats["ingest"]["processes"] = ingestion_executor.get_executor().get_stats()
+    stats["persist"]["writer"] = expense_writer.get_stats()
+    return stats
+
+def shutdown_pipeline() -> None:
+    """
+    Detiene los trabajadores del pipeline y sus pools de procesos e hilos.
+    """
+    global _pipeline, _db_pool
+    if _pipeline is None:
+        return
+    try:
+        client.run_sync(_pipeline.stop())
+        # Confirma los gastos que quedan en el búfer del escritor agrupado
+        client.run_sync(expense_writer.shutdown())
+        # Las conexiones asíncronas del historial de montos pertenecen al bucle de IA
+        client.run_sync(dispose_async_engine())
+    except Exception as e:
+        logger.warning(f"Error al detener el pipeline: {e}")
+    ingestion_executor.shutdown()
+    _db_pool.shutdown(wait=True)
+    shutdown_write_executor()
+    _pipeline = _db_pool = None
+
+def process_expense_input(db: Optional[Session], raw_input: RawInput, priority: Priority = Priority.INTERACTIVE) -> FinalExpense:
+    """
+    Pipeline completo para procesar una entrada sin procesar.
+
+    1. Ingestión: Convertir la entrada (texto, imagen, etc.) en texto sin procesar.
+    2. Extracción por IA: Analizar el texto sin procesar en datos estructurados.
+    3. Clasificación/Auditoría por IA: Validar y categorizar el gasto.
+    4. Persistencia: Guardar el gasto final confirmado en la base de datos.
+
+    Envía la entrada al pipeline por etapas y bloquea hasta obtener el resultado.
+    Si db es None, cada etapa usa su propia sesión de corta duración.
+
+    Las llamadas al modelo pasan por el control de admisión con la prioridad
+    indicada: los mensajes interactivos se atienden antes que los trabajos masivos.
+
+    Raises:
+        AdmissionRejected: Si no hay turno para llamar al modelo.
+    """
+    logger.info(f"El enrutador está procesando la entrada para el usuario {raw_input.user_id} de tipo {raw_input.input_type}")
+    return client.run_sync(_submit(db, raw_input, priority))
+
+async def aprocess_expense_input(db: Optional[Session], raw_input: RawInput, priority: Priority = Priority.INTERACTIVE) -> FinalExpense:
+    """
+    Versión asíncrona de process_expense_input.
+
+    Envía la entrada al pipeline y espera el resultado sin bloquear el bucle de
+    eventos, de modo que un worker puede atender otras peticiones mientras tanto.
+    """
+    logger.info(f"El enrutador está procesando la entrada para el usuario {raw_input.user_id} de tipo {raw_input.input_type}")
+    return await client.run_async(_submit(db, raw_input, priority))
+
+async def aprepare_expense_input(raw_input: RawInput, priority: Priority = Priority.BULK) -> Optional[FinalExpense]:
+    """
+    Recorre el pipeline sin guardar el resultado.
+
+    Devuelve el gasto auto-confirmado listo para persistir, o None si requiere
+    revisión manual. Lo usan los lotes, que confirman varios gastos en una sola
+    transacción en lugar de una por gasto.
+    """
+    return await client.run_async(_submit(None, raw_input, priority, persist=False))
@@ -22,6 +22,9 @@ class RawInput(BaseModel):
     user_id: str
     input_type: str = Field(..., alias="type", description="The type of input, e.g., 'text', 'voice', 'image', 'pdf'")
     data: str
+    allow_duplicate: bool = Field(
+        False, description="Store the expense even if an identical one is already recorded (a confirmed repeat purchase)."
+    )
 
 class ExtractedExpense(BaseModel):
     """
@@ -33,6 +36,7 @@ class ExtractedExpense(BaseModel):
     currency: Optional[str] = "MXN"
     expense_date: Optional[date] = None
     description: Optional[str] = None
+    category: Optional[str] = None
     raw_text: str
 
 class ProvisionalExpense(BaseModel):
@@ -78,3 +82,5 @@ class FinalExpense(BaseModel):
     audit_log: List[str] = []
 
     status: ExpenseStatus = ExpenseStatus.CONFIRMED
+    # The user confirmed that an identical, already recorded expense happened again
+    allow_duplicate: bool = False
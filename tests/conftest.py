@@ -0,0 +1,119 @@
+"""
+Fixtures compartidas de las pruebas.
+
+Las variables de entorno se fijan antes de importar la aplicación: la
+configuración se lee una sola vez al importar app.config. Cada sesión usa una
+base SQLite nueva en un directorio temporal, sin caché persistente ni grabación.
+"""
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+
+_TMP_DIR = tempfile.mkdtemp(prefix="expense-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP_DIR, 'expenses.db')}"
+os.environ["OPENAI_API_KEY"] = "test-key"
+os.environ["EXTRACTION_CACHE_PATH"] = ""
+os.environ["CATEGORIZER_MODEL_PATH"] = os.path.join(_TMP_DIR, "categorizer_model.json.gz")
+os.environ["RECORD_PATH"] = ""
+os.environ["RECORD_LLM_PATH"] = ""
+os.environ["METRICS_MULTIPROC_DIR"] = ""
+os.environ["LOG_LEVEL"] = "WARNING"
+
+import httpx
+import pytest
+import uvicorn
+
+from app.ai import admission, client, extractor, resilience
+from app.ai import cache as extraction_cache
+from app.config import config
+from app.maintenance import fake_llm
+from app.persistence import repositories
+
+
+class FakeLLMServer:
+    """
+    Servidor app.maintenance.fake_llm en un hilo, en un puerto libre.
+    """
+
+    def __init__(self, **options):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{self.port}/v1"
+        self._server = uvicorn.Server(uvicorn.Config(
+            fake_llm.create_app(**options), host="127.0.0.1", port=self.port, log_level="warning"
+        ))
+        self._thread = threading.Thread(target=self._server.run, name="fake-llm", daemon=True)
+
+    def start(self) -> "FakeLLMServer":
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("El servidor de pruebas no arrancó.")
+            time.sleep(0.01)
+        return self
+
+    def stats(self) -> dict:
+        return httpx.get(f"http://127.0.0.1:{self.port}/stats").json()
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+async def _stop_admission() -> None:
+    dispatcher = admission._controller._dispatcher
+    if dispatcher is not None and not dispatcher.done():
+        dispatcher.cancel()
+        await asyncio.gather(dispatcher, return_exceptions=True)
+
+
+def reset_ai_state() -> None:
+    """
+    Cierra el bucle de IA y descarta el estado ligado a él (cliente HTTP,
+    admisión, micro-lotes, interruptores), para que la siguiente prueba lo
+    cree de nuevo con su configuración.
+    """
+    if admission._controller is not None and client._loop is not None:
+        client.run_sync(_stop_admission())
+    client.shutdown()
+    admission._controller = None
+    extractor._batcher = None
+    extraction_cache.shutdown()
+    resilience._callers.clear()
+
+
+@pytest.fixture(scope="session")
+def database():
+    repositories.create_tables()
+    return config.DATABASE_URL
+
+
+@pytest.fixture
+def fake_llm_server(monkeypatch):
+    """
+    Fábrica de servidores falsos: fake_llm_server(latency_ms=50) arranca uno y
+    apunta el cliente de IA hacia él. Se detienen al terminar la prueba.
+    """
+    servers = []
+
+    def start(**options) -> FakeLLMServer:
+        options.setdefault("latency_sigma", 0.0)
+        server = FakeLLMServer(**options).start()
+        servers.append(server)
+        monkeypatch.setattr(config, "OPENAI_BASE_URL", server.base_url)
+        return server
+
+    # Solo el LLM: sin camino rápido, caché ni micro-lotes que lo eviten
+    monkeypatch.setattr(config, "FAST_PATH_ENABLED", False)
+    monkeypatch.setattr(config, "EXTRACTION_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "AI_BATCH_ENABLED", False)
+    reset_ai_state()
+    yield start
+    reset_ai_state()
+    for server in servers:
+        server.stop()
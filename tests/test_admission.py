@@ -0,0 +1,32 @@
+"""
+Control de admisión: cola con prioridades y llamadores diferidos.
+"""
+import asyncio
+
+from app.ai.admission import AdmissionController, Priority
+
+
+def test_cancelled_waiter_frees_room_for_deferred_caller():
+    async def run():
+        controller = AdmissionController(
+            requests_per_minute=1, tokens_per_minute=1e6, user_requests_per_minute=1e6, max_queue=1, max_wait=0
+        )
+        # Sin presupuesto global: las peticiones se quedan en la cola
+        controller.requests.tokens = 0
+        first = asyncio.ensure_future(controller.acquire("u-1", 10, Priority.BULK))
+        await asyncio.sleep(0.01)
+        deferred = asyncio.ensure_future(controller.acquire("u-2", 10, Priority.BULK, defer_if_full=True))
+        await asyncio.sleep(0.01)
+        assert controller.stats["deferred"] == 1
+
+        first.cancel()
+        await asyncio.sleep(0.05)
+        # El hueco del cancelado pasa al llamador diferido, que ya está en la cola
+        queued = list(controller._queues[Priority.BULK])
+
+        deferred.cancel()
+        controller._dispatcher.cancel()
+        await asyncio.gather(first, deferred, controller._dispatcher, return_exceptions=True)
+        return queued
+
+    assert asyncio.run(run()) == ["u-2"]
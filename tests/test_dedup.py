@@ -0,0 +1,65 @@
+"""
+Duplicados exactos: se informan sin guardarse, salvo que el usuario confirme la repetición.
+"""
+from datetime import date
+
+import pytest
+
+from app.persistence import repositories
+from app.persistence.db import session_scope
+from app.persistence.dedup import DuplicateExpenseError
+from app.schema.base import FinalExpense
+
+
+def _expense(user_id: str, **fields) -> FinalExpense:
+    values = dict(
+        user_id=user_id, provider_name="Cafetería", amount=45.0, currency="MXN", expense_date=date(2025, 3, 20),
+        description="cafe americano", category="Food", expense_type="personal",
+        initial_processing_method="test", confirmed_by="test",
+    )
+    values.update(fields)
+    return FinalExpense(**values)
+
+
+def _save(expense: FinalExpense) -> repositories.ExpenseDB:
+    with session_scope() as session:
+        return repositories.save_final_expense(session, expense)
+
+
+def test_exact_duplicate_is_flagged_not_stored(database):
+    original = _save(_expense("u-dup-flag"))
+
+    with pytest.raises(DuplicateExpenseError) as error:
+        _save(_expense("u-dup-flag"))
+
+    assert error.value.existing_id == original.id
+    assert "allow_duplicate" in str(error.value)
+
+
+def test_confirmed_repeat_is_stored_with_its_own_occurrence(database):
+    original = _save(_expense("u-dup-repeat"))
+
+    second = _save(_expense("u-dup-repeat", allow_duplicate=True))
+    third = _save(_expense("u-dup-repeat", allow_duplicate=True))
+
+    assert second.id != original.id and third.id not in (original.id, second.id)
+    assert second.duplicate_of == original.id and third.duplicate_of == original.id
+    assert len({original.fingerprint, second.fingerprint, third.fingerprint}) == 3
+    # Un reenvío sin confirmar sigue detectándose
+    with pytest.raises(DuplicateExpenseError):
+        _save(_expense("u-dup-repeat"))
+
+
+def test_group_save_honors_allow_duplicate(database):
+    expenses = [
+        _expense("u-dup-group"),
+        _expense("u-dup-group"),
+        _expense("u-dup-group", allow_duplicate=True),
+    ]
+
+    with session_scope() as session:
+        first, resent, repeat = repositories.save_final_expenses(session, expenses)
+
+    assert not first.duplicate
+    assert resent.duplicate and resent.expense_id == first.expense_id
+    assert not repeat.duplicate and repeat.duplicate_of == first.expense_id
@@ -0,0 +1,76 @@
+"""
+Extracción asíncrona contra el servidor local compatible con OpenAI (app.maintenance.fake_llm).
+"""
+import asyncio
+import time
+
+from app.ai import extractor
+from app.config import config
+from app.router import aprocess_expense_input, shutdown_pipeline
+from app.schema.base import RawInput
+
+
+def test_aextract_expense_data_reads_fake_llm(fake_llm_server):
+    server = fake_llm_server(latency_ms=20)
+
+    expense = asyncio.run(extractor.aextract_expense_data("cena con amigos 480 mxn", user_id="u-extract"))
+
+    assert expense.amount == 480.0
+    assert expense.currency == "MXN"
+    assert expense.raw_text == "cena con amigos 480 mxn"
+    assert server.stats()["calls"] == 1
+
+
+def test_sync_wrapper_still_works(fake_llm_server):
+    fake_llm_server(latency_ms=20)
+
+    expense = extractor.extract_expense_data("taxi al aeropuerto 12 usd", user_id="u-sync")
+
+    assert expense.amount == 12.0
+    assert expense.currency == "USD"
+
+
+def test_timeout_returns_empty_extraction(fake_llm_server, monkeypatch):
+    monkeypatch.setattr(config, "AI_TIMEOUT", 0.2)
+    monkeypatch.setattr(config, "AI_RETRY_ATTEMPTS", 1)
+    fake_llm_server(latency_ms=2000)
+
+    start = time.monotonic()
+    expense = asyncio.run(extractor.aextract_expense_data("libros 300", user_id="u-timeout"))
+
+    # El tiempo de espera corta la llamada; el gasto queda para revisión manual
+    assert time.monotonic() - start < 1.5
+    assert expense.amount is None
+    assert expense.raw_text == "libros 300"
+
+
+def test_concurrency_is_capped_by_ai_max_concurrency(fake_llm_server, monkeypatch):
+    monkeypatch.setattr(config, "AI_MAX_CONCURRENCY", 2)
+    server = fake_llm_server(latency_ms=150)
+
+    async def extract_all():
+        return await asyncio.gather(*(
+            extractor.aextract_expense_data(f"articulo {100 + index}", user_id=f"u-{index}")
+            for index in range(6)
+        ))
+
+    start = time.monotonic()
+    expenses = asyncio.run(extract_all())
+
+    assert [expense.amount for expense in expenses] == [100.0 + index for index in range(6)]
+    assert server.stats()["max_in_flight"] == 2
+    # Seis llamadas de 150 ms de dos en dos: al menos tres rondas
+    assert time.monotonic() - start >= 0.45
+
+
+def test_aprocess_expense_input_stores_expense(fake_llm_server, database):
+    server = fake_llm_server(latency_ms=20)
+    raw_input = RawInput(user_id="u-pipeline", type="text", data="Cena con amigos 480 MXN")
+
+    try:
+        result = asyncio.run(aprocess_expense_input(db=None, raw_input=raw_input))
+    finally:
+        shutdown_pipeline()
+
+    assert result is not None and result.id
+    assert server.stats()["calls"] >= 1
@@ -0,0 +1,75 @@
+"""
+Camino rápido determinístico: montos, monedas y fechas sin llamar al LLM.
+"""
+from datetime import date
+
+import pytest
+
+from app.ai import fast_path, prompts
+from app.config import config
+
+TODAY = date(2025, 3, 20)
+
+
+@pytest.mark.parametrize("text, amount, currency, description", [
+    ("comida 250 mxn", 250.0, "MXN", "comida"),
+    # Moneda pegada al número
+    ("comida 250mxn", 250.0, "MXN", "comida"),
+    ("cafe 250€", 250.0, "EUR", "cafe"),
+    ("libros 12.50usd", 12.5, "USD", "libros"),
+    ("renta 1,500pesos", 1500.0, "MXN", "renta"),
+])
+def test_amount_and_currency(text, amount, currency, description):
+    result = fast_path.parse(text, today=TODAY)
+
+    assert result.expense.amount == amount
+    assert result.expense.currency == currency
+    assert result.expense.description == description
+    assert result.confidence >= config.FAST_PATH_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("text, amount", [("uber 120", 120.0), ("$45 tacos", 45.0), ("renta 12000", 12000.0)])
+def test_missing_currency_uses_the_same_default_as_the_llm(text, amount):
+    result = fast_path.parse(text, today=TODAY)
+
+    assert result.expense.amount == amount
+    assert result.expense.currency == config.DEFAULT_CURRENCY
+    assert f"assume '{config.DEFAULT_CURRENCY}'" in prompts.EXTRACTOR_PROMPT
+
+
+def test_default_currency_is_configurable(monkeypatch):
+    monkeypatch.setattr(config, "DEFAULT_CURRENCY", "MXN")
+
+    assert fast_path.parse("renta 12000", today=TODAY).expense.currency == "MXN"
+
+
+@pytest.mark.parametrize("text, description", [
+    ("cine 3er piso 120", "cine piso"),
+    ("cerveza 2x1 90", "cerveza"),
+    ("leche 500ml 32", "leche"),
+])
+def test_tokens_with_digits_are_dropped_from_description(text, description):
+    assert fast_path.parse(text, today=TODAY).expense.description == description
+
+
+def test_number_glued_to_a_word_is_not_an_amount():
+    result = fast_path.parse("gasolina 2500abc", today=TODAY)
+
+    assert result.expense.amount is None
+    assert result.confidence == 0.0
+
+
+def test_date_is_not_taken_as_amount():
+    result = fast_path.parse("super 15/03 300", today=TODAY)
+
+    assert result.expense.amount == 300.0
+    assert result.expense.expense_date == date(2025, 3, 15)
+
+
+def test_normalized_input_gives_the_same_result():
+    raw = fast_path.parse("Café 250€ ayer", today=TODAY)
+    normalized = fast_path.parse("cafe 250€ ayer", today=TODAY, normalized=True)
+
+    assert normalized.expense.amount == raw.expense.amount == 250.0
+    assert normalized.expense.description == raw.expense.description == "cafe"
+    assert normalized.expense.expense_date == raw.expense.expense_date == date(2025, 3, 19)
@@ -0,0 +1,48 @@
+"""
+Resumen mensual tras actualizaciones masivas (bulk_update_expenses).
+"""
+from datetime import date
+
+from app.persistence import repositories
+from app.persistence.db import session_scope
+from app.schema.base import FinalExpense
+
+
+def _store(user_id: str, amount: float, category: str = "Food") -> int:
+    expense = FinalExpense(
+        user_id=user_id, provider_name="Super", amount=amount, currency="MXN", expense_date=date(2025, 4, 10),
+        description=f"compra {category.lower()} {amount}", category=category, expense_type="personal",
+        initial_processing_method="test", confirmed_by="test",
+    )
+    with session_scope() as session:
+        return repositories.save_final_expense(session, expense).id
+
+
+def _totals(user_id: str) -> dict:
+    with session_scope() as session:
+        return {row["category"]: (row["total"], row["count"]) for row in repositories.get_monthly_totals(session, user_id)}
+
+
+def test_updates_outside_the_rollup_skip_the_refresh(database, monkeypatch):
+    expense_id = _store("u-rollup-skip", 100.0)
+    refreshed = []
+    monkeypatch.setattr(repositories, "_refresh_monthly_totals", lambda db, keys: refreshed.append(keys))
+
+    with session_scope() as session:
+        repositories.bulk_update_expenses(session, [
+            {"id": expense_id, "fingerprint": "0" * 32, "subcategory": "Despensa"},
+        ])
+        # Misma categoría que ya tenía: tampoco cambia el resumen
+        repositories.bulk_update_expenses(session, [{"id": expense_id, "category": "Food"}])
+
+    assert refreshed == []
+
+
+def test_category_change_moves_the_rollup(database):
+    first = _store("u-rollup-move", 100.0)
+    _store("u-rollup-move", 50.0)
+
+    with session_scope() as session:
+        repositories.bulk_update_expenses(session, [{"id": first, "category": "Home"}])
+
+    assert _totals("u-rollup-move") == {"Food": (50.0, 1), "Home": (100.0, 1)}
@@ -0,0 +1,46 @@
+"""
+Pipeline por etapas: parada con trabajos en curso y en cola.
+"""
+import asyncio
+
+from app.pipeline import Job, Pipeline, Stage
+
+
+def test_stop_fails_in_flight_and_queued_jobs():
+    async def slow(job: Job) -> str:
+        await asyncio.sleep(10)
+        return "done"
+
+    async def run():
+        pipeline = Pipeline("test-stop", [Stage("slow", slow, workers=1, queue_size=10)])
+        in_flight = asyncio.ensure_future(pipeline.submit(Job()))
+        queued = asyncio.ensure_future(pipeline.submit(Job()))
+        await asyncio.sleep(0.05)
+        await pipeline.stop()
+        return await asyncio.wait_for(asyncio.gather(in_flight, queued, return_exceptions=True), 1)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+
+
+def test_stop_fails_job_waiting_for_next_stage():
+    async def fast(job: Job) -> None:
+        return None
+
+    async def slow(job: Job) -> str:
+        await asyncio.sleep(10)
+        return "done"
+
+    async def run():
+        # La segunda etapa tiene un hueco de cola: el tercer trabajo queda en manos del trabajador de la primera
+        pipeline = Pipeline("test-stop-put", [Stage("fast", fast, 1, 10), Stage("slow", slow, 1, 1)])
+        jobs = [asyncio.ensure_future(pipeline.submit(Job())) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        await pipeline.stop()
+        return await asyncio.wait_for(asyncio.gather(*jobs, return_exceptions=True), 1)
+
+    results = asyncio.run(run())
+
+    assert len(results) == 3
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
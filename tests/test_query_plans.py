@@ -0,0 +1,34 @@
+"""
+Planes de las consultas por usuario sobre la base migrada (EXPLAIN QUERY PLAN de SQLite).
+"""
+import pytest
+
+from app.maintenance import explain_queries
+from app.persistence import db
+
+_EXPECTED_INDEXES = {
+    "date_range": "ix_expenses_user_date",
+    "category_range": "ix_expenses_user_category_date",
+    "totals": "ix_expenses_user_date",
+    "category_totals": "ix_expenses_user_date",
+    "recent": "ix_expenses_user_confirmed_at",
+}
+
+
+@pytest.fixture(scope="module")
+def plans(database):
+    assert db.engine.dialect.name == "sqlite"
+    with db.engine.connect() as connection:
+        return {name: explain_queries._explain(connection, query) for name, _, query in explain_queries._queries("u-plans")}
+
+
+@pytest.mark.parametrize("name, index", sorted(_EXPECTED_INDEXES.items()))
+def test_query_uses_its_index(plans, name, index):
+    plan = plans[name]
+
+    assert any(f"USING INDEX {index}" in line or f"USING COVERING INDEX {index}" in line for line in plan), plan
+    assert not explain_queries._full_scan("sqlite", plan), plan
+
+
+def test_monthly_totals_use_the_primary_key(plans):
+    assert not explain_queries._full_scan("sqlite", plans["monthly_totals"]), plans["monthly_totals"]
@@ -0,0 +1,170 @@
+"""
+Envoltura resiliente contra un proveedor simulado que inyecta fallos.
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app import metrics
+from app.ai import resilience
+from app.ai.resilience import CircuitBreaker, CircuitOpenError, ResilientCaller
+
+
+class FaultyProvider:
+    """
+    Proveedor simulado: devuelve los fallos de `faults` en orden y después responde bien.
+    """
+
+    def __init__(self, *faults, latency: float = 0.0, hedge_latency: float = 0.0):
+        self.faults = list(faults)
+        self.latency = latency
+        self.hedge_latency = hedge_latency
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        call = self.calls
+        resilience.mark_dispatched()
+        await asyncio.sleep(self.latency if call == 1 or not self.hedge_latency else self.hedge_latency)
+        if self.faults:
+            raise self.faults.pop(0)
+        return f"ok-{call}"
+
+
+def _status_error(status: int, headers=None) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://provider.test/chat/completions")
+    response = httpx.Response(status, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"HTTP {status}", request=request, response=response)
+
+
+def _caller(name="test", attempts=3, threshold=5, reset_timeout=60.0, **options) -> ResilientCaller:
+    caller = ResilientCaller(
+        name, max_attempts=attempts, base_delay=0.001, max_delay=0.5,
+        breaker=CircuitBreaker(threshold, reset_timeout), **options
+    )
+    resilience._callers[name] = caller
+    return caller
+
+
+@pytest.fixture(autouse=True)
+def _clean_callers():
+    resilience._callers.clear()
+    yield
+    resilience._callers.clear()
+
+
+def test_transient_errors_are_retried():
+    caller = _caller()
+    provider = FaultyProvider(_status_error(500), httpx.ConnectError("sin conexión"))
+
+    assert asyncio.run(caller.call(provider)) == "ok-3"
+    assert caller.metrics["retries"] == 2
+    assert caller.metrics["successes"] == 1
+    assert caller.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retry_after_is_honored():
+    caller = _caller()
+    provider = FaultyProvider(_status_error(429, {"Retry-After": "0.05"}))
+
+    assert asyncio.run(caller.call(provider)) == "ok-2"
+    assert caller.metrics["retry_after_honored"] == 1
+
+
+def test_circuit_opens_and_rejects():
+    caller = _caller(attempts=1, threshold=2)
+    provider = FaultyProvider(*(_status_error(503) for _ in range(5)))
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                await caller.call(provider)
+        with pytest.raises(CircuitOpenError):
+            await caller.call(provider)
+
+    asyncio.run(run())
+    assert provider.calls == 2
+    assert caller.breaker.state == CircuitBreaker.OPEN
+    assert caller.metrics["circuit_opened"] == 1
+    assert caller.metrics["circuit_rejections"] == 1
+
+
+def test_client_error_does_not_close_half_open_circuit():
+    caller = _caller(attempts=1, threshold=1, reset_timeout=0.0)
+    provider = FaultyProvider(_status_error(503), _status_error(400))
+
+    async def run():
+        with pytest.raises(httpx.HTTPStatusError):
+            await caller.call(provider)
+        # La sonda recibe un 400: no dice nada del proveedor
+        with pytest.raises(httpx.HTTPStatusError):
+            await caller.call(provider)
+
+    asyncio.run(run())
+    assert caller.breaker.state == CircuitBreaker.HALF_OPEN
+    # La sonda quedó libre: la siguiente llamada pasa y cierra el circuito
+    assert asyncio.run(caller.call(provider)) == "ok-3"
+    assert caller.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_slow_call_is_hedged():
+    caller = _caller(hedge_enabled=True, hedge_min_samples=3)
+    for _ in range(3):
+        caller.latencies.add(0.01)
+    provider = FaultyProvider(latency=1.0, hedge_latency=0.01)
+
+    assert asyncio.run(caller.call(provider)) == "ok-2"
+    assert caller.metrics["hedges_launched"] == 1
+    assert caller.metrics["hedges_won"] == 1
+
+
+def test_wait_before_dispatch_does_not_trigger_hedge():
+    caller = _caller(hedge_enabled=True, hedge_min_samples=3)
+    for _ in range(3):
+        caller.latencies.add(0.01)
+    slot = asyncio.Semaphore(1)
+
+    async def queued_call():
+        # Como client.chat_completion: espera turno y entonces sale hacia el proveedor
+        async with slot:
+            resilience.mark_dispatched()
+            await asyncio.sleep(0.005)
+            return "ok"
+
+    async def run():
+        async with slot:
+            task = asyncio.ensure_future(caller.call(queued_call))
+            await asyncio.sleep(0.2)
+        return await task
+
+    assert asyncio.run(run()) == "ok"
+    assert caller.metrics["hedges_launched"] == 0
+    assert max(caller.latencies._samples) < 0.1
+
+
+def test_hedge_refused_by_gate_waits_for_primary():
+    refused = []
+
+    def gate(tokens: int) -> bool:
+        refused.append(tokens)
+        return False
+
+    caller = _caller(hedge_enabled=True, hedge_min_samples=3, hedge_gate=gate)
+    for _ in range(3):
+        caller.latencies.add(0.01)
+    provider = FaultyProvider(latency=0.1)
+
+    assert asyncio.run(caller.call(provider, tokens=500)) == "ok-1"
+    assert refused == [500]
+    assert provider.calls == 1
+    assert caller.metrics["hedges_skipped"] == 1
+
+
+def test_events_are_exported_as_metrics():
+    caller = _caller(name="exported")
+    asyncio.run(caller.call(FaultyProvider(_status_error(502))))
+
+    exposition = metrics.generate_latest()
+    assert 'expense_ai_resilience_total{caller="exported",event="retries"} 1' in exposition
+    assert resilience.get_stats()["exported"]["successes"] == 1